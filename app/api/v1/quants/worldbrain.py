@@ -1,7 +1,9 @@
 from bc_fastkit.api import CRUDRequestHandler, create_commit_session_router
+from fastapi import Body
 
 from app import crud, schema
 from app.core.db import SessionDep
+from app.services.quants.hash_index import persistent_hash_index
 from app.services.quants.worldbrain import wqb_client
 
 router = create_commit_session_router()
@@ -47,6 +49,23 @@ class WqbAlphaTemplateTaskRequest(CRUDRequestHandler):
     pass
 
 
+@router.post("/wqb/alpha/might-exist")
+async def alpha_might_exist(
+    db: SessionDep, expression: str = Body(), settings: dict = Body()
+):
+    """布隆过滤器判断表达式 + 设置是否可能已存在，False 表示截至上次同步的已提交行中不存在
+
+    索引按 id 增量同步，run.py -s rehash 原地重算哈希后会删除并全量重建
+    """
+    expression_hash = crud.quants_wqb_alpha_handler.generate_expression_hash(
+        db, expression=expression, settings=settings
+    )
+    return {
+        "expressionHash": expression_hash,
+        "mightExist": expression_hash in persistent_hash_index(db),
+    }
+
+
 @router.get("/wqb/operator-list", response_model=schema.quants_wqb_operator_schema.QR)
 async def get_wqb_operator_list(db: SessionDep):
     data, total = crud.quants_wqb_operator_handler.search_limit(db, {})
@@ -0,0 +1,460 @@
+"""FASTEXPR 表达式的词法、语法解析
+
+解析结果是由 NamedTuple 组成的不可变 AST，可直接哈希、比较，
+同一表达式字符串通过 parse_expression 的 LRU 缓存只解析一次。
+"""
+
+import re
+import sys
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional, Tuple, Union
+
+PARSE_CACHE_SIZE = 1 << 16
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<op>==|!=|<=|>=|&&|\|\||[-+*/^<>!?:=(),;])
+    """,
+    re.VERBOSE,
+)
+
+# 二元运算符优先级，数值越大结合越紧
+BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "==": 3,
+    "!=": 3,
+    "<": 3,
+    "<=": 3,
+    ">": 3,
+    ">=": 3,
+    "+": 4,
+    "-": 4,
+    "*": 5,
+    "/": 5,
+    "^": 7,
+}
+UNARY_PRECEDENCE = 6
+TERNARY_PRECEDENCE = 0
+
+
+class ExpressionSyntaxError(ValueError):
+    def __init__(self, message: str, expression: str, pos: int):
+        super().__init__(f"{message} at {pos}: {expression!r}")
+        self.expression = expression
+        self.pos = pos
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    pos: int
+
+
+class Num(NamedTuple):
+    value: float
+    text: str
+
+
+class Str(NamedTuple):
+    # 保留引号，避免与同名 Name 节点相等
+    text: str
+
+    @property
+    def value(self) -> str:
+        return self.text[1:-1]
+
+
+class Name(NamedTuple):
+    name: str
+
+
+class Call(NamedTuple):
+    name: str
+    args: Tuple["Node", ...]
+    kwargs: Tuple[Tuple[str, "Node"], ...]
+
+
+class Unary(NamedTuple):
+    op: str
+    operand: "Node"
+
+
+class Binary(NamedTuple):
+    op: str
+    left: "Node"
+    right: "Node"
+
+
+class Ternary(NamedTuple):
+    cond: "Node"
+    then: "Node"
+    otherwise: "Node"
+
+
+class Assign(NamedTuple):
+    name: str
+    value: "Node"
+
+
+class Program(NamedTuple):
+    statements: Tuple["Node", ...]
+
+    @property
+    def result(self) -> "Node":
+        """最后一条语句即表达式的输出"""
+        return self.statements[-1]
+
+
+Node = Union[Num, Str, Name, Call, Unary, Binary, Ternary, Assign, Program]
+
+
+def tokenize(expression: str) -> Iterator[Token]:
+    pos = 0
+    end = len(expression)
+    while pos < end:
+        m = TOKEN_RE.match(expression, pos)
+        if m is None:
+            raise ExpressionSyntaxError(
+                f"unexpected character {expression[pos]!r}", expression, pos
+            )
+        kind = m.lastgroup
+        if kind != "ws":
+            yield Token(kind, sys.intern(m.group()), pos)
+        pos = m.end()
+
+
+class Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = list(tokenize(expression))
+        self.pos = 0
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def error(self, message: str):
+        tok = self.peek()
+        pos = tok.pos if tok else len(self.expression)
+        raise ExpressionSyntaxError(message, self.expression, pos)
+
+    def accept(self, text: str) -> bool:
+        tok = self.peek()
+        if tok is not None and tok.kind == "op" and tok.text == text:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, text: str):
+        if not self.accept(text):
+            self.error(f"expected {text!r}")
+
+    def is_assign(self) -> bool:
+        tok, nxt = self.peek(), self.peek(1)
+        return (
+            tok is not None
+            and tok.kind == "name"
+            and nxt is not None
+            and nxt.kind == "op"
+            and nxt.text == "="
+        )
+
+    def parse_program(self) -> Program:
+        statements = []
+        while self.peek() is not None:
+            if self.accept(";"):
+                continue
+            if self.is_assign():
+                name = self.tokens[self.pos].text
+                self.pos += 2
+                statements.append(Assign(name, self.parse_expr()))
+            else:
+                statements.append(self.parse_expr())
+            if self.peek() is not None and not self.accept(";"):
+                self.error("expected ';'")
+        if not statements:
+            self.error("empty expression")
+        return Program(tuple(statements))
+
+    def parse_expr(self, min_prec: int = TERNARY_PRECEDENCE) -> Node:
+        left = self.parse_unary()
+        while True:
+            tok = self.peek()
+            if tok is None or tok.kind != "op":
+                return left
+            if tok.text == "?" and min_prec <= TERNARY_PRECEDENCE:
+                self.pos += 1
+                then = self.parse_expr()
+                self.expect(":")
+                left = Ternary(left, then, self.parse_expr())
+                continue
+            prec = BINARY_PRECEDENCE.get(tok.text)
+            if prec is None or prec < min_prec:
+                return left
+            self.pos += 1
+            # ^ 右结合，其余左结合
+            right = self.parse_expr(prec if tok.text == "^" else prec + 1)
+            left = Binary(tok.text, left, right)
+
+    def parse_unary(self) -> Node:
+        tok = self.peek()
+        if tok is not None and tok.kind == "op" and tok.text in ("-", "+", "!"):
+            self.pos += 1
+            operand = self.parse_expr(UNARY_PRECEDENCE)
+            return Unary(tok.text, operand)
+        return self.parse_primary()
+
+    def parse_primary(self) -> Node:
+        tok = self.peek()
+        if tok is None:
+            self.error("unexpected end of expression")
+        self.pos += 1
+        if tok.kind == "number":
+            return Num(float(tok.text), tok.text)
+        if tok.kind == "string":
+            return Str(tok.text)
+        if tok.kind == "name":
+            if self.accept("("):
+                return self.parse_call(tok.text)
+            return Name(tok.text)
+        if tok.kind == "op" and tok.text == "(":
+            node = self.parse_expr()
+            self.expect(")")
+            return node
+        self.pos -= 1
+        self.error(f"unexpected token {tok.text!r}")
+
+    def parse_call(self, name: str) -> Call:
+        args, kwargs = [], []
+        if not self.accept(")"):
+            while True:
+                if self.is_assign():
+                    key = self.tokens[self.pos].text
+                    self.pos += 2
+                    kwargs.append((key, self.parse_expr()))
+                elif kwargs:
+                    self.error("positional argument after keyword argument")
+                else:
+                    args.append(self.parse_expr())
+                if self.accept(")"):
+                    break
+                self.expect(",")
+        return Call(name, tuple(args), tuple(kwargs))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_expression(expression: str) -> Program:
+    """解析表达式，相同字符串共享同一棵 AST"""
+    return Parser(expression).parse_program()
+
+
+def walk(node: Node) -> Iterator[Node]:
+    """先序遍历所有节点"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, Program):
+            stack.extend(reversed(node.statements))
+        elif isinstance(node, Assign):
+            stack.append(node.value)
+        elif isinstance(node, Call):
+            stack.extend(v for _, v in reversed(node.kwargs))
+            stack.extend(reversed(node.args))
+        elif isinstance(node, Unary):
+            stack.append(node.operand)
+        elif isinstance(node, Binary):
+            stack.extend((node.right, node.left))
+        elif isinstance(node, Ternary):
+            stack.extend((node.otherwise, node.then, node.cond))
+
+
+def iter_calls(node: Node) -> Iterator[Call]:
+    return (n for n in walk(node) if isinstance(n, Call))
+
+
+def iter_names(node: Node) -> Iterator[str]:
+    return (n.name for n in walk(node) if isinstance(n, Name))
+
+
+def _precedence(node: Node) -> int:
+    if isinstance(node, Binary):
+        return BINARY_PRECEDENCE[node.op]
+    if isinstance(node, Ternary):
+        return TERNARY_PRECEDENCE
+    if isinstance(node, Unary):
+        return UNARY_PRECEDENCE
+    return 99
+
+
+def to_source(node: Node) -> str:
+    """把 AST 还原为紧凑的表达式字符串"""
+    if isinstance(node, Program):
+        return ";\n".join(to_source(s) for s in node.statements)
+    if isinstance(node, Assign):
+        return f"{node.name}={to_source(node.value)}"
+    if isinstance(node, Num):
+        return node.text
+    if isinstance(node, Str):
+        return node.text
+    if isinstance(node, Name):
+        return node.name
+    if isinstance(node, Call):
+        parts = [to_source(a) for a in node.args]
+        parts.extend(f"{k}={to_source(v)}" for k, v in node.kwargs)
+        return f"{node.name}({','.join(parts)})"
+    if isinstance(node, Unary):
+        operand = to_source(node.operand)
+        if _precedence(node.operand) < UNARY_PRECEDENCE:
+            operand = f"({operand})"
+        return f"{node.op}{operand}"
+    if isinstance(node, Binary):
+        prec = BINARY_PRECEDENCE[node.op]
+        left, right = to_source(node.left), to_source(node.right)
+        right_assoc = node.op == "^"
+        if _precedence(node.left) < prec + right_assoc:
+            left = f"({left})"
+        if _precedence(node.right) < prec + (not right_assoc):
+            right = f"({right})"
+        return f"{left}{node.op}{right}"
+    if isinstance(node, Ternary):
+        cond = to_source(node.cond)
+        if _precedence(node.cond) <= TERNARY_PRECEDENCE:
+            cond = f"({cond})"
+        return f"{cond}?{to_source(node.then)}:{to_source(node.otherwise)}"
+    raise TypeError(f"unknown node: {node!r}")
+
+
+# 参数顺序无关的操作符，规范化时对参数排序
+COMMUTATIVE_OPERATORS = {"add", "multiply", "max", "min", "and", "or"}
+# 可展开为多参调用的结合律操作符
+VARIADIC_OPERATORS = {"add", "multiply"}
+COMMUTATIVE_INFIX = {"==", "!=", "&&", "||"}
+# 中缀算术与对应的函数形式等价，规范化时统一为函数形式
+INFIX_OPERATORS = {
+    "+": "add",
+    "-": "subtract",
+    "*": "multiply",
+    "/": "divide",
+    "^": "power",
+}
+
+
+def canonical_number(value: float) -> str:
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Canonicalizer:
+    """把 AST 序列化为规范字符串，语义相同的表达式得到相同结果
+
+    defaults: 操作符名 -> {关键字参数: 规范化后的默认值}
+    """
+
+    def __init__(self, defaults: Optional[dict] = None):
+        self.defaults = defaults or {}
+
+    def __call__(self, node: Node) -> str:
+        return self.visit(node)
+
+    def visit(self, node: Node) -> str:
+        if isinstance(node, Program):
+            return ";".join(self.visit(s) for s in node.statements)
+        if isinstance(node, Assign):
+            return f"{node.name.lower()}={self.visit(node.value)}"
+        if isinstance(node, Num):
+            return canonical_number(node.value)
+        if isinstance(node, (Str, Name)):
+            return node[0].lower()
+        if isinstance(node, Call):
+            return self.visit_call(node.name.lower(), node.args, node.kwargs)
+        if isinstance(node, Unary):
+            if node.op == "-" and isinstance(node.operand, Num):
+                return canonical_number(-node.operand.value)
+            if node.op == "+":
+                return self.visit(node.operand)
+            return f"{node.op}({self.visit(node.operand)})"
+        if isinstance(node, Binary):
+            if node.op in INFIX_OPERATORS:
+                return self.visit_call(
+                    INFIX_OPERATORS[node.op], (node.left, node.right), ()
+                )
+            left, right = self.visit(node.left), self.visit(node.right)
+            if node.op in COMMUTATIVE_INFIX and right < left:
+                left, right = right, left
+            return f"({left}{node.op}{right})"
+        if isinstance(node, Ternary):
+            return (
+                f"({self.visit(node.cond)}?{self.visit(node.then)}"
+                f":{self.visit(node.otherwise)})"
+            )
+        raise TypeError(f"unknown node: {node!r}")
+
+    def visit_call(self, name: str, args, kwargs) -> str:
+        defaults = self.defaults.get(name, {})
+        kw = {}
+        for k, v in kwargs:
+            k = k.lower()
+            value = self.visit(v)
+            if defaults.get(k) != value:
+                kw[k] = value
+        if name in VARIADIC_OPERATORS and not kw:
+            args = self.flatten(name, args)
+        parts = [self.visit(a) for a in args]
+        if name in COMMUTATIVE_OPERATORS:
+            parts.sort()
+        parts.extend(f"{k}={kw[k]}" for k in sorted(kw))
+        return f"{name}({','.join(parts)})"
+
+    def flatten(self, name: str, args) -> list:
+        """add(add(a, b), c) -> add(a, b, c)，只展开没有非默认关键字参数的同名调用"""
+        out = []
+        for a in args:
+            inner = None
+            if isinstance(a, Call) and a.name.lower() == name:
+                defaults = self.defaults.get(name, {})
+                if all(defaults.get(k.lower()) == self.visit(v) for k, v in a.kwargs):
+                    inner = a.args
+            elif isinstance(a, Binary) and INFIX_OPERATORS.get(a.op) == name:
+                inner = (a.left, a.right)
+            if inner is None:
+                out.append(a)
+            else:
+                out.extend(self.flatten(name, inner))
+        return out
+
+
+def canonical_expression(expression: str, defaults: Optional[dict] = None) -> str:
+    return Canonicalizer(defaults)(parse_expression(expression))
+
+
+def parse_operator_definition(definition: str) -> Optional[Call]:
+    """解析操作符定义中的调用签名
+
+    ex: "add(x, y, filter = false), x + y" -> Call("add", (x, y), (("filter", false),))
+    无法解析（中缀定义、含非法参数名等）时返回 None
+    """
+    start = definition.find("(")
+    if start <= 0:
+        return None
+    depth = 0
+    for i in range(start, len(definition)):
+        if definition[i] == "(":
+            depth += 1
+        elif definition[i] == ")":
+            depth -= 1
+            if depth == 0:
+                break
+    else:
+        return None
+    try:
+        node = parse_expression(definition[: i + 1].strip()).result
+    except ExpressionSyntaxError:
+        return None
+    return node if isinstance(node, Call) else None
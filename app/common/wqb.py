@@ -8,3 +8,18 @@ NEUTRALIZATION_OPERATORS = [
 COUNTRY_GROUPING_REGIONS = ["ASI", "GLB", "EUR"]
 
 COUNTRY_GROUPING_OPERATOR = "group_cartesian_product(country, {})"
+
+# 参数网格扫描的默认取值
+SWEEP_DECAYS = [0, 2, 4, 6, 8, 10, 15, 20]
+
+SWEEP_TRUNCATIONS = [0.01, 0.03, 0.05, 0.08, 0.1]
+
+# 向量数据字段的归约操作符，第一个为默认
+VECTOR_REDUCTIONS = [
+    "vec_avg",
+    "vec_sum",
+    "vec_max",
+    "vec_min",
+    "vec_count",
+    "vec_stddev",
+]
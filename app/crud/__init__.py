@@ -1,5 +1,6 @@
 from .quants import (
     quants_alpha_template_handler,
+    quants_generation_cursor_handler,
     quants_inspiration_handler,
     quants_wqb_alpha_handler,
     quants_wqb_alpha_task_handler,
@@ -16,4 +17,5 @@ __all__ = [
     "quants_wqb_operator_handler",
     "quants_wqb_data_field_handler",
     "quants_wqb_universe_handler",
+    "quants_generation_cursor_handler",
 ]
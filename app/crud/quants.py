@@ -1,8 +1,13 @@
+from typing import Iterable, Optional, Tuple
+
 from bc_fastkit.crud import CRUDBase
+from sqlalchemy import exists, text, update
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm import Session
 
 from app.models.quants import (
     QuantsAlphaTemplateModel,
+    QuantsGenerationCursorModel,
     QuantsInspirationModel,
     QuantsWqbAlphaModel,
     QuantsWqbAlphaTaskModel,
@@ -12,6 +17,9 @@ from app.models.quants import (
 )
 from app.utils import convert_iso_time_str_to_datetime
 
+# MySQL 唯一键冲突的错误码
+ER_DUP_ENTRY = 1062
+
 
 class CRUDWqbAlphaTemplateTask(CRUDBase):
     def generate_wqb_alpha(self, db, *, id):
@@ -19,6 +27,20 @@ class CRUDWqbAlphaTemplateTask(CRUDBase):
 
 
 class CRUDWqbAlpha(CRUDBase[QuantsWqbAlphaModel]):
+    _operator_defaults: Optional[dict] = None
+
+    def operator_defaults(self, db: Session, refresh: bool = False) -> dict:
+        """操作符关键字参数默认值，进程内只加载一次"""
+        if self._operator_defaults is None or refresh:
+            self._operator_defaults = quants_wqb_operator_handler.get_default_kwargs(db)
+        return self._operator_defaults
+
+    def generate_expression_hash(
+        self, db: Session, *, expression: str, settings: dict
+    ) -> str:
+        return self.model.generate_expression_hash(
+            expression, settings, self.operator_defaults(db)
+        )
 
     def complement_obj_in(self, db: Session, *, obj_in):
         if "expression" in obj_in:
@@ -31,20 +53,124 @@ class CRUDWqbAlpha(CRUDBase[QuantsWqbAlphaModel]):
         if "wqb_data" in obj_in:
             obj_in["sharpe"] = (obj_in["wqb_data"]["is"]["sharpe"],)
             obj_in["fitness"] = obj_in["wqb_data"]["is"]["fitness"]
-        if "settings" in obj_in and "expression" in obj_in:
-            obj_in["expression_hash"] = self.model.generate_expression_hash(
-                obj_in["expression"], obj_in["settings"]
+        if (
+            "settings" in obj_in
+            and "expression" in obj_in
+            and "expression_hash" not in obj_in
+        ):
+            obj_in["expression_hash"] = self.generate_expression_hash(
+                db, expression=obj_in["expression"], settings=obj_in["settings"]
             )
         return super().complement_obj_in(db, obj_in=obj_in)
 
+    def bulk_insert_ignore(
+        self, db: Session, *, objs_in: Iterable[dict], chunk_size: int = 1000
+    ) -> Tuple[int, int]:
+        """多行 INSERT IGNORE 批量写入，expression_hash 重复的行直接跳过
+
+        返回 (插入条数, 未插入条数)，不负责提交事务。IGNORE 同样会把截断、NOT NULL
+        等数据错误降级为警告，重复键以外的警告会打印出来，不计为去重
+        """
+        groups: dict = {}
+        for obj_in in objs_in:
+            row = self.complement_obj_in(db, obj_in=dict(obj_in))
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        inserted = skipped = 0
+        stmt = insert(self.model.__table__).prefix_with("IGNORE")
+        # executemany 要求每行字段一致，按字段集合分组写入
+        for rows in groups.values():
+            for i in range(0, len(rows), chunk_size):
+                chunk = rows[i : i + chunk_size]
+                count = db.execute(stmt, chunk).rowcount
+                inserted += count
+                skipped += len(chunk) - count
+                self.report_insert_warnings(db)
+        return inserted, skipped
+
+    @staticmethod
+    def report_insert_warnings(db: Session):
+        """打印上一条语句中重复键（1062）以外的警告，每种错误码一行"""
+        warnings: dict = {}
+        for _, code, message in db.execute(text("SHOW WARNINGS")):
+            if code != ER_DUP_ENTRY:
+                count, _ = warnings.get(code, (0, message))
+                warnings[code] = (count + 1, message)
+        for code, (count, message) in warnings.items():
+            print(f"INSERT IGNORE warning {code} x{count}: {message}")
+
+    def rehash_expressions(
+        self, db: Session, *, legacy: bool = False, batch_size: int = 2000
+    ) -> int:
+        """按 id 顺序用当前规范化逻辑重算 expression_hash（legacy 时退回 v1 哈希），
+        返回更新条数，不负责提交事务
+
+        与先出现的行语义重复的行改写为 "v2:dup<id>:<原摘要>"，既不占用规范哈希、
+        也不再是旧版哈希，避免唯一键冲突；legacy 时冲突的行保留原哈希
+        """
+        defaults = self.operator_defaults(db, refresh=True)
+        rows = (
+            db.query(
+                self.model.id,
+                self.model.expression,
+                self.model.settings,
+                self.model.expression_hash,
+            )
+            .order_by(self.model.id)
+            .all()
+        )
+        taken = {row.expression_hash for row in rows}
+        updates = []
+        for row in rows:
+            if legacy:
+                new_hash = self.model.generate_legacy_expression_hash(
+                    row.expression, row.settings
+                )
+            else:
+                new_hash = self.model.generate_expression_hash(
+                    row.expression, row.settings, defaults
+                )
+            if new_hash in taken and not legacy:
+                new_hash = (
+                    f"v{self.model.EXPRESSION_HASH_VERSION}:"
+                    f"dup{row.id}:{row.expression_hash[-32:]}"
+                )
+            if new_hash == row.expression_hash or new_hash in taken:
+                continue
+            taken.discard(row.expression_hash)
+            taken.add(new_hash)
+            updates.append({"id": row.id, "expression_hash": new_hash})
+        for i in range(0, len(updates), batch_size):
+            # 按主键的批量 UPDATE
+            db.execute(update(self.model), updates[i : i + batch_size])
+        return len(updates)
+
+    def check_expression_hash_version(self, db: Session):
+        """库中还有旧版哈希时中止：新写入的 v2 哈希与旧哈希永远不相等，唯一键、
+        INSERT IGNORE 与哈希索引都会失去去重作用
+
+        旧版哈希（无前缀的十六进制或更低版本号）按字典序都小于 "v<版本>:"，
+        只需在唯一索引上做一次范围查找
+        """
+        prefix = f"v{self.model.EXPRESSION_HASH_VERSION}:"
+        stale = db.query(exists().where(self.model.expression_hash < prefix)).scalar()
+        if stale:
+            raise RuntimeError(
+                f"quants_wqb_alpha has expression hashes older than {prefix}, "
+                "run `python scripts/run.py -s rehash` first"
+            )
+
     def get_by_expression_and_settings(
         self, db: Session, *, expression: str, settings: dict
     ) -> QuantsWqbAlphaModel | None:
-        expression_hash = self.model.generate_expression_hash(expression, settings)
+        expression_hash = self.generate_expression_hash(
+            db, expression=expression, settings=settings
+        )
         print("Searching for expression hash:", expression_hash)
+        # 尚未执行 rehash 的库中仍是旧版哈希，需要一起匹配
+        legacy_hash = self.model.generate_legacy_expression_hash(expression, settings)
         return (
             db.query(self.model)
-            .filter(self.model.expression_hash == expression_hash)
+            .filter(self.model.expression_hash.in_([expression_hash, legacy_hash]))
             .first()
         )
 
@@ -91,6 +217,16 @@ class CRUDWqbAlpha(CRUDBase[QuantsWqbAlphaModel]):
             return quants_wqb_alpha_handler.create(db, obj_in=obj_in)
 
 
+class CRUDWqbOperator(CRUDBase[QuantsWqbOperatorModel]):
+    def get_default_kwargs(self, db: Session) -> dict:
+        rs = {}
+        for operator in self.search(db, q={}):
+            defaults = operator.default_kwargs
+            if defaults:
+                rs[operator.name.lower()] = defaults
+        return rs
+
+
 class CRUDWqbDataField(CRUDBase[QuantsWqbDataFieldModel]):
     def create_or_update_by_wqb_data(
         self, db: Session, *, data: dict
@@ -133,6 +269,7 @@ quants_inspiration_handler = CRUDBase(QuantsInspirationModel)
 quants_alpha_template_handler = CRUDBase(QuantsAlphaTemplateModel)
 quants_wqb_alpha_handler = CRUDWqbAlpha(QuantsWqbAlphaModel)
 quants_wqb_alpha_task_handler = CRUDWqbAlphaTemplateTask(QuantsWqbAlphaTaskModel)
-quants_wqb_operator_handler = CRUDBase(QuantsWqbOperatorModel)
+quants_wqb_operator_handler = CRUDWqbOperator(QuantsWqbOperatorModel)
 quants_wqb_data_field_handler = CRUDWqbDataField(QuantsWqbDataFieldModel)
 quants_wqb_universe_handler = CRUDBase(QuantsWqbUniverseModel)
+quants_generation_cursor_handler = CRUDBase(QuantsGenerationCursorModel)
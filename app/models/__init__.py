@@ -2,6 +2,7 @@ from bc_fastkit.model import BaseModel
 
 from .quants import (
     QuantsAlphaTemplateModel,
+    QuantsGenerationCursorModel,
     QuantsInspirationModel,
     QuantsWqbAlphaModel,
     QuantsWqbAlphaTaskModel,
@@ -15,4 +16,5 @@ __all__ = [
     "QuantsWqbAlphaTaskModel",
     "BaseModel",
     "QuantsWqbDataFieldModel",
+    "QuantsGenerationCursorModel",
 ]
@@ -1,7 +1,7 @@
 import hashlib
 import json
 import re
-from typing import Set
+from typing import Optional, Set
 
 from bc_fastkit.common.typing import D
 from bc_fastkit.model import (
@@ -17,6 +17,14 @@ from bc_fastkit.model import (
     UniqueConstraint,
     classproperty,
 )
+from sqlalchemy.dialects.mysql import BIGINT, INTEGER
+
+from app.common.expression import (
+    Canonicalizer,
+    ExpressionSyntaxError,
+    canonical_expression,
+    parse_operator_definition,
+)
 
 
 class QuantsInspirationModel(BaseModel):
@@ -53,6 +61,9 @@ class QuantsWqbAlphaTaskModel(BaseModel):
 
 class QuantsWqbAlphaModel(BaseModel):
 
+    # 1: 去空白小写后的字符串 md5（无前缀）; 2: AST 规范化后的 md5
+    EXPRESSION_HASH_VERSION = 2
+
     SETTINGS_HASH_KEYS = (
         "region",
         "universe",
@@ -68,6 +79,8 @@ class QuantsWqbAlphaModel(BaseModel):
 
     STATE_INIT = 0
     STATE_PENDING = 1
+    STATE_SCREEN_REJECTED = 2
+    STATE_SCREENED = 3
     STATE_SIMULATING = 5
     STATE_SIMULATED_FAIL = 8
     STATE_SIMULATED = 10
@@ -75,6 +88,16 @@ class QuantsWqbAlphaModel(BaseModel):
     STATE_CHECKED = 15
     STATE_ACTIVE = 20
 
+    PNL_STATE_FAILED = -1
+    PNL_STATE_MISSING = 0
+    PNL_STATE_STORED = 1
+    # wqb_pnl_data 中还有旧 JSON，由 run.py -s pm 迁移到本地 PnL 库，不重新抓取
+    PNL_STATE_JSON = 2
+
+    # self_corr 算不出相关系数时的取值，在 [-1, 1] 之外
+    SELF_CORR_NO_PEER = -2
+    SELF_CORR_NO_OVERLAP = -3
+
     WQB_TYP_REGULAR = 0
     WQB_TYP_SA = 10
 
@@ -102,8 +125,12 @@ class QuantsWqbAlphaModel(BaseModel):
     fitness = DefaultDecimalColumn(comment="适应度")
     level = DefaultTypeColumn(comment="级别")
     state = DefaultTypeColumn(
-        comment="状态: 0: 初始, 1: 待回测, 5: 测试中, 10: 回测完, 12: 自检完, 15: 审核完, 20: 已激活"
+        comment="状态: 0: 初始, 1: 待回测, 2: 本地预筛淘汰, 3: 本地预筛通过, 5: 测试中, 10: 回测完, 12: 自检完, 15: 审核完, 20: 已激活"
     )
+    screen_reason = NotNullColumn(
+        VARCHAR(255), server_default="", comment="本地预筛淘汰/跳过原因"
+    )
+    local_data = DefaultJsonColumn(server_default={}, comment="本地预筛回测指标")
     # wqb_simulate_id = NotNullColumn(VARCHAR(63),server_defaul index=True, comment="世坤模拟ID")
     wqb_alpha_id = NotNullColumn(
         VARCHAR(63), index=True, server_default="", comment="世坤因子ID"
@@ -113,7 +140,19 @@ class QuantsWqbAlphaModel(BaseModel):
     wqb_modified_time = DefaultTimeColumn(comment="wqb最后一次模拟时间")
     wqb_submitted_time = DefaultTimeColumn(comment="wqb提交时间")
     wqb_pnl_shape = DefaultTypeColumn(comment="收益形态:-1: 异常, 0: 未捕捉, 1: 正常")
-    wqb_pnl_data = DefaultJsonColumn(server_default={}, comment="收益数据")
+    wqb_pnl_data = DefaultJsonColumn(
+        server_default={}, comment="收益数据（已废弃，迁移到本地 PnL 库）"
+    )
+    pnl_state = DefaultTypeColumn(
+        index=True,
+        comment="收益数据: -1: 抓取失败, 0: 未抓取, 1: 已存入本地 PnL 库, 2: JSON 待迁移",
+    )
+    self_corr = DefaultDecimalColumn(
+        comment="与同地区已激活因子的最大 PnL 相关系数, -2: 无已激活因子, -3: 重叠日数不足"
+    )
+    self_corr_recent = DefaultDecimalColumn(
+        comment="最近 4 年与同地区已激活因子的最大 PnL 相关系数, -2/-3 同 self_corr"
+    )
 
     @classproperty
     def immutable_column_names(cls) -> Set[str]:
@@ -160,16 +199,36 @@ class QuantsWqbAlphaModel(BaseModel):
         return out
 
     @classmethod
-    def generate_expression_hash(cls, expression: str, settings: D) -> str:
-        settings_str = json.dumps(
+    def settings_hash_str(cls, settings: D) -> str:
+        return json.dumps(
             {k: v for k, v in settings.items() if k.lower() in cls.SETTINGS_HASH_KEYS},
             sort_keys=True,
             separators=(",", ":"),
             ensure_ascii=False,
         )
-        hash_input = cls.normalize_expr(expression) + settings_str
+
+    @classmethod
+    def generate_legacy_expression_hash(cls, expression: str, settings: D) -> str:
+        hash_input = cls.normalize_expr(expression) + cls.settings_hash_str(settings)
         return hashlib.md5(hash_input.lower().encode("utf-8")).hexdigest()
 
+    @classmethod
+    def generate_expression_hash(
+        cls, expression: str, settings: D, operator_defaults: Optional[D] = None
+    ) -> str:
+        """
+        基于 AST 规范化结果生成哈希：交换律参数排序、数字字面量统一、
+        省略与默认值相同的关键字参数（默认值来自 QuantsWqbOperatorModel.definition）。
+        无法解析的表达式退化为去空白的字符串。
+        """
+        try:
+            canonical = canonical_expression(expression, operator_defaults)
+        except ExpressionSyntaxError:
+            canonical = cls.normalize_expr(expression, newline_after_semicolon=False)
+        hash_input = canonical + cls.settings_hash_str(settings)
+        digest = hashlib.md5(hash_input.lower().encode("utf-8")).hexdigest()
+        return f"v{cls.EXPRESSION_HASH_VERSION}:{digest}"
+
     @classmethod
     def state_from_str(cls, state_str: str) -> int:
         mapping = {
@@ -204,6 +263,19 @@ class QuantsWqbOperatorModel(BaseModel):
     documentation = NotNullColumn(VARCHAR(511), server_default="", comment="文档链接")
     level = NotNullColumn(VARCHAR(63), server_default="", comment="级别")
 
+    @classmethod
+    def parse_default_kwargs(cls, definition: str) -> dict:
+        """definition 中关键字参数的规范化默认值, ex: add(x, y, filter = false) -> {"filter": "false"}"""
+        call = parse_operator_definition(definition or "")
+        if call is None:
+            return {}
+        canonical = Canonicalizer()
+        return {k.lower(): canonical(v) for k, v in call.kwargs}
+
+    @property
+    def default_kwargs(self) -> dict:
+        return self.parse_default_kwargs(self.definition)
+
 
 class QuantsWqbUniverseModel(BaseModel):
     name = NotNullColumn(VARCHAR(127), comment="操作名")
@@ -265,3 +337,35 @@ class QuantsWqbDataFieldModel(BaseModel):
         name,
         name="uix_wqb_data_field_unique",
     )
+
+
+class QuantsGenerationCursorModel(BaseModel):
+
+    STATE_RUNNING = 0
+    STATE_DONE = 1
+
+    batch_no = NotNullColumn(VARCHAR(63), server_default="", comment="批次ID")
+    template_id = DefaultIdColumn(comment="模板ID")
+    data_field_name = NotNullColumn(
+        VARCHAR(63), server_default="", comment="数据字段占位符名"
+    )
+    seed = NotNullColumn(BIGINT(unsigned=True), server_default="0", comment="随机种子")
+    position = NotNullColumn(
+        INTEGER(unsigned=True), server_default="0", comment="已完成的抽样序号位置"
+    )
+    total = NotNullColumn(
+        INTEGER(unsigned=True), server_default="0", comment="抽样总数"
+    )
+    fingerprint = NotNullColumn(
+        VARCHAR(63), index=True, server_default="", comment="模板与字段集合指纹"
+    )
+    field_ids = DefaultJsonColumn(
+        server_default=[], comment="数据字段/父alpha ID, 有序"
+    )
+    state = DefaultTypeColumn(comment="状态: 0: 进行中, 1: 已完成")
+
+    UniqueConstraint(
+        batch_no,
+        template_id,
+        name="uix_generation_cursor_unique",
+    )
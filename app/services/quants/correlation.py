@@ -0,0 +1,279 @@
+"""alpha 之间的 PnL 自相关检查
+
+从本地 PnL 库取出累计 PnL，差分得到日收益。两个 alpha 覆盖的日期不同，每一对只在
+两者都有值的日期上计算 Pearson 相关系数：把缺失记 0、有效标记记 1 后，重叠区间上的
+n、Σx、Σy、Σxy、Σx²、Σy² 各是一次矩阵乘法。候选与已激活两侧都按块切分，
+每块只保留每个候选的最大值与对应的已激活 alpha，内存为 block_size² 而不是 N×M。
+同时计算整个区间与 WQB 检查用的最近 window 个交易日两个窗口
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import models
+from app.crud import quants_wqb_alpha_handler
+
+from .pnl_store import PnlStore
+
+# WQB 自相关检查使用最近 4 年的日 PnL
+TRAILING_DAYS = 4 * 252
+
+
+def daily_returns(cumulative: np.ndarray) -> np.ndarray:
+    """累计 PnL 按行差分，任一端缺失时为 NaN，第一列为 NaN"""
+    out = np.full(cumulative.shape, np.nan, dtype=np.float32)
+    np.subtract(cumulative[:, 1:], cumulative[:, :-1], out=out[:, 1:])
+    return out
+
+
+def standardize(returns: np.ndarray) -> np.ndarray:
+    """每行按自身有效值去均值、除以标准差，缺失保持 NaN；有效值不足 2 个或方差为 0 的行全为 NaN
+
+    Pearson 相关系数不受平移与缩放影响，预先标准化只是让后续 float32 的求和不丢精度
+    """
+    z = returns.astype(np.float32, copy=True)
+    valid = ~np.isnan(z)
+    count = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z -= (
+            np.where(valid, z, 0).sum(axis=1, keepdims=True, dtype=np.float64) / count
+        ).astype(np.float32)
+        std = np.sqrt(
+            np.where(valid, z * z, 0).sum(axis=1, keepdims=True, dtype=np.float64)
+            / count
+        )
+        z /= std.astype(np.float32)
+    z[(count[:, 0] < 2) | ~(std[:, 0] > 0)] = np.nan
+    return z
+
+
+class _Moments(NamedTuple):
+    """一侧的 (值, 值², 有效标记)，缺失处为 0，用于按对计算重叠区间上的求和"""
+
+    x: np.ndarray
+    xx: np.ndarray
+    mask: np.ndarray
+
+    @classmethod
+    def of(cls, z: np.ndarray) -> "_Moments":
+        mask = ~np.isnan(z)
+        x = np.where(mask, z, 0).astype(np.float32)
+        return cls(x, x * x, mask.astype(np.float32))
+
+
+def pairwise_correlation(
+    left: np.ndarray, right: np.ndarray, min_overlap: int = 2
+) -> np.ndarray:
+    """left、right 的每一对行只在两者都有值的日期上计算 Pearson 相关系数，
+    重叠日数不足 min_overlap 或任一侧在重叠区间上方差为 0 时为 NaN
+
+    n、Σx、Σy、Σxy、Σx²、Σy² 各是一次矩阵乘法
+    """
+    a, b = _Moments.of(left), _Moments.of(right)
+    n = a.mask @ b.mask.T
+    sx = a.x @ b.mask.T
+    sy = a.mask @ b.x.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = a.x @ b.x.T - sx * sy / n
+        var_x = a.xx @ b.mask.T - sx * sx / n
+        var_y = a.mask @ b.xx.T - sy * sy / n
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[(n < min_overlap) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+    return np.clip(corr, -1, 1, out=corr)
+
+
+def load_returns(
+    store: PnlStore, alpha_ids: Sequence[int], block_size: int = 4096
+) -> Tuple[List[int], np.ndarray, slice]:
+    """读出日收益并裁掉所有 alpha 都没有数据的首尾日期，返回 (alpha ID, 日收益, 日期切片)
+
+    分块读两遍：第一遍求有数据的日期范围，第二遍只拷贝该范围内的列
+    """
+    rows = store.rows()
+    found = [i for i in alpha_ids if i in rows]
+    used = np.zeros(store.n_days, dtype=bool)
+    for start in range(0, len(found), block_size):
+        _, block = store.load(found[start : start + block_size])
+        used |= ~np.isnan(block).all(axis=0)
+    if not used.any():
+        return found, np.empty((len(found), 0), dtype=np.float32), slice(0, 0)
+    columns = np.flatnonzero(used)
+    span = slice(columns[0], columns[-1] + 1)
+    returns = np.empty((len(found), span.stop - span.start), dtype=np.float32)
+    for start in range(0, len(found), block_size):
+        _, block = store.load(found[start : start + block_size], span)
+        returns[start : start + len(block)] = daily_returns(block)
+    return found, returns, span
+
+
+def max_correlation(
+    candidates: np.ndarray,
+    accepted: np.ndarray,
+    candidate_ids: Sequence[int],
+    accepted_ids: Sequence[int],
+    block_size: int = 2048,
+    min_overlap: int = 2,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """candidates、accepted 为日收益（缺失为 NaN，可先 standardize），返回每个候选的
+    (最大相关系数, 对应的已激活序号)；每对只用重叠日期，同一个 alpha 不与自己比较，
+    没有可比对象时为 (NaN, -1)"""
+    n, m = len(candidates), len(accepted)
+    best = np.full(n, -np.inf, dtype=np.float32)
+    peer = np.full(n, -1, dtype=np.int64)
+    candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+    accepted_ids = np.asarray(accepted_ids, dtype=np.int64)
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        for j in range(0, m, block_size):
+            cols = slice(j, min(j + block_size, m))
+            corr = pairwise_correlation(candidates[rows], accepted[cols], min_overlap)
+            corr[np.isnan(corr)] = -np.inf
+            corr[candidate_ids[rows, None] == accepted_ids[None, cols]] = -np.inf
+            arg = corr.argmax(axis=1)
+            value = corr[np.arange(len(arg)), arg]
+            better = value > best[rows]
+            best[rows] = np.where(better, value, best[rows])
+            peer[rows] = np.where(better, arg + j, peer[rows])
+    best[peer < 0] = np.nan
+    return best, peer
+
+
+class CorrelationRow(NamedTuple):
+    alpha_id: int
+    max_corr: float
+    peer_id: Optional[int]
+    max_corr_recent: float
+    peer_id_recent: Optional[int]
+
+
+class CorrelationEngine:
+    """计算每个候选与已激活集合在全区间与最近 window 日上的最大相关系数，
+    重叠日数不足 min_overlap 的一对不参与比较"""
+
+    def __init__(
+        self,
+        store: Optional[PnlStore] = None,
+        window: int = TRAILING_DAYS,
+        block_size: int = 2048,
+        min_overlap: int = 63,
+    ):
+        self.store = PnlStore() if store is None else store
+        self.window = window
+        self.block_size = block_size
+        self.min_overlap = min_overlap
+
+    def run(
+        self, candidate_ids: Sequence[int], accepted_ids: Sequence[int]
+    ) -> List[CorrelationRow]:
+        # 两侧放在同一个日期范围内，最近窗口才对齐
+        ids, returns, _ = load_returns(
+            self.store, list(dict.fromkeys([*candidate_ids, *accepted_ids]))
+        )
+        index = {alpha_id: i for i, alpha_id in enumerate(ids)}
+        cand = [i for i in candidate_ids if i in index]
+        acc = [i for i in accepted_ids if i in index]
+        z = standardize(returns)
+        cand_z = z[[index[i] for i in cand]]
+        acc_z = z[[index[i] for i in acc]]
+        results = []
+        for columns in (slice(None), slice(-self.window, None)):
+            best, peer = max_correlation(
+                cand_z[:, columns],
+                acc_z[:, columns],
+                cand,
+                acc,
+                self.block_size,
+                self.min_overlap,
+            )
+            results.append((best, peer))
+        (best, peer), (recent, recent_peer) = results
+        return [
+            CorrelationRow(
+                alpha_id,
+                float(best[k]),
+                acc[peer[k]] if peer[k] >= 0 else None,
+                float(recent[k]),
+                acc[recent_peer[k]] if recent_peer[k] >= 0 else None,
+            )
+            for k, alpha_id in enumerate(cand)
+        ]
+
+
+class SelfCorrelationChecker:
+    """回测完的 alpha 与同地区已激活 alpha 比较最近窗口的最大 PnL 相关系数，
+    低于 threshold 的进入 STATE_SELF_CHECKED；两个窗口的结果都写入数据库
+
+    算不出相关系数时写入 [-1, 1] 以外的值：同地区没有已激活 alpha 为 SELF_CORR_NO_PEER，
+    视为通过；有已激活 alpha 但重叠日数都不足为 SELF_CORR_NO_OVERLAP，留在 STATE_SIMULATED
+    """
+
+    def __init__(
+        self,
+        store: Optional[PnlStore] = None,
+        threshold: float = 0.7,
+        window: int = TRAILING_DAYS,
+        block_size: int = 2048,
+        min_overlap: int = 63,
+    ):
+        self.engine = CorrelationEngine(store, window, block_size, min_overlap)
+        self.threshold = threshold
+
+    def select_alphas(
+        self, db: Session, state: int, filters: Optional[dict] = None
+    ) -> List[models.QuantsWqbAlphaModel]:
+        model = models.QuantsWqbAlphaModel
+        return quants_wqb_alpha_handler.search(
+            db,
+            q={"state": state, "pnl_state": model.PNL_STATE_STORED, **(filters or {})},
+        )
+
+    @staticmethod
+    def stored_value(value: float, has_peers: bool) -> float:
+        model = models.QuantsWqbAlphaModel
+        if not np.isnan(value):
+            return round(value, 6)
+        return model.SELF_CORR_NO_OVERLAP if has_peers else model.SELF_CORR_NO_PEER
+
+    def save(self, db: Session, row: CorrelationRow, has_peers: bool) -> bool:
+        model = models.QuantsWqbAlphaModel
+        obj_in = {
+            "id": row.alpha_id,
+            "self_corr": self.stored_value(row.max_corr, has_peers),
+            "self_corr_recent": self.stored_value(row.max_corr_recent, has_peers),
+        }
+        if np.isnan(row.max_corr_recent):
+            passed = not has_peers
+        else:
+            passed = row.max_corr_recent < self.threshold
+        if passed:
+            obj_in["state"] = model.STATE_SELF_CHECKED
+        quants_wqb_alpha_handler.update(db, obj_in=obj_in)
+        return passed
+
+    def run(self, db: Session, filters: Optional[dict] = None):
+        model = models.QuantsWqbAlphaModel
+        candidates = self.select_alphas(db, model.STATE_SIMULATED, filters)
+        if not candidates:
+            print("Self-correlation check skipped, no simulated alphas with PnL")
+            return
+        accepted = self.select_alphas(db, model.STATE_ACTIVE)
+        by_region: Dict[str, Tuple[List[int], List[int]]] = {}
+        for alpha in candidates:
+            by_region.setdefault(alpha.region, ([], []))[0].append(alpha.id)
+        for alpha in accepted:
+            if alpha.region in by_region:
+                by_region[alpha.region][1].append(alpha.id)
+        for region, (candidate_ids, accepted_ids) in by_region.items():
+            rows = self.engine.run(candidate_ids, accepted_ids)
+            has_peers = any(i in self.engine.store for i in accepted_ids)
+            passed = sum(self.save(db, row, has_peers) for row in rows)
+            no_overlap = sum(np.isnan(row.max_corr_recent) for row in rows)
+            db.commit()
+            print(
+                f"Self-correlation {region}: {len(rows)} candidates vs "
+                f"{len(accepted_ids)} active, passed {passed} "
+                f"(recent {self.engine.window}d max corr < {self.threshold}), "
+                f"no {'overlap' if has_peers else 'active peers'} {no_overlap}"
+            )
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import random
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import models
+from app.crud import (
+    quants_generation_cursor_handler,
+    quants_wqb_alpha_handler,
+    quants_wqb_data_field_handler,
+)
+
+from .utils import FieldRecord
+
+
+def fingerprint(template, records: List[FieldRecord], limit: int) -> str:
+    """模板内容、默认字段、有序字段集合与抽样数共同决定抽样序列"""
+    payload = json.dumps(
+        [
+            template.expression,
+            template.default_field,
+            [(r.id, r.text) for r in records],
+            limit,
+        ],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def find_resumable(
+    db: Session, *, template_id: int, data_field_name: str
+) -> Optional[models.QuantsGenerationCursorModel]:
+    model = quants_generation_cursor_handler.model
+    return (
+        db.query(model)
+        .filter(
+            model.template_id == template_id,
+            model.data_field_name == data_field_name,
+            model.state == model.STATE_RUNNING,
+        )
+        .order_by(model.id.desc())
+        .first()
+    )
+
+
+def load_records(
+    db: Session,
+    cursor: models.QuantsGenerationCursorModel,
+    vector_reductions: Optional[dict] = None,
+) -> List[FieldRecord]:
+    """按游标记录的有序 ID 重新加载字段（一阶为数据字段，二、三阶为父 alpha）"""
+    handler = (
+        quants_wqb_data_field_handler
+        if cursor.data_field_name == "data_field"
+        else quants_wqb_alpha_handler
+    )
+    ids = list(cursor.field_ids or [])
+    if not ids:
+        return []
+    by_id = {v.id: v for v in handler.search(db, q={"id": ids})}
+    return [
+        FieldRecord.from_model(by_id[i], vector_reductions) for i in ids if i in by_id
+    ]
+
+
+def resume_cursor(
+    db: Session,
+    *,
+    template,
+    data_field_name: str,
+    limit: int,
+    vector_reductions: Optional[dict] = None,
+) -> Tuple[Optional[models.QuantsGenerationCursorModel], List[FieldRecord]]:
+    """找到未完成且指纹一致的游标及其字段；指纹不一致（字段被删、模板被改、
+    向量字段的归约方式变了）时作废旧游标"""
+    cursor = find_resumable(
+        db, template_id=template.id, data_field_name=data_field_name
+    )
+    if cursor is None:
+        return None, []
+    records = load_records(db, cursor, vector_reductions)
+    if fingerprint(template, records, limit) == cursor.fingerprint:
+        return cursor, records
+    save_position(db, cursor, cursor.position, done=True)
+    db.commit()
+    return None, []
+
+
+def open_cursor(
+    db: Session,
+    *,
+    batch_no: str,
+    template,
+    data_field_name: str,
+    records: List[FieldRecord],
+    limit: int,
+) -> models.QuantsGenerationCursorModel:
+    cursor = quants_generation_cursor_handler.create(
+        db,
+        obj_in={
+            "batch_no": batch_no,
+            "template_id": template.id,
+            "data_field_name": data_field_name,
+            "seed": random.randrange(1 << 32),
+            "position": 0,
+            "total": limit,
+            "fingerprint": fingerprint(template, records, limit),
+            "field_ids": [r.id for r in records],
+            "state": quants_generation_cursor_handler.model.STATE_RUNNING,
+        },
+    )
+    db.commit()
+    return cursor
+
+
+def save_position(
+    db: Session,
+    cursor: models.QuantsGenerationCursorModel,
+    position: int,
+    done: bool = False,
+):
+    """只更新不提交，调用方与写入的 alpha 在同一事务内提交"""
+    obj_in = {"id": cursor.id, "position": position}
+    if done:
+        obj_in["state"] = quants_generation_cursor_handler.model.STATE_DONE
+    quants_generation_cursor_handler.update(db, obj_in=obj_in)
+    cursor.position = position
@@ -0,0 +1,238 @@
+import random
+from typing import Callable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.common.expression import (
+    Assign,
+    Binary,
+    Call,
+    ExpressionSyntaxError,
+    Name,
+    Node,
+    Num,
+    Program,
+    Ternary,
+    Unary,
+    iter_names,
+    parse_expression,
+    to_source,
+)
+
+# 签名同为 (x, d) 的时序操作符，可互相替换
+TS_WINDOW_OPERATORS = [
+    "ts_mean",
+    "ts_sum",
+    "ts_std_dev",
+    "ts_rank",
+    "ts_zscore",
+    "ts_delta",
+    "ts_decay_linear",
+    "ts_av_diff",
+    "ts_scale",
+    "ts_arg_max",
+    "ts_arg_min",
+]
+
+TS_WINDOWS = [5, 10, 20, 22, 60, 66, 120, 250, 252]
+
+GROUP_OPERATORS = ["group_rank", "group_zscore", "group_neutralize"]
+
+# 分组字段，与本地面板的分组一致（另加 market）；country 出现在
+# group_cartesian_product(country, …) 中，同样不能当作数据字段变异
+GROUP_FIELDS = ["market", "sector", "industry", "subindustry", "country"]
+
+# 作为关键字参数取值出现的常量名，不是数据字段
+CONSTANT_NAMES = {"true", "false", "nan", "inf"}
+
+Path = Tuple[int, ...]
+
+
+def children(node: Node) -> Tuple[Node, ...]:
+    if isinstance(node, Program):
+        return node.statements
+    if isinstance(node, Assign):
+        return (node.value,)
+    if isinstance(node, Call):
+        return node.args + tuple(v for _, v in node.kwargs)
+    if isinstance(node, Unary):
+        return (node.operand,)
+    if isinstance(node, Binary):
+        return node.left, node.right
+    if isinstance(node, Ternary):
+        return node.cond, node.then, node.otherwise
+    return ()
+
+
+def with_children(node: Node, new: Sequence[Node]) -> Node:
+    """按 children 的顺序替换子节点，返回新节点"""
+    if isinstance(node, Program):
+        return Program(tuple(new))
+    if isinstance(node, Assign):
+        return node._replace(value=new[0])
+    if isinstance(node, Call):
+        n = len(node.args)
+        kwargs = tuple((k, v) for (k, _), v in zip(node.kwargs, new[n:]))
+        return node._replace(args=tuple(new[:n]), kwargs=kwargs)
+    if isinstance(node, Unary):
+        return node._replace(operand=new[0])
+    if isinstance(node, Binary):
+        return node._replace(left=new[0], right=new[1])
+    if isinstance(node, Ternary):
+        return Ternary(*new)
+    return node
+
+
+def iter_subtrees(node: Node, path: Path = ()) -> Iterator[Tuple[Path, Node]]:
+    """先序产出 (路径, 子树)，路径为各层子节点下标"""
+    yield path, node
+    for i, child in enumerate(children(node)):
+        yield from iter_subtrees(child, path + (i,))
+
+
+def replace_at(node: Node, path: Path, new: Node) -> Node:
+    if not path:
+        return new
+    items = list(children(node))
+    items[path[0]] = replace_at(items[path[0]], path[1:], new)
+    return with_children(node, items)
+
+
+def assigned_names(program: Program) -> Set[str]:
+    return {s.name for s in program.statements if isinstance(s, Assign)}
+
+
+class ExpressionMutator:
+    """在 AST 上做变异与交叉，产出新的表达式字符串
+
+    - 替换数据字段、替换 ts_* 操作符或窗口、外层包一层 group_* 操作符
+    - 交叉：用另一个表达式中不依赖其局部变量的子树替换当前表达式的子树
+    变异结果不保证合法，调用方需再经 ExpressionValidator 校验
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        rng: Optional[random.Random] = None,
+        ts_operators: Sequence[str] = TS_WINDOW_OPERATORS,
+        windows: Sequence[int] = TS_WINDOWS,
+        group_operators: Sequence[str] = GROUP_OPERATORS,
+        group_fields: Sequence[str] = GROUP_FIELDS,
+    ):
+        self.fields = list(fields)
+        self.rng = rng or random.Random()
+        self.ts_operators = list(ts_operators)
+        self.windows = list(windows)
+        self.group_operators = list(group_operators)
+        self.group_fields = list(group_fields)
+        self.mutations: List[Callable[[Program], Optional[Program]]] = [
+            self.swap_field,
+            self.swap_ts_operator,
+            self.swap_window,
+            self.wrap_group,
+        ]
+
+    def _pick(
+        self, program: Node, predicate, root: bool = True
+    ) -> Optional[Tuple[Path, Node]]:
+        candidates = [
+            (p, n) for p, n in iter_subtrees(program) if (root or p) and predicate(n)
+        ]
+        return self.rng.choice(candidates) if candidates else None
+
+    def swap_field(self, program: Program) -> Optional[Program]:
+        local = (
+            assigned_names(program)
+            | set(GROUP_FIELDS)
+            | set(self.group_fields)
+            | CONSTANT_NAMES
+        )
+        picked = self._pick(
+            program, lambda n: isinstance(n, Name) and n.name not in local
+        )
+        if picked is None or not self.fields:
+            return None
+        path, node = picked
+        return replace_at(program, path, Name(self.rng.choice(self.fields)))
+
+    def swap_ts_operator(self, program: Program) -> Optional[Program]:
+        picked = self._pick(
+            program, lambda n: isinstance(n, Call) and n.name in self.ts_operators
+        )
+        if picked is None:
+            return None
+        path, node = picked
+        name = self.rng.choice([op for op in self.ts_operators if op != node.name])
+        return replace_at(program, path, node._replace(name=name))
+
+    def swap_window(self, program: Program) -> Optional[Program]:
+        picked = self._pick(
+            program,
+            lambda n: isinstance(n, Call)
+            and n.name.startswith("ts_")
+            and len(n.args) >= 2
+            and isinstance(n.args[1], Num),
+        )
+        if picked is None:
+            return None
+        path, node = picked
+        window = self.rng.choice([w for w in self.windows if w != node.args[1].value])
+        args = (node.args[0], Num(float(window), str(window))) + node.args[2:]
+        return replace_at(program, path, node._replace(args=args))
+
+    def wrap_group(self, program: Program) -> Optional[Program]:
+        result = program.result
+        if isinstance(result, Assign):
+            return None
+        if isinstance(result, Call) and result.name in self.group_operators:
+            return None
+        wrapped = Call(
+            self.rng.choice(self.group_operators),
+            (result, Name(self.rng.choice(self.group_fields))),
+            (),
+        )
+        return Program(program.statements[:-1] + (wrapped,))
+
+    def crossover(self, program: Program, donor: Program) -> Optional[Program]:
+        donor_local = assigned_names(donor)
+        donated = self._pick(
+            donor,
+            lambda n: isinstance(n, Call)
+            and not any(name in donor_local for name in iter_names(n)),
+        )
+        # 不替换整个输出，否则子代只是 donor 的片段
+        target = self._pick(program.result, lambda n: isinstance(n, Call), root=False)
+        if donated is None or target is None:
+            return None
+        path = (len(program.statements) - 1,) + target[0]
+        return replace_at(program, path, donated[1])
+
+    def mutate(self, program: Program) -> Optional[Program]:
+        return self.rng.choice(self.mutations)(program)
+
+    def offspring(self, expression: str, donor: Optional[str] = None) -> Optional[str]:
+        """有 donor 时做交叉，否则随机变异；无法变异或结果不变时返回 None"""
+        program = parse_expression(expression)
+        if donor is not None:
+            child = self.crossover(program, parse_expression(donor))
+        else:
+            child = self.mutate(program)
+        if child is None or child == program:
+            return None
+        return to_source(child)
+
+
+def field_names(expressions: Sequence[str]) -> List[str]:
+    """从种群表达式中收集数据字段名（排除局部变量、分组字段），跳过无法解析的表达式"""
+    names = set()
+    for expression in expressions:
+        try:
+            program = parse_expression(expression)
+        except ExpressionSyntaxError:
+            continue
+        local = assigned_names(program)
+        names.update(n for n in iter_names(program) if n not in local)
+    return sorted(names - set(GROUP_FIELDS) - CONSTANT_NAMES)
+
+
+def tournament(population: Sequence, key, rng: random.Random, size: int = 3):
+    """锦标赛选择：随机取 size 个个体返回 key 最大者"""
+    return max(rng.sample(list(population), min(size, len(population))), key=key)
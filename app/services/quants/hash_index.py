@@ -0,0 +1,311 @@
+import math
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.crud import quants_wqb_alpha_handler
+from config import settings
+
+HASH_INDEX_PATH = Path(settings.DATA_DIR) / "expression_hash.bloom"
+
+
+def hash_digest(expression_hash: str) -> bytes:
+    """expression_hash 的 md5 部分（兼容 v1 无前缀与 v2 "v2:" 前缀）"""
+    return bytes.fromhex(expression_hash[-32:])
+
+
+def bloom_params(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """按容量与误判率计算 (位数, 哈希个数)"""
+    capacity = max(capacity, 1)
+    size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    return size, max(1, round(size / capacity * math.log(2)))
+
+
+class BloomFilter:
+    """基于 md5 摘要的布隆过滤器，位置直接由摘要双重哈希得到，无需再次哈希"""
+
+    def __init__(self, capacity: int, error_rate: float = 1e-3):
+        self.size, self.k = bloom_params(capacity, error_rate)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, digest: bytes):
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.k))
+
+    def add(self, digest: bytes) -> bool:
+        """返回是否有新的位被置位（即大概率是新元素）"""
+        changed = False
+        bits = self.bits
+        for p in self.positions(digest):
+            mask = 1 << (p & 7)
+            byte = bits[p >> 3]
+            if not byte & mask:
+                bits[p >> 3] = byte | mask
+                changed = True
+        return changed
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(digest))
+
+
+class PersistentBloomFilter(BloomFilter):
+    """mmap 映射到文件的布隆过滤器，打开几乎零开销，写入直接落在页缓存
+
+    文件头记录位数、哈希个数、容量、已同步的最大 alpha id、元素数与表达式哈希版本，
+    之后是位数组。布隆过滤器只增不删、按 id 增量同步，已有行的哈希被原地改写后
+    新哈希不会进入索引（假阴性），因此哈希版本变化或重算哈希后需要重建。
+    """
+
+    MAGIC = b"BCBF"
+    VERSION = 2
+    HEADER = struct.Struct("<4sIQIQQQI")
+    HEADER_SIZE = 64
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, version, size, k, capacity, synced_id, count, hash_version = (
+            self.HEADER.unpack_from(self.mm, 0)
+        )
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError(f"not a bloom filter file: {self.path}")
+        self.size, self.k, self.capacity = size, k, capacity
+        self.synced_id, self.count = synced_id, count
+        self.hash_version = hash_version
+        self.bits = memoryview(self.mm)[self.HEADER_SIZE :]
+
+    @classmethod
+    def create(
+        cls,
+        path: Path,
+        capacity: int,
+        error_rate: float = 1e-3,
+        hash_version: int = 0,
+    ) -> "PersistentBloomFilter":
+        size, k = bloom_params(capacity, error_rate)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 临时文件名唯一，多个进程同时重建时最后一次替换生效
+        fd, tmp = tempfile.mkstemp(
+            dir=path.parent, prefix=path.name + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                header = cls.HEADER.pack(
+                    cls.MAGIC, cls.VERSION, size, k, capacity, 0, 0, hash_version
+                )
+                f.write(header.ljust(cls.HEADER_SIZE, b"\0"))
+                f.truncate(cls.HEADER_SIZE + (size + 7) // 8)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return cls(path)
+
+    def add(self, digest: bytes) -> bool:
+        changed = super().add(digest)
+        if changed:
+            self.count += 1
+        return changed
+
+    def flush(self):
+        self.HEADER.pack_into(
+            self.mm,
+            0,
+            self.MAGIC,
+            self.VERSION,
+            self.size,
+            self.k,
+            self.capacity,
+            self.synced_id,
+            self.count,
+            self.hash_version,
+        )
+        self.mm.flush()
+
+    def replaced(self) -> bool:
+        """文件已被删除或被重建替换（inode 变化），当前 mmap 映射的是旧文件"""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        if getattr(self, "bits", None) is not None:
+            self.bits.release()
+            self.bits = None
+        self.mm.close()
+        self.file.close()
+
+
+class ExpressionHashIndex:
+    """已存在的 expression_hash 集合，用于写库前在内存中去重
+
+    数据量超过 bloom_threshold 时改用布隆过滤器（有少量误判，会多丢弃极少数新表达式）。
+    持久化索引只在 sync() 时写入已提交的行，本次运行新加入、尚未提交的哈希
+    记在内存的 pending 中，中断或回滚不会在共享文件里留下不存在的哈希。
+    多个生成进程并发写入时，id 较小的事务可能晚于 id 较大的提交，sync() 每次从
+    同步位置往回多扫 SYNC_LAG 个 id，重复加入不影响结果
+    """
+
+    # 并发写入者分配 id 到提交之间，其他进程最多可能分配的 id 数
+    SYNC_LAG = 20_000
+
+    def __init__(
+        self, digests: Iterable[bytes] = (), bloom: Optional[BloomFilter] = None
+    ):
+        self.bloom = bloom
+        self.digests: Set[bytes] = set() if bloom is not None else set(digests)
+        self.pending: Set[bytes] = set()
+        if bloom is not None:
+            for digest in digests:
+                bloom.add(digest)
+
+    @property
+    def persistent(self) -> bool:
+        return isinstance(self.bloom, PersistentBloomFilter)
+
+    @classmethod
+    def load(
+        cls,
+        db: Session,
+        bloom_threshold: int = 2_000_000,
+        error_rate: float = 1e-3,
+        yield_per: int = 50_000,
+    ) -> "ExpressionHashIndex":
+        model = quants_wqb_alpha_handler.model
+        total = db.query(func.count(model.id)).scalar() or 0
+        bloom = (
+            BloomFilter(int(total * 1.2), error_rate)
+            if total > bloom_threshold
+            else None
+        )
+        # 只查唯一索引列，走覆盖索引扫描
+        rows = db.query(model.expression_hash).yield_per(yield_per)
+        return cls((hash_digest(h) for (h,) in rows if h), bloom=bloom)
+
+    @classmethod
+    def open_persistent(
+        cls,
+        db: Session,
+        path: Path = HASH_INDEX_PATH,
+        error_rate: float = 1e-3,
+        min_capacity: int = 1_000_000,
+    ) -> "ExpressionHashIndex":
+        """打开（不存在则创建）持久化索引，并增量同步上次之后新增的 alpha"""
+        path = Path(path)
+        model = quants_wqb_alpha_handler.model
+        try:
+            bloom = PersistentBloomFilter(path) if path.exists() else None
+        except ValueError:
+            # 旧版文件格式
+            bloom = None
+        if (
+            bloom is None
+            or bloom.count > bloom.capacity
+            or bloom.hash_version != model.EXPRESSION_HASH_VERSION
+        ):
+            # 首次创建、超出容量或哈希版本变化时按当前行数的两倍重建
+            if bloom is not None:
+                bloom.close()
+            total = db.query(func.count(model.id)).scalar()
+            bloom = PersistentBloomFilter.create(
+                path,
+                max((total or 0) * 2, min_capacity),
+                error_rate,
+                model.EXPRESSION_HASH_VERSION,
+            )
+        index = cls(bloom=bloom)
+        index.sync(db)
+        return index
+
+    def sync(self, db: Session, yield_per: int = 50_000) -> int:
+        """把 id 大于（上次同步位置 - SYNC_LAG）的 alpha 加入持久化索引，返回扫描条数；
+        需在提交之后调用，已提交的行写入文件后清空 pending"""
+        bloom = self.bloom
+        if not isinstance(bloom, PersistentBloomFilter):
+            return 0
+        model = quants_wqb_alpha_handler.model
+        rows = (
+            db.query(model.id, model.expression_hash)
+            .filter(model.id > bloom.synced_id - self.SYNC_LAG)
+            .order_by(model.id)
+            .yield_per(yield_per)
+        )
+        n = 0
+        for id_, expression_hash in rows:
+            if expression_hash:
+                bloom.add(hash_digest(expression_hash))
+            bloom.synced_id = max(bloom.synced_id, id_)
+            n += 1
+        bloom.flush()
+        self.pending.clear()
+        return n
+
+    def flush(self):
+        if self.persistent:
+            self.bloom.flush()
+
+    def __contains__(self, expression_hash: str) -> bool:
+        digest = hash_digest(expression_hash)
+        if digest in self.pending:
+            return True
+        if self.bloom is not None:
+            return digest in self.bloom
+        return digest in self.digests
+
+    def add(self, expression_hash: str):
+        digest = hash_digest(expression_hash)
+        if self.persistent:
+            # 提交后由 sync() 从表中写入
+            self.pending.add(digest)
+        elif self.bloom is not None:
+            self.bloom.add(digest)
+        else:
+            self.digests.add(digest)
+
+    def check_and_add(self, expression_hash: str) -> bool:
+        """不存在时加入并返回 True，批次内重复同样返回 False"""
+        if expression_hash in self:
+            return False
+        self.add(expression_hash)
+        return True
+
+
+_persistent_index: Optional[ExpressionHashIndex] = None
+
+
+def reset_persistent_hash_index(path: Path = HASH_INDEX_PATH):
+    """已有行的哈希被原地改写后删除持久化索引，下次打开时全量重建"""
+    global _persistent_index
+    if _persistent_index is not None:
+        _persistent_index.bloom.close()
+        _persistent_index = None
+    Path(path).unlink(missing_ok=True)
+
+
+def persistent_hash_index(db: Session) -> ExpressionHashIndex:
+    """进程内共享的持久化索引，首次调用时打开并同步；其他进程的写入通过 mmap 共享可见
+
+    其他进程删除或重建了索引文件（rehash、扩容、哈希版本变化）时重新打开，
+    否则长期运行的进程会一直读旧文件。旧索引可能仍被调用方持有，不在这里关闭
+    """
+    global _persistent_index
+    index = _persistent_index
+    if (
+        index is None
+        or index.bloom.replaced()
+        or index.bloom.hash_version
+        != quants_wqb_alpha_handler.model.EXPRESSION_HASH_VERSION
+    ):
+        _persistent_index = ExpressionHashIndex.open_persistent(db)
+    return _persistent_index
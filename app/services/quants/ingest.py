@@ -0,0 +1,63 @@
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.crud import quants_wqb_alpha_handler
+
+from .hash_index import ExpressionHashIndex
+
+
+class AlphaIngestor:
+    """缓冲待写入的 alpha，攒满 chunk_size 后一次 INSERT IGNORE 并提交，结束时需 flush"""
+
+    def __init__(
+        self,
+        db: Session,
+        chunk_size: int = 1000,
+        hash_index: Optional[ExpressionHashIndex] = None,
+        on_flush: Optional[Callable[[], None]] = None,
+    ):
+        # 未重算旧版哈希时写入的行无法去重，直接中止
+        quants_wqb_alpha_handler.check_expression_hash_version(db)
+        self.db = db
+        self.chunk_size = chunk_size
+        self.hash_index = hash_index
+        # 在同一事务内提交前回调，例如保存生成游标
+        self.on_flush = on_flush
+        self.buffer: List[dict] = []
+        self.inserted = 0
+        self.skipped = 0
+        self.deduped = 0
+
+    def add(self, obj_in: dict) -> bool:
+        """返回 False 表示已存在于 hash_index（或本批次内重复），不会写库"""
+        if self.hash_index is not None:
+            expression_hash = obj_in.get(
+                "expression_hash"
+            ) or quants_wqb_alpha_handler.generate_expression_hash(
+                self.db, expression=obj_in["expression"], settings=obj_in["settings"]
+            )
+            if not self.hash_index.check_and_add(expression_hash):
+                self.deduped += 1
+                return False
+            obj_in = {**obj_in, "expression_hash": expression_hash}
+        self.buffer.append(obj_in)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if not self.buffer:
+            return
+        inserted, skipped = quants_wqb_alpha_handler.bulk_insert_ignore(
+            self.db, objs_in=self.buffer, chunk_size=self.chunk_size
+        )
+        if self.on_flush is not None:
+            self.on_flush()
+        self.db.commit()
+        if self.hash_index is not None:
+            # 持久化索引追加本次写入的行并记录同步位置
+            self.hash_index.sync(self.db)
+        self.inserted += inserted
+        self.skipped += skipped
+        self.buffer = []
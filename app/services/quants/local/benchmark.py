@@ -0,0 +1,379 @@
+"""本地求值引擎的离线基准测试
+
+在合成面板（默认 2500 天 × 3000 只股票）上测量：
+
+- 各 ts_* / group_* / vec_* 操作符与回测的单次耗时和吞吐（每秒处理的单元格数）
+- scripts/promotions 中一阶模板、二阶展开表达式的单条延迟（求值与回测分开计）
+- BatchScorer 批量评估的吞吐
+- 每个阶段的峰值 RSS
+
+结果写成 JSON，键与顺序固定，可以直接 diff 或用 compare() 对比两个版本
+"""
+
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import time
+from pathlib import Path
+from statistics import median
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .evaluator import DagEvaluator, compile_expressions
+from .executor import BatchScorer, Candidate
+from .group import GROUP_KERNELS
+from .kernels import TS_KERNELS, TS_PAIR_KERNELS, nan_handling_on
+from .panel import Panel, PanelStore, write_synthetic_panel
+from .simulator import Simulator
+from .vector import VECTOR_KERNELS
+
+PROMOTIONS_DIR = Path(__file__).resolve().parents[4] / "scripts" / "promotions"
+FIRST_ORDER_FILE = PROMOTIONS_DIR / "一阶_templates.json"
+SECOND_ORDER_FILE = PROMOTIONS_DIR / "二阶_expanded.json"
+
+# 与数据字段默认 settings（QuantsWqbDataFieldModel.settings）一致
+DEFAULT_SETTINGS = {
+    "instrumentType": "EQUITY",
+    "delay": 1,
+    "region": "USA",
+    "universe": "TOP3000",
+    "language": "FASTEXPR",
+    "nanHandling": "ON",
+    "truncation": 0.05,
+    "pasteurization": "ON",
+    "decay": 5,
+    "neutralization": "SUBINDUSTRY",
+}
+TS_WINDOWS = (21, 252)
+BENCH_GROUP = "subindustry"
+BENCH_VECTOR = "bench_vector"
+
+
+def _status_mb(key: str) -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{key}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb() -> float:
+    """进程的 RSS 高水位（VmHWM），不支持 /proc 时退回 getrusage"""
+    peak = _status_mb("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return peak
+
+
+def reset_peak_rss() -> float:
+    """Linux 上写 5 到 clear_refs 可把高水位重置为当前 RSS，使各阶段的峰值互不影响；
+    返回重置后的基线，不支持时为当前高水位"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def memory(baseline: float) -> dict:
+    """RSS 含已映射的面板页，delta 为本阶段相对基线的增量"""
+    peak = peak_rss_mb()
+    return {
+        "peak_rss_mb": round(peak, 1),
+        "peak_rss_delta_mb": round(peak - baseline, 1),
+    }
+
+
+def timed(fn: Callable[[], object], repeat: int) -> Tuple[float, float]:
+    """返回 (最短, 中位) 耗时秒数"""
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), median(seconds)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROMOTIONS_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def first_order_candidates(
+    path: Path = FIRST_ORDER_FILE, fields_per_template: int = 2
+) -> List[Tuple[str, Candidate]]:
+    """一阶模板形如 {"ts_mean(x,66)": [字段名, ...]}，每个模板取前几个字段代入 x"""
+    templates = json.loads(path.read_text(encoding="utf-8"))
+    rs = []
+    for template, fields in templates.items():
+        for field in fields[:fields_per_template]:
+            expression = re.sub(r"\bx\b", field, template)
+            rs.append((template, Candidate(expression, DEFAULT_SETTINGS)))
+    return rs
+
+
+def second_order_candidates(
+    path: Path = SECOND_ORDER_FILE, limit: int = 50
+) -> List[Tuple[str, Candidate]]:
+    """二阶展开结果为模拟请求列表，等间隔取 limit 条，保证各外层操作符都被覆盖"""
+    requests = json.loads(path.read_text(encoding="utf-8"))
+    step = max(len(requests) // max(limit, 1), 1)
+    rs = []
+    for request in requests[::step][:limit]:
+        expression = request["regular"]
+        settings = {**DEFAULT_SETTINGS, **request["settings"]}
+        rs.append((expression.split("(")[0], Candidate(expression, settings)))
+    return rs
+
+
+def field_names(candidates: List[Candidate]) -> List[str]:
+    dag = compile_expressions([c.expression for c in candidates])
+    return sorted({node.params[0] for node in dag.nodes if node.op == "field"})
+
+
+def operator_expressions() -> Dict[str, str]:
+    """每个操作符一条只含该操作符的表达式，别名（如 ts_std）只测一次"""
+    rs = {}
+    for name, fn in TS_KERNELS.items():
+        if fn.__name__ != name:
+            continue
+        for d in TS_WINDOWS:
+            rs[f"{name}/{d}"] = f"{name}(close, {d})"
+    for name in TS_PAIR_KERNELS:
+        for d in TS_WINDOWS:
+            rs[f"{name}/{d}"] = f"{name}(close, volume, {d})"
+    for name, fn in GROUP_KERNELS.items():
+        if fn.__name__ == name:
+            rs[name] = f"{name}(close, {BENCH_GROUP})"
+    for name in VECTOR_KERNELS:
+        rs[name] = f"{name}({BENCH_VECTOR})"
+    return rs
+
+
+class Benchmark:
+    """在一个合成面板上运行全部基准，run() 返回可写成 JSON 的结果"""
+
+    def __init__(
+        self,
+        store: PanelStore,
+        n_dates: int = 2500,
+        n_instruments: int = 3000,
+        repeat: int = 3,
+        fields_per_template: int = 2,
+        second_order_limit: int = 50,
+        processes: int = 1,
+        seed: int = 0,
+        dtype=np.float32,
+    ):
+        self.store = store
+        self.shape = (n_dates, n_instruments)
+        self.repeat = repeat
+        self.processes = processes
+        self.seed = seed
+        self.dtype = np.dtype(dtype)
+        self.expressions = first_order_candidates(
+            fields_per_template=fields_per_template
+        ) + second_order_candidates(limit=second_order_limit)
+        self.panel: Optional[Panel] = None
+
+    @property
+    def cells(self) -> int:
+        return self.shape[0] * self.shape[1]
+
+    def prepare(self) -> Panel:
+        """面板已存在且形状一致时直接复用，否则重新生成"""
+        key = DEFAULT_SETTINGS["region"], 1, DEFAULT_SETTINGS["universe"]
+        fields = field_names([c for _, c in self.expressions])
+        panel = self.store.panel(*key)
+        if not (
+            panel.exists()
+            and panel.shape == self.shape
+            and all(panel.has_field(name) for name in fields)
+            and panel.has_vector(BENCH_VECTOR)
+        ):
+            print(f"Writing synthetic panel {self.shape} with {len(fields)} fields")
+            panel = write_synthetic_panel(
+                self.store,
+                *key,
+                n_dates=self.shape[0],
+                n_instruments=self.shape[1],
+                fields=fields,
+                vector_fields=[BENCH_VECTOR],
+                seed=self.seed,
+                dtype=self.dtype,
+            )
+        self.panel = panel
+        return panel
+
+    def evaluator(self, settings: dict = DEFAULT_SETTINGS) -> DagEvaluator:
+        return DagEvaluator(
+            self.panel, dtype=self.dtype, nan_handling=nan_handling_on(settings)
+        )
+
+    def warm_up(self):
+        """先顺序读一遍面板文件，载入页缓存，避免首个操作符承担磁盘 I/O；
+        用普通读而不是 mmap，映射的页不计入本进程的 RSS"""
+        for path in sorted(self.panel.path.rglob("*.npy")):
+            with open(path, "rb") as f:
+                while f.read(1 << 24):
+                    pass
+
+    def bench_operators(self) -> List[dict]:
+        rs = []
+        for name, expression in operator_expressions().items():
+            baseline = reset_peak_rss()
+            evaluator = self.evaluator()
+            best, typical = timed(lambda: evaluator.evaluate([expression]), self.repeat)
+            rs.append(self.row(name, best, typical, baseline))
+        return rs
+
+    def bench_simulator(self) -> List[dict]:
+        simulator = Simulator(self.panel, dtype=self.dtype)
+        alpha = self.evaluator().evaluate(["rank(-ts_delta(close, 5))"])[0]
+        rs = []
+        for neutralization in ("MARKET", "SUBINDUSTRY"):
+            settings = {**DEFAULT_SETTINGS, "neutralization": neutralization}
+            baseline = reset_peak_rss()
+            best, typical = timed(lambda: simulator.run(alpha, settings), self.repeat)
+            name = f"simulate/{neutralization.lower()}"
+            rs.append(self.row(name, best, typical, baseline))
+        return rs
+
+    def row(self, name: str, best: float, typical: float, baseline: float) -> dict:
+        return {
+            "name": name,
+            "seconds": round(best, 6),
+            "median_seconds": round(typical, 6),
+            "cells_per_second": round(self.cells / best) if best else None,
+            **memory(baseline),
+        }
+
+    def bench_expressions(self) -> List[dict]:
+        """单条求值与回测，不共享子表达式也不使用节点缓存"""
+        simulator = Simulator(self.panel, dtype=self.dtype)
+        rs = []
+        for source, candidate in self.expressions:
+            baseline = reset_peak_rss()
+            evaluator = self.evaluator(candidate.settings)
+            started = time.perf_counter()
+            value = evaluator.evaluate([candidate.expression])[0]
+            evaluated = time.perf_counter()
+            row = {"source": source, "expression": candidate.expression}
+            if isinstance(value, Exception):
+                row["error"] = f"evaluate: {value}"
+            else:
+                try:
+                    simulator.run(value, candidate.settings)
+                except (KeyError, ValueError) as e:
+                    row["error"] = f"simulate: {e}"
+            row["evaluate_seconds"] = round(evaluated - started, 6)
+            row["simulate_seconds"] = round(time.perf_counter() - evaluated, 6)
+            row.update(memory(baseline))
+            rs.append(row)
+        return rs
+
+    def bench_batch(self) -> dict:
+        """整批交给 BatchScorer，公共子表达式只算一次"""
+        candidates = [c for _, c in self.expressions]
+        baseline = reset_peak_rss()
+        started = time.perf_counter()
+        errors = sum(
+            bool(row.error)
+            for row in BatchScorer(self.panel, self.processes).score(candidates)
+        )
+        seconds = time.perf_counter() - started
+        dag = compile_expressions([c.expression for c in candidates])
+        return {
+            "expressions": len(candidates),
+            "errors": errors,
+            "processes": self.processes,
+            "seconds": round(seconds, 6),
+            "expressions_per_second": round(len(candidates) / seconds, 3),
+            "dag_nodes": len(dag.nodes),
+            "dag_requested": dag.requested,
+            **memory(baseline),
+        }
+
+    @staticmethod
+    def summarize(expressions: List[dict]) -> dict:
+        totals = sorted(
+            r["evaluate_seconds"] + r["simulate_seconds"]
+            for r in expressions
+            if "error" not in r
+        )
+        if not totals:
+            return {}
+        return {
+            "count": len(totals),
+            "p50_seconds": round(float(np.percentile(totals, 50)), 6),
+            "p95_seconds": round(float(np.percentile(totals, 95)), 6),
+            "max_seconds": round(totals[-1], 6),
+        }
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        self.prepare()
+        self.warm_up()
+        expressions = self.bench_expressions()
+        return {
+            "meta": {
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "shape": list(self.shape),
+                "dtype": self.dtype.name,
+                "repeat": self.repeat,
+                "seed": self.seed,
+            },
+            "operators": self.bench_operators() + self.bench_simulator(),
+            "expressions": expressions,
+            "latency": self.summarize(expressions),
+            "batch": self.bench_batch(),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+
+def write_result(result: dict, path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(result, indent=2, ensure_ascii=False, sort_keys=True) + "\n",
+        encoding="utf-8",
+    )
+
+
+def compare(old: dict, new: dict) -> List[Tuple[str, float, float, float]]:
+    """按名称对比两份结果的操作符耗时与批量吞吐，返回 (名称, 旧, 新, 新/旧)"""
+    before = {r["name"]: r["seconds"] for r in old.get("operators", [])}
+    rs = []
+    for row in new.get("operators", []):
+        if before.get(row["name"]):
+            old_s, new_s = before[row["name"]], row["seconds"]
+            rs.append((row["name"], old_s, new_s, new_s / old_s))
+    for key in ("p50_seconds", "p95_seconds"):
+        old_s, new_s = old.get("latency", {}).get(key), new.get("latency", {}).get(key)
+        if old_s and new_s:
+            rs.append((f"latency/{key}", old_s, new_s, new_s / old_s))
+    old_s = old.get("batch", {}).get("seconds")
+    new_s = new.get("batch", {}).get("seconds")
+    if old_s and new_s:
+        rs.append(("batch", old_s, new_s, new_s / old_s))
+    return rs
@@ -0,0 +1,93 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from config import settings
+
+from .panel import _save
+
+CACHE_DIR = Path(settings.DATA_DIR) / "node_cache"
+
+
+class NodeCache:
+    """按内容寻址的求值结果磁盘缓存
+
+    键为子表达式的规范哈希（含面板版本与求值选项，见 ExpressionDag.content_keys），
+    每个键一个 .npy 文件，读取时以只读 mmap 打开并刷新修改时间；
+    总大小超过 max_bytes 时按修改时间从旧到新淘汰（LRU），降到预算的 low_water 比例。
+    写入先写临时文件再替换，多个进程可共用同一目录
+    """
+
+    def __init__(
+        self,
+        root: Path = CACHE_DIR,
+        max_bytes: int = 20 << 30,
+        low_water: float = 0.8,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.npy"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # 不存在，或正被其他进程淘汰 / 写了一半
+            self.misses += 1
+            return None
+        self.hits += 1
+        return array
+
+    def put(self, key: str, array: np.ndarray):
+        path = self.path(key)
+        if path.exists():
+            return
+        array = np.asarray(array)
+        _save(path, array)
+        if self.size is None:
+            self.size = self.scan_size()
+        else:
+            self.size += array.nbytes
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def files(self):
+        return self.root.glob("*/*.npy")
+
+    def scan_size(self) -> int:
+        total = 0
+        for path in self.files():
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                continue
+        return total
+
+    def evict(self):
+        entries = []
+        for path in self.files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_water
+        for _, size, path in entries:
+            if total <= target:
+                break
+            # 已 mmap 打开的读者不受删除影响
+            path.unlink(missing_ok=True)
+            total -= size
+        self.size = total
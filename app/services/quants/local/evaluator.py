@@ -0,0 +1,516 @@
+"""把一批 FASTEXPR 表达式编译成一张共享子表达式的 DAG，并在本地面板上求值
+
+- 编译时做 hash-consing：节点以 (操作符, 输入节点, 参数) 为键，结构相同的子树只建一次；
+  局部变量展开为其定义，交换律操作符的输入排序，a + b 与 add(b, a) 共享同一节点
+- 求值按节点创建顺序（即各表达式的后序遍历顺序）进行，每个节点只算一次，
+  记录剩余消费者数，最后一个消费者算完即释放中间结果
+- 可选的 NodeCache 以节点内容哈希跨批次、跨进程复用结果：命中的节点直接读盘，
+  其下的整棵子树不再求值
+"""
+
+import hashlib
+import inspect
+from functools import lru_cache
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from app.common.expression import (
+    Assign,
+    Binary,
+    Call,
+    ExpressionSyntaxError,
+    Name,
+    Node,
+    Num,
+    Program,
+    Str,
+    Ternary,
+    Unary,
+    parse_expression,
+)
+
+from .cache import NodeCache
+from .group import GROUP_KERNELS, GroupCache, GroupIndex
+from .kernels import TS_KERNELS, TS_PAIR_KERNELS
+from .panel import Panel
+from .vector import VECTOR_KERNELS
+
+
+class EvaluationError(ValueError):
+    """表达式含本地不支持的操作符、字段或参数形式"""
+
+
+class DagNode(NamedTuple):
+    op: str
+    inputs: Tuple[int, ...]
+    params: tuple = ()
+
+
+def _compare(fn):
+    def apply(a, b):
+        with np.errstate(invalid="ignore"):
+            out = fn(a, b).astype(np.float64)
+        return np.where(np.isnan(a) | np.isnan(b), np.nan, out)
+
+    return apply
+
+
+def _truth(x):
+    return np.where(np.isnan(x), np.nan, (x != 0).astype(np.float64))
+
+
+def _signed_power(x, y):
+    return np.sign(x) * np.abs(x) ** y
+
+
+def _if_else(cond, then, otherwise):
+    return np.where(np.isnan(cond), np.nan, np.where(cond != 0, then, otherwise))
+
+
+# 逐元素操作符
+ELEMENTWISE: Dict[str, Callable] = {
+    "add": np.add,
+    "subtract": np.subtract,
+    "multiply": np.multiply,
+    "divide": np.divide,
+    "power": np.power,
+    "signed_power": _signed_power,
+    "max": np.maximum,
+    "min": np.minimum,
+    "abs": np.abs,
+    "log": np.log,
+    "sqrt": np.sqrt,
+    "sign": np.sign,
+    "reverse": np.negative,
+    "inverse": np.reciprocal,
+    "less": _compare(np.less),
+    "greater": _compare(np.greater),
+    "less_equal": _compare(np.less_equal),
+    "greater_equal": _compare(np.greater_equal),
+    "equal": _compare(np.equal),
+    "not_equal": _compare(np.not_equal),
+    "and": lambda a, b: _truth(_truth(a) * _truth(b)),
+    "or": lambda a, b: _truth(_truth(a) + _truth(b)),
+    "not": lambda a: 1 - _truth(a),
+    "if_else": _if_else,
+}
+
+# 可接受任意个参数、按顺序两两归约的操作符
+VARIADIC = {"add", "multiply", "max", "min"}
+COMMUTATIVE = {"add", "multiply", "max", "min", "equal", "not_equal", "and", "or"}
+
+# 截面操作符，按日期在全市场上计算，等价于 market 分组上的 group 操作
+CROSS_SECTION = {"rank": "group_rank", "zscore": "group_zscore"}
+
+INFIX = {
+    "+": "add",
+    "-": "subtract",
+    "*": "multiply",
+    "/": "divide",
+    "^": "power",
+    "<": "less",
+    ">": "greater",
+    "<=": "less_equal",
+    ">=": "greater_equal",
+    "==": "equal",
+    "!=": "not_equal",
+    "&&": "and",
+    "||": "or",
+}
+
+UNARY = {"-": "reverse", "!": "not"}
+
+# 分组参数除字段名外，也可以是分组的 cartesian product
+GROUP_PRODUCT = "group_cartesian_product"
+
+
+@lru_cache(maxsize=None)
+def _accepts(fn: Callable) -> frozenset:
+    return frozenset(inspect.signature(fn).parameters)
+
+
+def _call(fn: Callable, *args, **options):
+    """只传入 fn 声明过的可选参数（如 nan_handling、dtype）"""
+    accepted = _accepts(fn)
+    return fn(*args, **{k: v for k, v in options.items() if k in accepted})
+
+
+class ExpressionDag:
+    """一批表达式编译后的 DAG，roots[i] 为第 i 个表达式的输出节点（编译失败为 None）"""
+
+    def __init__(self):
+        self.nodes: List[DagNode] = []
+        self.ids: Dict[DagNode, int] = {}
+        self.roots: List[Optional[int]] = []
+        self.errors: Dict[int, str] = {}
+        # 编译时请求的节点数（含重复），与 len(nodes) 之比即公共子表达式的复用程度
+        self.requested = 0
+
+    def intern(self, op: str, inputs=(), params=()) -> int:
+        self.requested += 1
+        if op in COMMUTATIVE:
+            inputs = tuple(sorted(inputs))
+        node = DagNode(op, tuple(inputs), tuple(params))
+        node_id = self.ids.get(node)
+        if node_id is None:
+            node_id = self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return node_id
+
+    def add(self, expression: str) -> Optional[int]:
+        try:
+            root = self.lower_program(parse_expression(expression))
+        except (EvaluationError, ExpressionSyntaxError) as e:
+            self.errors[len(self.roots)] = str(e)
+            root = None
+        self.roots.append(root)
+        return root
+
+    def lower_program(self, program: Program) -> int:
+        env: Dict[str, int] = {}
+        root = None
+        for statement in program.statements:
+            if isinstance(statement, Assign):
+                env[statement.name.lower()] = self.lower(statement.value, env)
+            else:
+                root = self.lower(statement, env)
+        if root is None:
+            raise EvaluationError("expression has no output statement")
+        return root
+
+    def lower(self, node: Node, env: Dict[str, int]) -> int:
+        if isinstance(node, Num):
+            return self.intern("const", params=(node.value,))
+        if isinstance(node, Name):
+            name = node.name.lower()
+            if name in env:
+                return env[name]
+            if name in ("true", "false"):
+                return self.intern("const", params=(float(name == "true"),))
+            if name == "nan":
+                return self.intern("const", params=(np.nan,))
+            return self.intern("field", params=(name,))
+        if isinstance(node, Str):
+            raise EvaluationError(f"string literal {node.text} is not supported")
+        if isinstance(node, Unary):
+            operand = self.lower(node.operand, env)
+            if node.op == "+":
+                return operand
+            return self.intern(UNARY[node.op], (operand,))
+        if isinstance(node, Binary):
+            op = INFIX.get(node.op)
+            if op is None:
+                raise EvaluationError(f"operator {node.op} is not supported")
+            return self.intern(
+                op, (self.lower(node.left, env), self.lower(node.right, env))
+            )
+        if isinstance(node, Ternary):
+            return self.intern(
+                "if_else",
+                tuple(
+                    self.lower(n, env) for n in (node.cond, node.then, node.otherwise)
+                ),
+            )
+        if isinstance(node, Call):
+            return self.lower_call(node, env)
+        raise EvaluationError(f"unsupported node {node!r}")
+
+    def lower_group(self, node: Node) -> int:
+        if isinstance(node, Name):
+            return self.intern("group", params=(node.name.lower(),))
+        if isinstance(node, Call) and node.name.lower() == GROUP_PRODUCT:
+            names = []
+            for arg in node.args:
+                if not isinstance(arg, Name):
+                    raise EvaluationError(f"unsupported group {arg!r}")
+                names.append(arg.name.lower())
+            return self.intern("group", params=tuple(names))
+        raise EvaluationError(f"unsupported group {node!r}")
+
+    def const_params(self, call: Call) -> tuple:
+        params = []
+        for key, value in call.kwargs:
+            if isinstance(value, Num):
+                params.append((key.lower(), value.value))
+            elif isinstance(value, Name) and value.name.lower() in ("true", "false"):
+                params.append((key.lower(), value.name.lower() == "true"))
+            else:
+                raise EvaluationError(f"{call.name}: keyword {key} must be a constant")
+        return tuple(sorted(params))
+
+    def window(self, call: Call, index: int) -> int:
+        if len(call.args) <= index or not isinstance(call.args[index], Num):
+            raise EvaluationError(f"{call.name}: window must be a number")
+        return int(call.args[index].value)
+
+    def lower_call(self, call: Call, env: Dict[str, int]) -> int:
+        name = call.name.lower()
+        args = call.args
+        if name in VECTOR_KERNELS:
+            # 向量字段只能直接作为 vec_* 的参数，归约结果是普通的面板节点
+            if len(args) != 1 or not isinstance(args[0], Name) or call.kwargs:
+                raise EvaluationError(f"{name}: expected a vector field name")
+            return self.intern(name, params=(args[0].name.lower(),))
+        if name in TS_KERNELS:
+            x = self.lower(args[0], env)
+            return self.intern(
+                name, (x,), (self.window(call, 1),) + self.const_params(call)
+            )
+        if name in TS_PAIR_KERNELS:
+            inputs = (self.lower(args[0], env), self.lower(args[1], env))
+            return self.intern(
+                name, inputs, (self.window(call, 2),) + self.const_params(call)
+            )
+        if name in GROUP_KERNELS or name in CROSS_SECTION:
+            kernel = CROSS_SECTION.get(name, name)
+            x = self.lower(args[0], env)
+            if name in CROSS_SECTION:
+                group = self.intern("group", params=("market",))
+                weight = ()
+            elif kernel == "group_mean" and len(args) == 3:
+                weight = (self.lower(args[1], env),)
+                group = self.lower_group(args[2])
+            else:
+                if len(args) != 2:
+                    raise EvaluationError(f"{name}: expected (x, group)")
+                weight = ()
+                group = self.lower_group(args[1])
+            return self.intern(kernel, (x, group) + weight, self.const_params(call))
+        if name in ELEMENTWISE:
+            if call.kwargs:
+                raise EvaluationError(f"{name}: keyword arguments are not supported")
+            inputs = [self.lower(a, env) for a in args]
+            if name in VARIADIC and len(inputs) > 2:
+                # 排序后两两归约，add(a, b, c) 与 add(c, a, b) 得到同一组节点
+                inputs.sort()
+                node_id = inputs[0]
+                for other in inputs[1:]:
+                    node_id = self.intern(name, (node_id, other))
+                return node_id
+            return self.intern(name, inputs)
+        raise EvaluationError(f"operator {name} is not supported locally")
+
+    def consumers(self, cached: Collection[int] = ()) -> List[int]:
+        """每个节点被多少个节点或输出引用
+
+        cached 中的节点无需求值，只统计从输出出发、不经过 cached 节点可达的引用
+        """
+        needed = [False] * len(self.nodes)
+        counts = [0] * len(self.nodes)
+        for root in self.roots:
+            if root is not None:
+                needed[root] = True
+                counts[root] += 1
+        # 节点按后序创建，输入的序号总小于自身，倒序一遍即可传播
+        for node_id in range(len(self.nodes) - 1, -1, -1):
+            if not needed[node_id] or node_id in cached:
+                continue
+            for i in self.nodes[node_id].inputs:
+                needed[i] = True
+                counts[i] += 1
+        return counts
+
+    def content_keys(self, salt: str = "") -> List[str]:
+        """每个节点的内容哈希，只取决于子树结构，与节点序号、所在批次无关
+
+        salt 用于区分面板版本与求值选项；交换律操作符的输入按哈希排序
+        """
+        keys: List[str] = []
+        for node in self.nodes:
+            inputs = [keys[i] for i in node.inputs]
+            if node.op in COMMUTATIVE:
+                inputs.sort()
+            text = f"{salt}|{node.op}|{node.params!r}|{','.join(inputs)}"
+            keys.append(hashlib.md5(text.encode()).hexdigest())
+        return keys
+
+
+def compile_expressions(expressions: List[str]) -> ExpressionDag:
+    dag = ExpressionDag()
+    for expression in expressions:
+        dag.add(expression)
+    return dag
+
+
+Value = Union[np.ndarray, float, GroupIndex]
+
+
+class DagEvaluator:
+    """在一个面板上求值 ExpressionDag
+
+    dtype 为中间结果与输出的精度；nan_handling 对应 settings 中的 nanHandling；
+    cache 不为空时，时序 / 分组操作符节点写入磁盘缓存供后续批次复用；表达式输出是
+    整张面板且很少复用，不缓存，以免挤掉 LRU 预算里的公共子表达式
+    """
+
+    def __init__(
+        self,
+        panel: Panel,
+        dtype=np.float32,
+        nan_handling: bool = False,
+        groups: Optional[GroupCache] = None,
+        cache: Optional[NodeCache] = None,
+    ):
+        self.panel = panel
+        self.dtype = np.dtype(dtype)
+        self.nan_handling = nan_handling
+        self.groups = groups or GroupCache(panel.group, panel.shape)
+        self.cache = cache
+        self.peak_live = 0
+
+    def cache_salt(self) -> str:
+        return f"{self.panel.version}|{self.dtype.str}|{int(self.nan_handling)}"
+
+    @staticmethod
+    def cacheable(node: DagNode) -> bool:
+        """只缓存计算代价高的节点，逐元素运算重算比读盘更快"""
+        return (
+            node.op in TS_KERNELS
+            or node.op in TS_PAIR_KERNELS
+            or (node.op in GROUP_KERNELS)
+        )
+
+    def load_cached(self, dag: ExpressionDag, keys: List[str]) -> Dict[int, Value]:
+        cached = {}
+        for node_id, node in enumerate(dag.nodes):
+            if self.cacheable(node):
+                array = self.cache.get(keys[node_id])
+                if array is not None:
+                    cached[node_id] = array
+        return cached
+
+    def apply(self, node: DagNode, args: List[Value]) -> Value:
+        op, params = node.op, node.params
+        if op == "const":
+            return params[0]
+        if op == "field":
+            try:
+                field = self.panel.field(params[0])
+            except KeyError as e:
+                raise EvaluationError(str(e.args[0])) from None
+            # dtype 一致时直接返回 mmap 视图，不拷贝
+            return np.asarray(field, dtype=self.dtype)
+        if op == "group":
+            try:
+                return self.groups.get(*params)
+            except KeyError as e:
+                raise EvaluationError(str(e.args[0])) from None
+        if op in VECTOR_KERNELS:
+            try:
+                vector = self.panel.vector(params[0])
+            except KeyError as e:
+                raise EvaluationError(str(e.args[0])) from None
+            return VECTOR_KERNELS[op](vector, dtype=self.dtype)
+        options = {"nan_handling": self.nan_handling, "dtype": self.dtype}
+        if op in TS_KERNELS:
+            return _call(
+                TS_KERNELS[op],
+                self._array(args[0]),
+                params[0],
+                **dict(params[1:]),
+                **options,
+            )
+        if op in TS_PAIR_KERNELS:
+            x, y = (self._array(a) for a in args)
+            return _call(
+                TS_PAIR_KERNELS[op], x, y, params[0], **dict(params[1:]), **options
+            )
+        if op in GROUP_KERNELS:
+            x, index, *weight = args
+            if weight:
+                options["weight"] = self._array(weight[0])
+            return _call(
+                GROUP_KERNELS[op], self._array(x), index, **dict(params), **options
+            )
+        with np.errstate(all="ignore"):
+            out = ELEMENTWISE[op](*args)
+        return np.asarray(out, dtype=self.dtype)
+
+    def _array(self, value: Value) -> np.ndarray:
+        """常量参与面板操作时扩展成整张面板"""
+        if isinstance(value, np.ndarray) and value.ndim == 2:
+            return value
+        return np.full(self.panel.shape, value, dtype=self.dtype)
+
+    def iter_evaluate(
+        self, dag: ExpressionDag
+    ) -> Iterator[Tuple[int, Optional[np.ndarray], Optional[str]]]:
+        """按输出就绪的顺序产出 (表达式序号, 结果, 错误)
+
+        结果为只读共享数据，调用方需在取下一个结果前用完或自行拷贝
+        """
+        for i, error in dag.errors.items():
+            yield i, None, error
+        keys, cached = [], {}
+        if self.cache is not None:
+            keys = dag.content_keys(self.cache_salt())
+            cached = self.load_cached(dag, keys)
+        remaining = dag.consumers(cached)
+        outputs: Dict[int, List[int]] = {}
+        for i, root in enumerate(dag.roots):
+            if root is not None:
+                outputs.setdefault(root, []).append(i)
+        values: Dict[int, Value] = {}
+        failed: Dict[int, str] = {}
+        for node_id, node in enumerate(dag.nodes):
+            if remaining[node_id] == 0:
+                continue
+            error = None
+            hit = node_id in cached
+            if hit:
+                values[node_id] = cached.pop(node_id)
+            else:
+                error = next((failed[i] for i in node.inputs if i in failed), None)
+            if error is None and node_id not in values:
+                try:
+                    values[node_id] = self.apply(node, [values[i] for i in node.inputs])
+                except EvaluationError as e:
+                    error = str(e)
+                else:
+                    if self.cache is not None:
+                        self.store(node, keys[node_id], values[node_id])
+            if error is not None:
+                failed[node_id] = error
+            self.peak_live = max(self.peak_live, len(values))
+            # 命中缓存的节点不引用输入，consumers 也没有为它计数
+            if not hit:
+                for i in node.inputs:
+                    self._release(i, remaining, values, failed)
+            for i in outputs.get(node_id, ()):
+                error = failed.get(node_id)
+                yield i, None if error else self._array(values[node_id]), error
+                self._release(node_id, remaining, values, failed)
+
+    def store(self, node: DagNode, key: str, value):
+        if not isinstance(value, np.ndarray) or value.ndim != 2:
+            return
+        if self.cacheable(node):
+            self.cache.put(key, value)
+
+    @staticmethod
+    def _release(node_id: int, remaining: List[int], values: dict, failed: dict):
+        remaining[node_id] -= 1
+        if remaining[node_id] == 0:
+            values.pop(node_id, None)
+            failed.pop(node_id, None)
+
+    def evaluate(
+        self, expressions: List[str]
+    ) -> List[Union[np.ndarray, EvaluationError]]:
+        """求值一批表达式，失败的位置为 EvaluationError"""
+        dag = compile_expressions(expressions)
+        results: List[Union[np.ndarray, EvaluationError]] = [None] * len(expressions)
+        for i, value, error in self.iter_evaluate(dag):
+            results[i] = EvaluationError(error) if error else value
+        return results
@@ -0,0 +1,250 @@
+"""多进程批量评估候选 alpha
+
+面板字段本身是只读 mmap，各进程共享同一份页缓存；需要计算才能得到的只读数组
+（分组扁平编号、NaN 置 0 的收益）由主进程算好一次放入共享内存，子进程按名字
+attach 成 ndarray 视图。候选按块分发，子进程只接收表达式与 settings、只返回指标行，
+不拷贝也不 pickle 任何面板数组，内存峰值约为一份面板加各进程自己的中间结果。
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .cache import NodeCache
+from .evaluator import DagEvaluator, compile_expressions
+from .group import GroupCache, GroupIndex
+from .kernels import nan_handling_on
+from .panel import Panel
+from .simulator import Simulator
+
+# 名字 -> (共享内存名, 形状, dtype)
+ArraySpecs = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+class Candidate(NamedTuple):
+    expression: str
+    settings: dict
+
+
+class ScoreRow(NamedTuple):
+    """index 为候选在输入中的序号；error 以 evaluate: / simulate: 开头"""
+
+    index: int
+    metrics: dict
+    error: str = ""
+
+
+class SharedArrays:
+    """主进程创建的一组共享内存数组，退出上下文时释放"""
+
+    def __init__(self):
+        self.blocks: List[SharedMemory] = []
+        self.specs: ArraySpecs = {}
+
+    def put(self, name: str, array: np.ndarray):
+        array = np.ascontiguousarray(array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(specs: ArraySpecs) -> Tuple[Dict[str, np.ndarray], List[SharedMemory]]:
+    """子进程按名字打开共享内存，返回只读视图；blocks 需与视图同生命周期"""
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in specs.items():
+        # 进程池的子进程与主进程共用一个资源跟踪器，释放统一由主进程 unlink 负责
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays, blocks
+
+
+def group_names(candidates: Sequence[Candidate]) -> Set[Tuple[str, ...]]:
+    """候选会用到的分组：表达式中的 group 叶子节点与 settings 中的 neutralization"""
+    names = {
+        node.params
+        for node in compile_expressions([c.expression for c in candidates]).nodes
+        if node.op == "group"
+    }
+    for c in candidates:
+        neutralization = str(c.settings.get("neutralization") or "NONE").lower()
+        if neutralization not in ("none", "market"):
+            names.add((neutralization,))
+    return names
+
+
+class Scorer:
+    """单个进程内的评估器，按 nanHandling 复用 DagEvaluator，与回测器共用分组索引"""
+
+    def __init__(
+        self,
+        panel: Panel,
+        simulator: Simulator,
+        dtype=np.float32,
+        cache: Optional[NodeCache] = None,
+    ):
+        self.panel = panel
+        self.simulator = simulator
+        self.dtype = dtype
+        self.cache = cache
+        self.evaluators: Dict[bool, DagEvaluator] = {}
+
+    def evaluator(self, nan_handling: bool) -> DagEvaluator:
+        if nan_handling not in self.evaluators:
+            self.evaluators[nan_handling] = DagEvaluator(
+                self.panel,
+                dtype=self.dtype,
+                nan_handling=nan_handling,
+                groups=self.simulator.groups,
+                cache=self.cache,
+            )
+        return self.evaluators[nan_handling]
+
+    def score(self, chunk: Sequence[Tuple[int, Candidate]]) -> List[ScoreRow]:
+        """同一块内按 nanHandling 各编译一个 DAG，公共子表达式只算一次"""
+        by_nan: Dict[bool, List[Tuple[int, Candidate]]] = {}
+        for index, candidate in chunk:
+            by_nan.setdefault(nan_handling_on(candidate.settings), []).append(
+                (index, candidate)
+            )
+        rows = []
+        for nan_handling, members in by_nan.items():
+            dag = compile_expressions([c.expression for _, c in members])
+            for i, value, error in self.evaluator(nan_handling).iter_evaluate(dag):
+                index, candidate = members[i]
+                if error:
+                    rows.append(ScoreRow(index, {}, f"evaluate: {error}"))
+                    continue
+                try:
+                    result = self.simulator.run(value, candidate.settings)
+                except (KeyError, ValueError) as e:
+                    rows.append(ScoreRow(index, {}, f"simulate: {e}"))
+                    continue
+                metrics = {k: round(v, 6) for k, v in result.as_dict().items()}
+                rows.append(ScoreRow(index, metrics))
+        return rows
+
+
+_worker_scorer: Optional[Scorer] = None
+_worker_blocks: List[SharedMemory] = []
+
+
+def _init_worker(
+    root: str,
+    key: Tuple[str, int, str],
+    specs: ArraySpecs,
+    group_sizes: Dict[Tuple[str, ...], int],
+    dtype: str,
+    cache: Optional[NodeCache],
+):
+    global _worker_scorer, _worker_blocks
+    arrays, _worker_blocks = attach(specs)
+    panel = Panel(root, *key)
+    groups = GroupCache(panel.group, panel.shape)
+    for names, n_groups in group_sizes.items():
+        prefix = "*".join(names)
+        index = GroupIndex.from_arrays(
+            arrays[f"{prefix}.ids"], arrays[f"{prefix}.flat"], n_groups, panel.shape
+        )
+        groups.put(index, *names)
+    simulator = Simulator(
+        panel, groups=groups, dtype=dtype, realized=arrays["realized"]
+    )
+    _worker_scorer = Scorer(panel, simulator, dtype, cache)
+
+
+def _score_chunk(chunk: List[Tuple[int, Candidate]]) -> List[ScoreRow]:
+    return _worker_scorer.score(chunk)
+
+
+class BatchScorer:
+    """在一个面板上批量评估并回测候选，按块完成的顺序产出指标行
+
+    processes <= 1 时在当前进程内执行；否则共享只读数组后分发到进程池，
+    块大小决定 DAG 公共子表达式复用的范围与负载均衡的粒度；
+    cache 为所有进程共用的磁盘节点缓存目录
+    """
+
+    def __init__(
+        self,
+        panel: Panel,
+        processes: Optional[int] = None,
+        chunk_size: int = 50,
+        dtype=np.float32,
+        cache: Optional[NodeCache] = None,
+    ):
+        self.panel = panel
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.cache = cache
+
+    def chunks(self, candidates: Sequence[Candidate]):
+        indexed = list(enumerate(candidates))
+        return [
+            indexed[i : i + self.chunk_size]
+            for i in range(0, len(indexed), self.chunk_size)
+        ]
+
+    def share(
+        self, shared: SharedArrays, candidates: Sequence[Candidate]
+    ) -> Dict[Tuple[str, ...], int]:
+        """把收益与候选用到的分组索引放入共享内存，返回 {分组名: 组数}"""
+        simulator = Simulator(self.panel, dtype=self.dtype)
+        shared.put("realized", simulator.realized)
+        group_sizes = {}
+        for names in group_names(candidates):
+            try:
+                index = simulator.groups.get(*names)
+            except KeyError:
+                # 面板缺少该分组，交给子进程按求值错误处理
+                continue
+            prefix = "*".join(names)
+            shared.put(f"{prefix}.ids", index.ids)
+            shared.put(f"{prefix}.flat", index.flat)
+            group_sizes[names] = index.n_groups
+        return group_sizes
+
+    def score(self, candidates: Sequence[Candidate]) -> Iterator[ScoreRow]:
+        chunks = self.chunks(candidates)
+        if self.processes <= 1 or len(chunks) <= 1:
+            simulator = Simulator(self.panel, dtype=self.dtype)
+            scorer = Scorer(self.panel, simulator, self.dtype, self.cache)
+            for chunk in chunks:
+                yield from scorer.score(chunk)
+            return
+        with SharedArrays() as shared:
+            group_sizes = self.share(shared, candidates)
+            with ProcessPoolExecutor(
+                max_workers=min(self.processes, len(chunks)),
+                initializer=_init_worker,
+                initargs=(
+                    str(self.panel.path.parent),
+                    self.panel.key,
+                    shared.specs,
+                    group_sizes,
+                    self.dtype.str,
+                    self.cache,
+                ),
+            ) as pool:
+                futures = [pool.submit(_score_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    yield from future.result()
@@ -0,0 +1,232 @@
+"""FASTEXPR group_* 操作符的向量化实现
+
+分组编号为 (n_instruments,) 或 (n_dates, n_instruments) 的整数数组。
+把 (日期, 分组) 编成一个扁平编号 t * n_groups + g 后，所有日期的所有分组
+只需一次 bincount 聚合或一次按行批量排序，不按日期或分组做 Python 循环。
+"""
+
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from .kernels import out_dtype
+
+
+def compact(ids: np.ndarray) -> Tuple[np.ndarray, int]:
+    """把任意整数编号压缩为 0..k-1，返回 (编号, k)"""
+    uniques, inverse = np.unique(ids, return_inverse=True)
+    return inverse.reshape(ids.shape).astype(np.int32), len(uniques)
+
+
+def cartesian_product(*groups: np.ndarray) -> np.ndarray:
+    """group_cartesian_product：各分组取值组合成新的分组编号"""
+    shape = np.broadcast_shapes(*(np.shape(g) for g in groups))
+    combined = np.zeros(shape, dtype=np.int64)
+    for g in groups:
+        g = np.asarray(g, dtype=np.int64)
+        combined = combined * (int(g.max(initial=0)) + 1) + g
+    return compact(combined)[0]
+
+
+class GroupIndex:
+    """某个面板形状上的一种分组，预先算好扁平编号与各组样本数，可被多个操作复用"""
+
+    def __init__(self, group: np.ndarray, shape: Tuple[int, int]):
+        ids, n_groups = compact(np.asarray(group))
+        offsets = np.arange(shape[0], dtype=np.int64)[:, None] * n_groups
+        self._setup(ids, np.broadcast_to(ids, shape) + offsets, n_groups, shape)
+
+    def _setup(self, ids: np.ndarray, flat: np.ndarray, n_groups: int, shape):
+        # ids 为压缩后的原始形状编号，与 flat 一起可直接重建索引
+        self.ids = ids
+        self.n_groups = n_groups
+        self.shape = shape
+        self.group = np.broadcast_to(ids, shape)
+        self.flat = flat
+        self.size = shape[0] * n_groups
+
+    @classmethod
+    def from_arrays(
+        cls, ids: np.ndarray, flat: np.ndarray, n_groups: int, shape
+    ) -> "GroupIndex":
+        """用已算好的数组（例如共享内存中的视图）构造，不重新计算也不拷贝"""
+        index = cls.__new__(cls)
+        index._setup(ids, flat, n_groups, tuple(shape))
+        return index
+
+    def _valid(self, x: np.ndarray) -> np.ndarray:
+        return ~np.isnan(x)
+
+    def counts(self, valid: np.ndarray) -> np.ndarray:
+        return np.bincount(self.flat[valid], minlength=self.size)
+
+    def sums(self, values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        return np.bincount(self.flat[valid], weights=values[valid], minlength=self.size)
+
+    def broadcast(self, per_group: np.ndarray, valid: np.ndarray, dtype):
+        """把每组的统计量放回每个样本的位置，原值为 NaN 的位置仍为 NaN"""
+        out = np.full(self.shape, np.nan, dtype=dtype)
+        out[valid] = per_group[self.flat[valid]]
+        return out
+
+    def mean(self, x: np.ndarray, weight: Optional[np.ndarray] = None, dtype=None):
+        valid = self._valid(x)
+        if weight is None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                per_group = self.sums(x, valid) / self.counts(valid)
+        else:
+            weight = np.broadcast_to(weight, self.shape)
+            valid &= ~np.isnan(weight)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                per_group = self.sums(x * weight, valid) / self.sums(weight, valid)
+        return self.broadcast(per_group, valid, out_dtype(x, dtype))
+
+    def sum(self, x: np.ndarray, dtype=None):
+        valid = self._valid(x)
+        return self.broadcast(self.sums(x, valid), valid, out_dtype(x, dtype))
+
+    def count(self, x: np.ndarray, dtype=None):
+        valid = self._valid(x)
+        return self.broadcast(self.counts(valid), valid, out_dtype(x, dtype))
+
+    def _moments(self, x: np.ndarray):
+        """两遍计算组内均值与总体方差，先减组均值再平方，避免相消误差"""
+        valid = self._valid(x)
+        counts = self.counts(valid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sums(x, valid) / counts
+            deviation = np.where(valid, x - mean[self.flat], 0)
+            var = self.sums(deviation * deviation, valid) / counts
+        return valid, mean, var, deviation
+
+    def std(self, x: np.ndarray, dtype=None):
+        valid, _, var, _ = self._moments(x)
+        return self.broadcast(np.sqrt(var), valid, out_dtype(x, dtype))
+
+    def zscore(self, x: np.ndarray, dtype=None):
+        valid, _, var, deviation = self._moments(x)
+        std = np.sqrt(var)[self.flat]
+        out = np.full(self.shape, np.nan, dtype=out_dtype(x, dtype))
+        ok = valid & (std > 0)
+        out[ok] = deviation[ok] / std[ok]
+        return out
+
+    def neutralize(self, x: np.ndarray, dtype=None):
+        """只需组均值，不计算方差"""
+        valid = self._valid(x)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sums(x, valid) / self.counts(valid)
+        out = np.full(self.shape, np.nan, dtype=out_dtype(x, dtype))
+        out[valid] = x[valid] - mean[self.flat[valid]]
+        return out
+
+    def rank(self, x: np.ndarray, dtype=None):
+        """组内排名缩放到 [0, 1]，并列取平均名次，组内只有一个样本时为 0.5
+
+        每个日期一行：先按取值排序，再按组号稳定排序（整数排序为基数排序），
+        得到按 (组号, 取值) 有序的排列，名次即位置减去所在组的起点。
+        NaN 归入额外的组号 n_groups，不参与排名
+        """
+        valid = self._valid(x)
+        group = np.where(valid, self.group, self.n_groups)
+        order = np.argsort(x, axis=1)
+        by_group = np.argsort(
+            np.take_along_axis(group, order, axis=1), axis=1, kind="stable"
+        )
+        order = np.take_along_axis(order, by_group, axis=1)
+        group_sorted = np.take_along_axis(group, order, axis=1)
+        values_sorted = np.take_along_axis(x, order, axis=1)
+        new_group = np.ones(self.shape, dtype=bool)
+        new_group[:, 1:] = group_sorted[:, 1:] != group_sorted[:, :-1]
+        # 同组同值为一段，段内名次取首尾平均
+        new_run = new_group.copy()
+        new_run[:, 1:] |= values_sorted[:, 1:] != values_sorted[:, :-1]
+        group_first, group_last = _segment_bounds(new_group)
+        run_first, run_last = _segment_bounds(new_run)
+        size = group_last - group_first + 1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ranked = np.where(
+                size > 1, ((run_first + run_last) / 2 - group_first) / (size - 1), 0.5
+            )
+        out = np.empty(self.shape, dtype=out_dtype(x, dtype))
+        np.put_along_axis(out, order, ranked, axis=1)
+        out[~valid] = np.nan
+        return out
+
+
+def _segment_bounds(starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """starts 标记每行中各段的起点，返回每个位置所在段的 (首位置, 尾位置)"""
+    n = starts.shape[1]
+    positions = np.broadcast_to(np.arange(n), starts.shape)
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    # 尾位置 = 下一段起点 - 1，对反转后的行做累积最小值
+    following = np.full(starts.shape, n)
+    following[:, :-1] = np.where(starts[:, 1:], positions[:, 1:], n)
+    last = np.minimum.accumulate(following[:, ::-1], axis=1)[:, ::-1] - 1
+    return first, last
+
+
+class GroupCache:
+    """按分组名（含 cartesian product 组合）缓存 GroupIndex，同一面板上只构造一次"""
+
+    def __init__(self, loader: Callable[[str], np.ndarray], shape: Tuple[int, int]):
+        self.loader = loader
+        self.shape = shape
+        self._indexes: Dict[Tuple[str, ...], GroupIndex] = {}
+
+    @staticmethod
+    def key(*names: str) -> Tuple[str, ...]:
+        return tuple(name.lower() for name in names)
+
+    def put(self, index: GroupIndex, *names: str):
+        self._indexes[self.key(*names)] = index
+
+    def get(self, *names: str) -> GroupIndex:
+        key = self.key(*names)
+        index = self._indexes.get(key)
+        if index is None:
+            groups = [self.loader(name) for name in key]
+            group = groups[0] if len(groups) == 1 else cartesian_product(*groups)
+            index = self._indexes[key] = GroupIndex(group, self.shape)
+        return index
+
+
+def group_rank(x, index: GroupIndex, dtype=None):
+    return index.rank(x, dtype)
+
+
+def group_mean(x, index: GroupIndex, weight=None, dtype=None):
+    return index.mean(x, weight, dtype)
+
+
+def group_sum(x, index: GroupIndex, dtype=None):
+    return index.sum(x, dtype)
+
+
+def group_count(x, index: GroupIndex, dtype=None):
+    return index.count(x, dtype)
+
+
+def group_std_dev(x, index: GroupIndex, dtype=None):
+    return index.std(x, dtype)
+
+
+def group_zscore(x, index: GroupIndex, dtype=None):
+    return index.zscore(x, dtype)
+
+
+def group_neutralize(x, index: GroupIndex, dtype=None):
+    return index.neutralize(x, dtype)
+
+
+# 以 (x, 分组) 为输入的操作符，供表达式求值器按名称调用
+GROUP_KERNELS: Dict[str, Callable[..., np.ndarray]] = {
+    "group_rank": group_rank,
+    "group_mean": group_mean,
+    "group_sum": group_sum,
+    "group_count": group_count,
+    "group_std_dev": group_std_dev,
+    "group_std": group_std_dev,
+    "group_zscore": group_zscore,
+    "group_neutralize": group_neutralize,
+}
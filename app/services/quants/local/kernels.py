@@ -0,0 +1,209 @@
+"""FASTEXPR 时序操作符的向量化实现
+
+输入为 (n_dates, n_instruments) 面板，沿日期轴滚动，一次处理全部股票。
+求和类统计都由累加和相减得到，与窗口长度无关；累加统一用 float64，
+输出 dtype 默认与输入一致（float32 输入得到 float32 输出），也可通过 dtype 指定。
+
+NaN 语义对应 settings 中的 nanHandling：
+
+- nan_handling=True（ON）：窗口内的 NaN 被跳过，按有效值计算，有效值不足时为 NaN
+- nan_handling=False（OFF）：窗口未满或窗口内有 NaN 时结果为 NaN
+"""
+
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+
+def out_dtype(x: np.ndarray, dtype=None) -> np.dtype:
+    if dtype is not None:
+        return np.dtype(dtype)
+    return x.dtype if x.dtype.kind == "f" else np.dtype(np.float64)
+
+
+def _rolling(values: np.ndarray, d: int) -> np.ndarray:
+    """沿日期轴长度为 d 的滚动和（含当前行），前 d-1 行为部分窗口的和"""
+    out = np.cumsum(values, axis=0, dtype=np.float64)
+    if d < len(out):
+        out[d:] -= out[:-d].copy()
+    return out
+
+
+def _valid(x: np.ndarray) -> np.ndarray:
+    return ~np.isnan(x)
+
+
+def _finish(
+    out: np.ndarray,
+    count: np.ndarray,
+    d: int,
+    nan_handling: bool,
+    dtype,
+    min_count: int = 1,
+) -> np.ndarray:
+    ok = count >= (min_count if nan_handling else d)
+    return np.where(ok, out, np.nan).astype(dtype, copy=False)
+
+
+def _centered(x: np.ndarray) -> np.ndarray:
+    """减去每列均值再累加，避免大数值平方和相减的精度损失（方差、相关与平移无关）"""
+    x = np.asarray(x, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        shift = np.nanmean(x, axis=0) if len(x) else 0
+    return x - np.nan_to_num(shift)
+
+
+def ts_delay(x: np.ndarray, d: int, dtype=None) -> np.ndarray:
+    dtype = out_dtype(x, dtype)
+    out = np.full(x.shape, np.nan, dtype=dtype)
+    if d < len(x):
+        out[d:] = x[: len(x) - d]
+    return out
+
+
+def ts_delta(x: np.ndarray, d: int, dtype=None) -> np.ndarray:
+    dtype = out_dtype(x, dtype)
+    return (np.asarray(x, dtype=dtype) - ts_delay(x, d, dtype)).astype(dtype)
+
+
+def ts_count_nans(x: np.ndarray, d: int, dtype=None) -> np.ndarray:
+    return _rolling(np.isnan(x), d).astype(out_dtype(x, dtype))
+
+
+def ts_sum(x: np.ndarray, d: int, nan_handling: bool = True, dtype=None):
+    valid = _valid(x)
+    total = _rolling(np.where(valid, x, 0), d)
+    return _finish(total, _rolling(valid, d), d, nan_handling, out_dtype(x, dtype))
+
+
+def ts_mean(x: np.ndarray, d: int, nan_handling: bool = True, dtype=None):
+    valid = _valid(x)
+    count = _rolling(valid, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = _rolling(np.where(valid, x, 0), d) / count
+    return _finish(mean, count, d, nan_handling, out_dtype(x, dtype))
+
+
+def _moments(x: np.ndarray, d: int):
+    valid = _valid(x)
+    c = np.where(valid, _centered(x), 0)
+    count = _rolling(valid, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = _rolling(c, d) / count
+        square = _rolling(c * c, d) / count
+    var = square - mean * mean
+    # 窗口内取值全相同时消去误差可能留下极小的正数，视为 0
+    var[var <= square * 1e-10] = 0
+    return c, count, mean, var
+
+
+def ts_std_dev(x: np.ndarray, d: int, nan_handling: bool = True, dtype=None):
+    """总体标准差（除以 n）"""
+    _, count, _, var = _moments(x, d)
+    return _finish(np.sqrt(var), count, d, nan_handling, out_dtype(x, dtype), 2)
+
+
+def ts_zscore(x: np.ndarray, d: int, nan_handling: bool = True, dtype=None):
+    c, count, mean, var = _moments(x, d)
+    std = np.sqrt(var)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(std > 0, (c - mean) / std, np.nan)
+    z[np.isnan(x)] = np.nan
+    return _finish(z, count, d, nan_handling, out_dtype(x, dtype), 2)
+
+
+def ts_corr(
+    x: np.ndarray, y: np.ndarray, d: int, nan_handling: bool = True, dtype=None
+):
+    """滚动 Pearson 相关，只用两者同时有效的样本"""
+    valid = _valid(x) & _valid(y)
+    cx = np.where(valid, _centered(x), 0)
+    cy = np.where(valid, _centered(y), 0)
+    n = _rolling(valid, d)
+    sx, sy = _rolling(cx, d), _rolling(cy, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = _rolling(cx * cy, d) - sx * sy / n
+        vx = _rolling(cx * cx, d) - sx * sx / n
+        vy = _rolling(cy * cy, d) - sy * sy / n
+        denom = np.sqrt(np.maximum(vx, 0) * np.maximum(vy, 0))
+        corr = np.where(denom > 0, cov / denom, np.nan)
+    return _finish(np.clip(corr, -1, 1), n, d, nan_handling, out_dtype(x, dtype), 2)
+
+
+def ts_decay_linear(x: np.ndarray, d: int, nan_handling: bool = True, dtype=None):
+    """线性衰减加权均值，最新一天权重 d，最早一天权重 1
+
+    记 k 为行号，窗口内权重为 k - (t - d)，故
+    Σw·x = (C1_t - C1_{t-d}) - (t - d)(C0_t - C0_{t-d})，其中 C1 = cumsum(k·x)
+    """
+    valid = _valid(x)
+    v = np.where(valid, x, 0).astype(np.float64)
+    k = np.arange(len(x), dtype=np.float64)[:, None]
+    offset = k - d
+    weighted = _rolling(v * k, d) - offset * _rolling(v, d)
+    weights = _rolling(valid * k, d) - offset * _rolling(valid, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = weighted / weights
+    return _finish(out, _rolling(valid, d), d, nan_handling, out_dtype(x, dtype))
+
+
+def _rank_counts(x: np.ndarray, d: int):
+    """滑动窗口内比当前值小、与当前值相等的个数（NaN 比较恒为假，自然不计入）
+
+    按滞后 0..d-1 把整个面板与自身错位比较并累加，共 d 次向量运算，不对任何窗口排序；
+    计数用 int16 且复用比较结果的缓冲区，内存带宽约为 float64 实现的一半
+    """
+    n_dates = len(x)
+    count_dtype = np.int16 if d < np.iinfo(np.int16).max else np.int32
+    less = np.zeros(x.shape, dtype=count_dtype)
+    equal = np.zeros(x.shape, dtype=count_dtype)
+    hit = np.empty(x.shape, dtype=bool)
+    for lag in range(min(d, n_dates)):
+        past, current, out = x[: n_dates - lag], x[lag:], hit[lag:]
+        np.less(past, current, out=out)
+        less[lag:] += out
+        np.equal(past, current, out=out)
+        equal[lag:] += out
+    return less, equal
+
+
+def ts_rank(
+    x: np.ndarray,
+    d: int,
+    constant: float = 0,
+    nan_handling: bool = True,
+    dtype=None,
+):
+    """当前值在过去 d 天（含当天）中的排名，缩放到 [0, 1] 后加 constant，并列取平均名次"""
+    x = np.asarray(x)
+    valid = _valid(x)
+    less, equal = _rank_counts(x, d)
+    count = _rolling(valid, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rank = np.where(count > 1, (less + (equal - 1) / 2) / (count - 1), 0.5)
+    rank = np.where(valid, rank + constant, np.nan)
+    return _finish(rank, count, d, nan_handling, out_dtype(x, dtype))
+
+
+# 窗口参数在第二个位置的时序操作符，供表达式求值器按名称调用
+TS_KERNELS: Dict[str, Callable[..., np.ndarray]] = {
+    "ts_sum": ts_sum,
+    "ts_mean": ts_mean,
+    "ts_std_dev": ts_std_dev,
+    "ts_std": ts_std_dev,
+    "ts_zscore": ts_zscore,
+    "ts_delta": ts_delta,
+    "ts_delay": ts_delay,
+    "ts_rank": ts_rank,
+    "ts_decay_linear": ts_decay_linear,
+    "ts_count_nans": ts_count_nans,
+}
+
+# 以两个序列为输入的时序操作符
+TS_PAIR_KERNELS: Dict[str, Callable[..., np.ndarray]] = {
+    "ts_corr": ts_corr,
+}
+
+
+def nan_handling_on(settings: Optional[dict]) -> bool:
+    return str((settings or {}).get("nanHandling", "OFF")).upper() == "ON"
@@ -0,0 +1,329 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+
+from .vector import VectorField
+
+PANEL_DIR = Path(settings.DATA_DIR) / "panel"
+
+# 分组字段，按 instrument 存 int32 类别编号；market 不落盘，恒为 0
+GROUP_FIELDS = ("sector", "industry", "subindustry", "country")
+MARKET_GROUP = "market"
+
+
+def _save(path: Path, array: np.ndarray):
+    """先写临时文件再替换，读者不会 mmap 到写了一半的文件；
+    临时文件名唯一，多个进程同时写同一个键时各写各的，最后一次替换生效"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array, allow_pickle=False)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+class Panel:
+    """一个 (region, delay, universe) 下的面板数据
+
+    目录结构::
+
+        dates.npy            datetime64[D], (n_dates,)
+        instruments.npy      str, (n_instruments,)
+        fields/<name>.npy    float32/float64, (n_dates, n_instruments)，缺失为 NaN
+        groups/<name>.npy    int32, (n_instruments,) 或 (n_dates, n_instruments)
+        vectors/<name>.offsets.npy, vectors/<name>.values.npy
+                             向量字段，格式见 VectorField
+
+    字段与分组均以只读 mmap 打开，加载不拷贝，多个进程共享同一份页缓存
+    """
+
+    def __init__(self, root: Path, region: str, delay: int, universe: str):
+        self.region = region
+        self.delay = int(delay)
+        self.universe = universe
+        self.path = Path(root) / f"{region}_{self.delay}_{universe}"
+        self._dates: Optional[np.ndarray] = None
+        self._instruments: Optional[np.ndarray] = None
+        self._fields: Dict[str, np.ndarray] = {}
+        self._groups: Dict[str, np.ndarray] = {}
+        self._vectors: Dict[str, VectorField] = {}
+
+    @property
+    def key(self) -> Tuple[str, int, str]:
+        return self.region, self.delay, self.universe
+
+    def exists(self) -> bool:
+        return (self.path / "dates.npy").exists()
+
+    @property
+    def dates(self) -> np.ndarray:
+        if self._dates is None:
+            self._dates = np.load(self.path / "dates.npy", mmap_mode="r")
+        return self._dates
+
+    @property
+    def instruments(self) -> np.ndarray:
+        if self._instruments is None:
+            self._instruments = np.load(self.path / "instruments.npy", mmap_mode="r")
+        return self._instruments
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.dates), len(self.instruments)
+
+    def field_path(self, name: str) -> Path:
+        return self.path / "fields" / f"{name}.npy"
+
+    def group_path(self, name: str) -> Path:
+        return self.path / "groups" / f"{name}.npy"
+
+    def vector_path(self, name: str, part: str) -> Path:
+        return self.path / "vectors" / f"{name}.{part}.npy"
+
+    def has_field(self, name: str) -> bool:
+        return name in self._fields or self.field_path(name).exists()
+
+    def has_group(self, name: str) -> bool:
+        return (
+            name == MARKET_GROUP
+            or name in self._groups
+            or self.group_path(name).exists()
+        )
+
+    def has_vector(self, name: str) -> bool:
+        return name in self._vectors or self.vector_path(name, "offsets").exists()
+
+    def field_names(self) -> List[str]:
+        return sorted(p.stem for p in (self.path / "fields").glob("*.npy"))
+
+    def group_names(self) -> List[str]:
+        return [MARKET_GROUP] + sorted(
+            p.stem for p in (self.path / "groups").glob("*.npy")
+        )
+
+    def vector_names(self) -> List[str]:
+        return sorted(
+            p.name[: -len(".offsets.npy")]
+            for p in (self.path / "vectors").glob("*.offsets.npy")
+        )
+
+    def field(self, name: str) -> np.ndarray:
+        """只读 mmap 视图，不存在时抛 KeyError"""
+        array = self._fields.get(name)
+        if array is None:
+            path = self.field_path(name)
+            if not path.exists():
+                raise KeyError(f"field {name} not in panel {self.key}")
+            array = self._fields[name] = np.load(path, mmap_mode="r")
+        return array
+
+    def group(self, name: str) -> np.ndarray:
+        array = self._groups.get(name)
+        if array is None:
+            if name == MARKET_GROUP:
+                array = np.zeros(self.shape[1], dtype=np.int32)
+            else:
+                path = self.group_path(name)
+                if not path.exists():
+                    raise KeyError(f"group {name} not in panel {self.key}")
+                array = np.load(path, mmap_mode="r")
+            self._groups[name] = array
+        return array
+
+    def vector(self, name: str) -> VectorField:
+        """offsets 与 values 均为只读 mmap，不存在时抛 KeyError"""
+        vector = self._vectors.get(name)
+        if vector is None:
+            if not self.vector_path(name, "offsets").exists():
+                raise KeyError(f"vector field {name} not in panel {self.key}")
+            vector = self._vectors[name] = VectorField(
+                np.load(self.vector_path(name, "offsets"), mmap_mode="r"),
+                np.load(self.vector_path(name, "values"), mmap_mode="r"),
+                self.shape,
+            )
+        return vector
+
+    def write_axes(self, dates: Iterable, instruments: Iterable[str]):
+        _save(self.path / "dates.npy", np.asarray(dates, dtype="datetime64[D]"))
+        _save(self.path / "instruments.npy", np.asarray(instruments, dtype=str))
+        self._dates = self._instruments = None
+
+    def write_field(self, name: str, values: np.ndarray, dtype=np.float32):
+        values = np.asarray(values, dtype=dtype)
+        if values.shape != self.shape:
+            raise ValueError(
+                f"field {name} shape {values.shape} != panel shape {self.shape}"
+            )
+        _save(self.field_path(name), values)
+        self._fields.pop(name, None)
+
+    def write_group(self, name: str, values: np.ndarray):
+        values = np.asarray(values, dtype=np.int32)
+        if values.shape not in (self.shape, self.shape[1:]):
+            raise ValueError(
+                f"group {name} shape {values.shape} does not match panel {self.shape}"
+            )
+        _save(self.group_path(name), values)
+        self._groups.pop(name, None)
+
+    def write_vector(
+        self, name: str, offsets: np.ndarray, values: np.ndarray, dtype=np.float32
+    ):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        values = np.asarray(values, dtype=dtype)
+        n_cells = self.shape[0] * self.shape[1]
+        if len(offsets) != n_cells + 1 or offsets[-1] != len(values):
+            raise ValueError(
+                f"vector {name} offsets do not match panel {self.shape} "
+                f"and {len(values)} values"
+            )
+        # 先写取值再写偏移，读者以 offsets 是否存在判断字段是否可用
+        _save(self.vector_path(name, "values"), values)
+        _save(self.vector_path(name, "offsets"), offsets)
+        self._vectors.pop(name, None)
+
+    @property
+    def version(self) -> str:
+        """坐标轴与全部字段文件的大小、修改时间摘要，任何写入都会改变版本"""
+        md5 = hashlib.md5()
+        paths = [self.path / "dates.npy", self.path / "instruments.npy"]
+        for sub in ("fields", "groups", "vectors"):
+            paths.extend(sorted((self.path / sub).glob("*.npy")))
+        for path in paths:
+            if path.exists():
+                stat = path.stat()
+                md5.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return md5.hexdigest()
+
+
+class PanelStore:
+    """按 (region, delay, universe, field) 组织的本地面板数据，与数据字段表的唯一键一致"""
+
+    def __init__(self, root: Path = PANEL_DIR):
+        self.root = Path(root)
+        self._panels: Dict[Tuple[str, int, str], Panel] = {}
+
+    def panel(self, region: str, delay: int, universe: str) -> Panel:
+        key = (region, int(delay), universe)
+        if key not in self._panels:
+            self._panels[key] = Panel(self.root, *key)
+        return self._panels[key]
+
+    def panel_for(self, settings: dict) -> Panel:
+        """按 alpha / 数据字段的 settings 找到对应面板"""
+        return self.panel(settings["region"], settings["delay"], settings["universe"])
+
+    def field(self, region: str, delay: int, universe: str, name: str) -> np.ndarray:
+        return self.panel(region, delay, universe).field(name)
+
+    def panels(self) -> List[Panel]:
+        rs = []
+        for path in sorted(self.root.glob("*_*_*")):
+            region, delay, universe = path.name.split("_", 2)
+            panel = self.panel(region, int(delay), universe)
+            if panel.exists():
+                rs.append(panel)
+        return rs
+
+
+def synthetic_groups(
+    n_instruments: int, rng: np.random.Generator, countries: int = 1
+) -> Dict[str, np.ndarray]:
+    """层级一致的分组：subindustry 唯一属于某个 industry，industry 唯一属于某个 sector"""
+    subindustry = rng.integers(0, 150, n_instruments).astype(np.int32)
+    industry = (subindustry // 3).astype(np.int32)
+    sector = (industry // 5).astype(np.int32)
+    country = rng.integers(0, max(countries, 1), n_instruments).astype(np.int32)
+    return {
+        "sector": sector,
+        "industry": industry,
+        "subindustry": subindustry,
+        "country": country,
+    }
+
+
+def write_synthetic_panel(
+    store: PanelStore,
+    region: str = "USA",
+    delay: int = 1,
+    universe: str = "TOP3000",
+    n_dates: int = 500,
+    n_instruments: int = 500,
+    fields: Iterable[str] = (),
+    vector_fields: Iterable[str] = (),
+    seed: int = 0,
+    start: str = "2015-01-01",
+    countries: int = 1,
+    dtype=np.float32,
+) -> Panel:
+    """生成可离线使用的合成面板：价量字段来自带行业因子的随机游走，
+    fields 中的其他字段为带自相关的噪声，vector_fields 为每个单元格 0~若干个取值、
+    均值带自相关的向量字段；每只股票随机晚上市，上市前为 NaN（向量为空）"""
+    rng = np.random.default_rng(seed)
+    panel = store.panel(region, delay, universe)
+    dates = np.busday_offset(
+        np.datetime64(start, "D"), np.arange(n_dates), roll="forward"
+    )
+    instruments = [f"{region}{i:05d}" for i in range(n_instruments)]
+    panel.write_axes(dates, instruments)
+
+    groups = synthetic_groups(n_instruments, rng, countries)
+    for name, values in groups.items():
+        panel.write_group(name, values)
+
+    shape = (n_dates, n_instruments)
+    sector_factor = rng.normal(0, 0.01, (n_dates, groups["sector"].max() + 1))
+    market_factor = rng.normal(0, 0.008, (n_dates, 1))
+    returns = (
+        market_factor + sector_factor[:, groups["sector"]] + rng.normal(0, 0.015, shape)
+    )
+    close = (
+        20
+        * np.exp(rng.normal(0, 0.5, n_instruments))
+        * np.exp(np.cumsum(returns, axis=0))
+    )
+    spread = np.abs(rng.normal(0, 0.01, shape))
+    volume = np.exp(rng.normal(13, 1, n_instruments) + rng.normal(0, 0.3, shape))
+    listed = rng.integers(0, max(n_dates // 5, 1), n_instruments)
+    missing = np.arange(n_dates)[:, None] < listed[None, :]
+
+    data = {
+        "returns": returns,
+        "close": close,
+        "open": close * (1 + rng.normal(0, 0.005, shape)),
+        "high": close * (1 + spread),
+        "low": close * (1 - spread),
+        "vwap": close * (1 + rng.normal(0, 0.002, shape)),
+        "volume": volume,
+        "cap": close * volume * 50,
+    }
+    for name in fields:
+        if name in data:
+            continue
+        noise = rng.normal(0, 1, shape)
+        # AR(1) 让合成基本面字段在时间上平滑
+        for t in range(1, n_dates):
+            noise[t] = 0.95 * noise[t - 1] + 0.3 * noise[t]
+        data[name] = noise
+    for name, values in data.items():
+        values = np.where(missing, np.nan, values)
+        panel.write_field(name, values, dtype=dtype)
+    for name in vector_fields:
+        center = rng.normal(0, 1, shape)
+        for t in range(1, n_dates):
+            center[t] = 0.95 * center[t - 1] + 0.3 * center[t]
+        lengths = np.where(missing, 0, rng.poisson(3, shape)).ravel()
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.repeat(center.ravel(), lengths) + rng.normal(0, 1, offsets[-1])
+        panel.write_vector(name, offsets, values, dtype=dtype)
+    return panel
@@ -0,0 +1,216 @@
+"""本地回测：按 alpha 的 settings 把表达式取值变成持仓并计算 PnL 指标
+
+时间约定：面板第 t 行的 returns 为 t-1 收盘到 t 收盘的收益，alpha 第 t 行只用到 t 收盘前的数据。
+delay=0 时在 t 收盘调仓、赚取 t+1 的收益；delay=1 时晚一天，赚取 t+2 的收益，
+即第 t 天的 PnL = w[t - 1 - delay] · returns[t]。
+
+处理顺序与 WQB 一致：pasteurization -> decay -> neutralization -> 归一化 -> truncation。
+全部为整面板的向量运算，不按日期循环。
+"""
+
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from app.common.wqb import NEUTRALIZATION_OPERATORS
+
+from .group import GroupCache
+from .panel import Panel
+
+TRADING_DAYS = 252
+BOOK_SIZE = 20_000_000
+# fitness 中 turnover 的下限，与 WQB 一致
+MIN_FITNESS_TURNOVER = 0.125
+# truncation 截断后重新归一化的迭代次数
+TRUNCATION_ITERATIONS = 3
+
+
+class SimulationResult(NamedTuple):
+    sharpe: float
+    fitness: float
+    turnover: float
+    returns: float
+    drawdown: float
+    margin: float
+    long_count: float
+    short_count: float
+    pnl: np.ndarray
+
+    def as_dict(self) -> dict:
+        """与 wqb_data["is"] 中同名字段对应，不含每日 PnL"""
+        return {k: v for k, v in self._asdict().items() if k != "pnl"}
+
+
+def pasteurize(alpha: np.ndarray, returns: np.ndarray) -> np.ndarray:
+    """无穷值置为 NaN；不在股票池（当日无收益数据）的股票不持仓，原地修改"""
+    alpha[~np.isfinite(alpha) | np.isnan(returns)] = np.nan
+    return alpha
+
+
+def decay_linear(alpha: np.ndarray, decay: int) -> np.ndarray:
+    """decay 通常只有几天，直接对 decay 个错位切片加权求和，比累加和版本更快"""
+    if decay <= 1:
+        return alpha
+    n_dates = len(alpha)
+    valid = ~np.isnan(alpha)
+    values = np.where(valid, alpha, 0).astype(alpha.dtype, copy=False)
+    total = np.zeros_like(values)
+    weights = np.zeros_like(values)
+    buffer = np.empty_like(values)
+    for lag in range(min(decay, n_dates)):
+        w, out = decay - lag, buffer[lag:]
+        np.multiply(values[: n_dates - lag], w, out=out)
+        total[lag:] += out
+        np.multiply(valid[: n_dates - lag], w, out=out)
+        weights[lag:] += out
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(total, weights, out=total)
+    total[~valid] = np.nan
+    return total
+
+
+def neutralize(
+    alpha: np.ndarray, neutralization: str, groups: Optional[GroupCache]
+) -> np.ndarray:
+    neutralization = (neutralization or "NONE").upper()
+    if neutralization == "NONE":
+        return alpha
+    if neutralization == "MARKET" or groups is None:
+        valid = ~np.isnan(alpha)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(valid, alpha, 0).sum(axis=1, keepdims=True) / valid.sum(
+                axis=1, keepdims=True
+            )
+        return alpha - mean.astype(alpha.dtype)
+    if neutralization not in NEUTRALIZATION_OPERATORS:
+        raise ValueError(f"unsupported neutralization {neutralization}")
+    return groups.get(neutralization).neutralize(alpha, dtype=alpha.dtype)
+
+
+def normalize(weights: np.ndarray) -> np.ndarray:
+    """每天多空权重绝对值之和为 1，原地修改；weights 中不含 NaN"""
+    gross = np.abs(weights).sum(axis=1, keepdims=True)
+    gross[gross == 0] = 1
+    weights /= gross
+    return weights
+
+
+def truncate(weights: np.ndarray, truncation: float) -> np.ndarray:
+    """单只股票权重不超过 truncation，截断后重新归一化，迭代至收敛或达到次数上限"""
+    if not truncation or truncation <= 0:
+        return weights
+    for _ in range(TRUNCATION_ITERATIONS):
+        if np.abs(weights).max(initial=0) <= truncation * (1 + 1e-6):
+            break
+        normalize(np.clip(weights, -truncation, truncation, out=weights))
+    return weights
+
+
+def positions(
+    alpha: np.ndarray,
+    returns: np.ndarray,
+    settings: dict,
+    groups: Optional[GroupCache] = None,
+    dtype=np.float32,
+) -> np.ndarray:
+    """alpha 取值 -> 每日权重（绝对值之和为 1，无持仓为 0）
+
+    权重精度只影响 PnL 的末几位，默认用 float32 计算，内存带宽减半
+    """
+    alpha = np.array(alpha, dtype=dtype)
+    if str(settings.get("pasteurization", "ON")).upper() == "ON":
+        alpha = pasteurize(alpha, returns)
+    alpha = decay_linear(alpha, int(settings.get("decay") or 0))
+    alpha = neutralize(alpha, settings.get("neutralization"), groups)
+    weights = normalize(np.nan_to_num(alpha, nan=0.0, posinf=0.0, neginf=0.0))
+    return truncate(weights, float(settings.get("truncation") or 0))
+
+
+def max_drawdown(cumulative: np.ndarray) -> float:
+    if not len(cumulative):
+        return 0.0
+    peak = np.maximum.accumulate(np.maximum(cumulative, 0))
+    return float(np.max(peak - cumulative))
+
+
+class Simulator:
+    """绑定一个面板的回测器，收益与分组索引只加载一次，供批量回测复用"""
+
+    def __init__(
+        self,
+        panel: Panel,
+        returns_field: str = "returns",
+        groups: Optional[GroupCache] = None,
+        dtype=np.float32,
+        realized: Optional[np.ndarray] = None,
+    ):
+        self.panel = panel
+        self.dtype = np.dtype(dtype)
+        self.returns = np.asarray(panel.field(returns_field))
+        # realized 为 NaN 置 0 后的收益，可传入共享内存中已算好的数组
+        if realized is None:
+            realized = np.nan_to_num(self.returns).astype(self.dtype, copy=False)
+        self.realized = realized
+        self.groups = groups or GroupCache(panel.group, panel.shape)
+
+    def positions(self, alpha: np.ndarray, settings: dict) -> np.ndarray:
+        return positions(alpha, self.returns, settings, self.groups, self.dtype)
+
+    def run(self, alpha: np.ndarray, settings: dict) -> SimulationResult:
+        weights = self.positions(alpha, settings)
+        shift = 1 + int(settings.get("delay", self.panel.delay))
+        held = weights[:-shift] if shift < len(weights) else weights[:0]
+        daily = np.einsum("ij,ij->i", held, self.realized[shift:], dtype=np.float64)
+        # 首个有持仓的日期之前不计入统计
+        active = np.flatnonzero(np.any(held != 0, axis=1))
+        daily = daily[active[0] :] if len(active) else daily[:0]
+        turnover_days = np.abs(np.diff(weights, axis=0)).sum(axis=1, dtype=np.float64)
+        return metrics(daily, turnover_days, weights)
+
+
+def simulate(
+    alpha: np.ndarray,
+    panel: Panel,
+    settings: dict,
+    groups: Optional[GroupCache] = None,
+    returns_field: str = "returns",
+) -> SimulationResult:
+    return Simulator(panel, returns_field, groups).run(alpha, settings)
+
+
+def metrics(
+    daily: np.ndarray, turnover_days: np.ndarray, weights: np.ndarray
+) -> SimulationResult:
+    """daily 为按 1 单位总仓位计的每日收益"""
+    pnl = daily * BOOK_SIZE
+    if len(daily) < 2 or not np.any(daily):
+        return SimulationResult(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, pnl)
+    std = daily.std()
+    sharpe = float(daily.mean() / std * np.sqrt(TRADING_DAYS)) if std > 0 else 0.0
+    holding = np.any(weights != 0, axis=1)
+    # 按天平均，不换仓的日期计 0；只跳过首次建仓之前的预热期，建仓当天计入
+    first = int(holding.argmax()) if holding.any() else len(holding)
+    traded = turnover_days[max(first - 1, 0) :]
+    turnover = float(traded.mean()) if len(traded) else 0.0
+    # WQB 的 returns / drawdown 以半个 booksize 为分母
+    returns = float(daily.mean() * TRADING_DAYS * 2)
+    drawdown = max_drawdown(np.cumsum(daily) * 2)
+    fitness = sharpe * np.sqrt(abs(returns) / max(turnover, MIN_FITNESS_TURNOVER))
+    margin = float(daily.sum() / turnover_days.sum()) if turnover_days.sum() else 0.0
+    long_count = (
+        float((weights[holding] > 0).sum(axis=1).mean()) if holding.any() else 0.0
+    )
+    short_count = (
+        float((weights[holding] < 0).sum(axis=1).mean()) if holding.any() else 0.0
+    )
+    return SimulationResult(
+        sharpe=sharpe,
+        fitness=float(fitness),
+        turnover=turnover,
+        returns=returns,
+        drawdown=drawdown,
+        margin=margin,
+        long_count=long_count,
+        short_count=short_count,
+        pnl=pnl,
+    )
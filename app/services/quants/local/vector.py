@@ -0,0 +1,121 @@
+"""向量数据字段（每个日期、每只股票一个变长数组）的存储格式与 vec_* 操作符
+
+按 (日期, 股票) 行优先把所有单元格的取值首尾相接存成一维 values，
+offsets[k]..offsets[k+1] 为第 k 个单元格（k = t * n_instruments + i）的取值区间。
+求和类统计用累加和相减得到，max / min 用 reduceat，均不按单元格循环；
+单元格内的 NaN 被跳过，没有有效值的单元格结果为 NaN（vec_count 为 0）。
+"""
+
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .kernels import out_dtype
+
+
+class VectorField(NamedTuple):
+    offsets: np.ndarray
+    values: np.ndarray
+    shape: Tuple[int, int]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @classmethod
+    def from_cells(
+        cls, cells: Iterable[Iterable[float]], shape: Tuple[int, int], dtype=np.float32
+    ) -> "VectorField":
+        """按行优先顺序的单元格列表构造，主要用于导入与测试"""
+        cells = [np.asarray(c, dtype=dtype).ravel() for c in cells]
+        if len(cells) != shape[0] * shape[1]:
+            raise ValueError(f"{len(cells)} cells do not match shape {shape}")
+        offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in cells], out=offsets[1:])
+        values = np.concatenate(cells) if cells else np.empty(0, dtype=dtype)
+        return cls(offsets, values.astype(dtype, copy=False), shape)
+
+
+def _segment_sums(field: VectorField, values: np.ndarray) -> np.ndarray:
+    total = np.zeros(len(values) + 1, dtype=np.float64)
+    np.cumsum(values, out=total[1:])
+    return total[field.offsets[1:]] - total[field.offsets[:-1]]
+
+
+def _counts(field: VectorField) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """返回 (有效值掩码, 每个单元格的有效值个数)；没有 NaN 时掩码为 None，个数即长度"""
+    valid = ~np.isnan(field.values)
+    if valid.all():
+        return None, field.lengths.astype(np.float64)
+    return valid, _segment_sums(field, valid)
+
+
+def _filled(values: np.ndarray, valid: Optional[np.ndarray]) -> np.ndarray:
+    return values if valid is None else np.where(valid, values, 0)
+
+
+def _finish(field: VectorField, out: np.ndarray, count: np.ndarray, dtype):
+    out = np.where(count > 0, out, np.nan)
+    return out.reshape(field.shape).astype(dtype, copy=False)
+
+
+def vec_count(field: VectorField, dtype=None) -> np.ndarray:
+    _, count = _counts(field)
+    return count.reshape(field.shape).astype(out_dtype(field.values, dtype))
+
+
+def vec_sum(field: VectorField, dtype=None) -> np.ndarray:
+    valid, count = _counts(field)
+    total = _segment_sums(field, _filled(field.values, valid))
+    return _finish(field, total, count, out_dtype(field.values, dtype))
+
+
+def _mean(field: VectorField):
+    valid, count = _counts(field)
+    values = _filled(field.values, valid)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = _segment_sums(field, values) / count
+    return valid, values, count, mean
+
+
+def vec_avg(field: VectorField, dtype=None) -> np.ndarray:
+    _, _, count, mean = _mean(field)
+    return _finish(field, mean, count, out_dtype(field.values, dtype))
+
+
+def vec_stddev(field: VectorField, dtype=None) -> np.ndarray:
+    """总体标准差，先减单元格均值再平方（两遍），避免相消误差"""
+    valid, values, count, mean = _mean(field)
+    deviation = _filled(values - np.repeat(mean, field.lengths), valid)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = _segment_sums(field, deviation * deviation) / count
+    return _finish(field, np.sqrt(var), count, out_dtype(field.values, dtype))
+
+
+def _reduce(field: VectorField, ufunc: np.ufunc, dtype) -> np.ndarray:
+    """只对非空单元格 reduceat：相邻非空单元格首尾相接，下一个起点即本单元格终点"""
+    out = np.full(len(field.offsets) - 1, np.nan)
+    nonempty = field.lengths > 0
+    if nonempty.any():
+        out[nonempty] = ufunc.reduceat(field.values, field.offsets[:-1][nonempty])
+    return out.reshape(field.shape).astype(out_dtype(field.values, dtype))
+
+
+def vec_max(field: VectorField, dtype=None) -> np.ndarray:
+    # fmax 跳过 NaN，全为 NaN 时结果仍为 NaN
+    return _reduce(field, np.fmax, dtype)
+
+
+def vec_min(field: VectorField, dtype=None) -> np.ndarray:
+    return _reduce(field, np.fmin, dtype)
+
+
+# 以向量字段为唯一参数的操作符，供表达式求值器按名称调用
+VECTOR_KERNELS: Dict[str, Callable[..., np.ndarray]] = {
+    "vec_avg": vec_avg,
+    "vec_sum": vec_sum,
+    "vec_max": vec_max,
+    "vec_min": vec_min,
+    "vec_count": vec_count,
+    "vec_stddev": vec_stddev,
+}
@@ -0,0 +1,131 @@
+import math
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from bc_fastkit.common.typing import D
+
+from app import models
+
+from .utils import ExpressionGenerator
+from .validator import ExpressionValidator, OperatorSignature
+
+
+class ExpansionTask(NamedTuple):
+    """一个模板（或其组合空间的一个分片）的展开任务，只含可序列化的轻量数据"""
+
+    template_id: int
+    typ: int
+    template: str
+    fields: D
+    data_field_name: str
+    batch_no: str
+    limit: int
+    seed: Optional[int]
+    shard: Tuple[int, int] = (0, 1)
+    settings: Optional[dict] = None
+    start: int = 0
+
+
+class ExpansionResult(NamedTuple):
+    template_id: int
+    shard: Tuple[int, int]
+    rows: List[dict]
+    rejections: Counter
+
+
+def build_row(
+    task: ExpansionTask,
+    generator: ExpressionGenerator,
+    expression: str,
+    field_combo: D,
+    operator_defaults: Optional[dict] = None,
+) -> dict:
+    record = field_combo[task.data_field_name]
+    settings = {**generator.field_settings(field_combo), **(task.settings or {})}
+    model = models.QuantsWqbAlphaModel
+    return {
+        "parent_id": record.parent_id,
+        "template_id": task.template_id,
+        "batch_no": task.batch_no,
+        "typ": task.typ,
+        "expression": expression,
+        "settings": settings,
+        "state": model.STATE_PENDING,
+        "expression_hash": model.generate_expression_hash(
+            expression, settings, operator_defaults
+        ),
+    }
+
+
+def new_generator(
+    task: ExpansionTask, validator: ExpressionValidator
+) -> ExpressionGenerator:
+    return ExpressionGenerator(
+        task.template,
+        task.fields,
+        data_field_name=task.data_field_name,
+        validator=validator,
+    )
+
+
+def iter_rows(
+    task: ExpansionTask,
+    generator: ExpressionGenerator,
+    operator_defaults: Optional[dict] = None,
+) -> Iterator[dict]:
+    for expression, field_combo in generator.generate(
+        None, limit=task.limit, seed=task.seed, shard=task.shard, start=task.start
+    ):
+        yield build_row(task, generator, expression, field_combo, operator_defaults)
+
+
+_worker_validator: Optional[ExpressionValidator] = None
+_worker_defaults: Optional[dict] = None
+
+
+def _init_worker(signatures: List[OperatorSignature], operator_defaults: dict):
+    global _worker_validator, _worker_defaults
+    _worker_validator = ExpressionValidator(signatures)
+    _worker_defaults = operator_defaults
+
+
+def _run_task(task: ExpansionTask) -> ExpansionResult:
+    generator = new_generator(task, _worker_validator)
+    rows = list(iter_rows(task, generator, _worker_defaults))
+    return ExpansionResult(task.template_id, task.shard, rows, generator.rejections)
+
+
+def split_tasks(tasks: List[ExpansionTask], processes: int) -> List[ExpansionTask]:
+    """模板数少于进程数时，把单个模板的组合空间按相同 seed 切成多个分片"""
+    shard_count = max(1, math.ceil(processes / max(len(tasks), 1)))
+    return [
+        task._replace(shard=(i, shard_count))
+        for task in tasks
+        for i in range(shard_count)
+    ]
+
+
+def expand_parallel(
+    tasks: Iterable[ExpansionTask],
+    signatures: List[OperatorSignature],
+    operator_defaults: dict,
+    processes: int,
+) -> Iterator[ExpansionResult]:
+    """在进程池中展开模板，按完成顺序返回结果"""
+    tasks = split_tasks(
+        [
+            t if t.seed is not None else t._replace(seed=random.randrange(1 << 32))
+            for t in tasks
+        ],
+        processes,
+    )
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(signatures, operator_defaults),
+    ) as pool:
+        futures = [pool.submit(_run_task, task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
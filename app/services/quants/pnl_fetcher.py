@@ -0,0 +1,251 @@
+"""并发抓取 alpha 的 PnL recordset 并写入本地 PnL 库
+
+WQBSession 的请求是阻塞的，关掉其自带的重试与重新登录后每个请求放到线程中执行，
+由 Semaphore 限制同时在途的请求数，所有请求先从共享的令牌桶取令牌，限制每秒请求数：
+
+- 429 时按 Retry-After（没有则指数退避）暂停整个令牌桶，并把速率减半（不低于 min_rate）；
+  之后每次成功按 max_rate 的 5% 线性恢复，即 AIMD
+- recordset 还在生成时 WQB 返回 200、空内容和 Retry-After，按其等待后重试，不降速
+- 401 重新登录后重试，5xx 与网络错误指数退避重试；其他 4xx 与解析失败记为抓取失败
+- 重试次数用完的保持未抓取，下次运行再取
+
+待抓取的 alpha 按有索引的 pnl_state 选出，每批抓完后一次写入 PnL 库并提交数据库
+"""
+
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import List, NamedTuple, Optional
+
+from requests import RequestException
+from sqlalchemy.orm import Session
+from wqb import URL_ALPHAS_ALPHAID, WQBSession
+
+from app import models
+from app.crud import quants_wqb_alpha_handler
+from config import settings
+
+from .pnl_store import PnlStore, parse_pnl_recordset
+
+URL_ALPHAS_ALPHA_PNL = URL_ALPHAS_ALPHAID + "/recordsets/pnl"
+
+
+def retry_after(headers, default: float) -> float:
+    """Retry-After 可以是秒数或 HTTP 日期"""
+    value = headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为允许的突发请求数"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        min_rate: float = 0.2,
+    ):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self, seconds: float):
+        """收到 429：暂停 seconds 秒并清空已积攒的令牌；同一暂停期内并发请求
+        收到的多个 429 只减速一次"""
+        now = time.monotonic()
+        self.refill(now)
+        if now >= self.paused_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class FetchResult(NamedTuple):
+    alpha: models.QuantsWqbAlphaModel
+    data: Optional[dict]
+    error: str = ""
+
+
+class PnlFetcher:
+    def __init__(
+        self,
+        wqb: WQBSession,
+        store: Optional[PnlStore] = None,
+        rate: float = settings.WQB_PNL_RATE,
+        concurrency: int = settings.WQB_PNL_CONCURRENCY,
+        batch_size: int = 200,
+        max_attempts: int = 8,
+        backoff: float = 2.0,
+        max_backoff: float = 120.0,
+    ):
+        self.wqb = wqb
+        self.store = PnlStore() if store is None else store
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.throttled = 0
+        self.pending = 0
+        self.auth_lock = asyncio.Lock()
+        # 每次重新登录加一，请求发出前记下，用于判断 401 之后是否已有人重新登录
+        self.auth_generation = 0
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2**attempt)
+
+    def select_alphas(
+        self, db: Session, last_id: int = 0
+    ) -> List[models.QuantsWqbAlphaModel]:
+        model = quants_wqb_alpha_handler.model
+        return (
+            db.query(model)
+            .filter(
+                model.pnl_state == model.PNL_STATE_MISSING,
+                model.wqb_alpha_id != "",
+                model.id > last_id,
+            )
+            .order_by(model.id)
+            .limit(self.batch_size)
+            .all()
+        )
+
+    def request(self, url: str):
+        """只发一次请求；WQBSession.request 默认会对 204/401/429 自行等待、重新登录并重试，
+        且不经过令牌桶，这里关掉它的重试，由 fetch 统一处理"""
+        return self.wqb.request("get", url, expected=lambda _: True, max_tries=1)
+
+    async def reauth(self, generation: int):
+        """generation 为发出请求时的登录代数；多个请求同时 401 时只有第一个重新登录，
+        其余的发现代数已前进则直接重试，不会让刚拿到的会话失效"""
+        async with self.auth_lock:
+            if self.auth_generation != generation:
+                return
+            await asyncio.to_thread(self.wqb.auth_request)
+            self.auth_generation += 1
+
+    async def fetch(self, alpha: models.QuantsWqbAlphaModel) -> FetchResult:
+        url = URL_ALPHAS_ALPHA_PNL.format(alpha.wqb_alpha_id)
+        for attempt in range(self.max_attempts):
+            await self.bucket.acquire()
+            generation = self.auth_generation
+            try:
+                resp = await asyncio.to_thread(self.request, url)
+            except RequestException as e:
+                print(f"PnL request failed for {alpha.wqb_alpha_id}: {e}")
+                await asyncio.sleep(self.delay(attempt))
+                continue
+            if resp.status_code == 429:
+                self.throttled += 1
+                self.bucket.throttle(retry_after(resp.headers, self.delay(attempt)))
+                continue
+            if resp.status_code == 401:
+                await self.reauth(generation)
+                continue
+            if resp.status_code >= 500:
+                await asyncio.sleep(retry_after(resp.headers, self.delay(attempt)))
+                continue
+            if resp.status_code != 200:
+                return FetchResult(alpha, None, f"http {resp.status_code}")
+            if not resp.content:
+                # recordset 仍在生成
+                await asyncio.sleep(retry_after(resp.headers, self.delay(attempt)))
+                continue
+            self.bucket.recover()
+            try:
+                return FetchResult(alpha, resp.json())
+            except ValueError as e:
+                return FetchResult(alpha, None, f"invalid json: {e}")
+        return FetchResult(alpha, None)
+
+    async def fetch_batch(
+        self, alphas: List[models.QuantsWqbAlphaModel]
+    ) -> List[FetchResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(alpha):
+            async with semaphore:
+                return await self.fetch(alpha)
+
+        return await asyncio.gather(*(bounded(a) for a in alphas))
+
+    def save(self, db: Session, results: List[FetchResult]) -> int:
+        """成功的一次写入 PnL 库后再更新数据库，返回成功数"""
+        model = quants_wqb_alpha_handler.model
+        items, states = [], {}
+        for result in results:
+            alpha = result.alpha
+            if result.data is None:
+                if result.error:
+                    print(
+                        f"Failed to fetch PnL of {alpha.wqb_alpha_id}: {result.error}"
+                    )
+                    states[alpha.id] = model.PNL_STATE_FAILED
+                else:
+                    self.pending += 1
+                continue
+            try:
+                items.append((alpha.id, *parse_pnl_recordset(result.data)))
+                states[alpha.id] = model.PNL_STATE_STORED
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Failed to parse PnL of {alpha.wqb_alpha_id}: {e}")
+                states[alpha.id] = model.PNL_STATE_FAILED
+        self.store.put_many(items)
+        for alpha_id, state in states.items():
+            quants_wqb_alpha_handler.update(
+                db, obj_in={"id": alpha_id, "pnl_state": state}
+            )
+        db.commit()
+        return len(items)
+
+    async def run(self, db: Session):
+        started = time.monotonic()
+        last_id, fetched, total = 0, 0, 0
+        while True:
+            alphas = self.select_alphas(db, last_id)
+            if not alphas:
+                break
+            last_id = alphas[-1].id
+            total += len(alphas)
+            fetched += self.save(db, await self.fetch_batch(alphas))
+            elapsed = time.monotonic() - started
+            print(
+                f"Fetched PnL {fetched}/{total} in {elapsed:.0f}s "
+                f"({fetched / max(elapsed, 1e-9):.2f}/s), rate {self.bucket.rate:.2f}/s, "
+                f"throttled {self.throttled}, pending {self.pending}"
+            )
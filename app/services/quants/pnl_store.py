@@ -0,0 +1,279 @@
+"""alpha PnL 的列式本地存储，替代数据库中的 wqb_pnl_data JSON
+
+所有 alpha 共用一条工作日日期轴（从 PNL_START 起 PNL_DAYS 个工作日），
+每个 alpha 一行 float32 累计 PnL，缺失为 NaN：
+
+    pnl.<代>.f32    (行数, PNL_DAYS) 的行优先原始矩阵，只追加
+    ids.<代>.i64    每行对应的 alpha ID（数据库主键），只追加
+    CURRENT         当前代号
+
+写入先追加矩阵行、再追加 ID，ID 文件即提交记录：进程中途退出留下的多余矩阵行
+在下次写入前截掉。同一 alpha 重复写入时追加新行、映射指向最新行，旧行由 compact()
+写成新一代文件后替换 CURRENT 回收，替换是原子的。
+读取时整个矩阵是一个只读 mmap，5 万条序列的相关性计算不需要逐条解析 JSON。
+数据库只在 pnl_state 中记录是否已存入
+"""
+
+import fcntl
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import models
+from app.crud import quants_wqb_alpha_handler
+from config import settings
+
+PNL_DIR = Path(settings.DATA_DIR) / "pnl"
+PNL_START = np.datetime64("2005-01-03", "D")
+# 约 30 年的工作日，每行 31KB
+PNL_DAYS = 7800
+
+
+def parse_pnl_recordset(data: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """WQB /recordsets/pnl 的返回：schema.properties 给出列名，records 为按日的行，
+    返回 (日期 datetime64[D], 累计 PnL)"""
+    names = [p.get("name") for p in data.get("schema", {}).get("properties", [])]
+    date_col = names.index("date") if "date" in names else 0
+    pnl_col = names.index("pnl") if "pnl" in names else 1
+    records = [r for r in data.get("records", []) if r[pnl_col] is not None]
+    dates = np.array([r[date_col] for r in records], dtype="datetime64[D]")
+    values = np.array([r[pnl_col] for r in records], dtype=np.float64)
+    return dates, values
+
+
+class PnlStore:
+    def __init__(
+        self,
+        root: Path = PNL_DIR,
+        start: np.datetime64 = PNL_START,
+        n_days: int = PNL_DAYS,
+    ):
+        self.root = Path(root)
+        self.start = np.datetime64(start, "D")
+        self.n_days = n_days
+        self.row_bytes = n_days * np.dtype(np.float32).itemsize
+        self._generation = -1
+        self._ids: Optional[np.ndarray] = None
+        self._rows: Dict[int, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+
+    def generation(self) -> int:
+        try:
+            return int((self.root / "CURRENT").read_text())
+        except FileNotFoundError:
+            return 0
+
+    def data_path(self, generation: int) -> Path:
+        return self.root / f"pnl.{generation}.f32"
+
+    def ids_path(self, generation: int) -> Path:
+        return self.root / f"ids.{generation}.i64"
+
+    def committed(self, generation: int) -> int:
+        path = self.ids_path(generation)
+        return path.stat().st_size // 8 if path.exists() else 0
+
+    @property
+    def dates(self) -> np.ndarray:
+        return np.busday_offset(self.start, np.arange(self.n_days), roll="forward")
+
+    def day_index(self, dates: np.ndarray) -> np.ndarray:
+        """日期在公共日期轴上的列号，非工作日记到下一个工作日"""
+        index = np.busday_count(self.start, np.asarray(dates, dtype="datetime64[D]"))
+        if len(index) and (index.min() < 0 or index.max() >= self.n_days):
+            raise ValueError(
+                f"pnl dates {dates.min()}..{dates.max()} out of store range "
+                f"{self.start}+{self.n_days} business days"
+            )
+        return index
+
+    def ids(self) -> np.ndarray:
+        """每行对应的 alpha ID，文件变长或被 compact 换代后重新读取"""
+        generation = self.generation()
+        size = self.committed(generation)
+        if (
+            self._ids is None
+            or generation != self._generation
+            or len(self._ids) != size
+        ):
+            self._generation = generation
+            self._ids = (
+                np.fromfile(self.ids_path(generation), dtype=np.int64, count=size)
+                if size
+                else np.empty(0, dtype=np.int64)
+            )
+            # 同一 alpha 多行时后写的覆盖先写的
+            self._rows = dict(zip(self._ids.tolist(), range(size)))
+            self._matrix = None
+        return self._ids
+
+    def rows(self) -> Dict[int, int]:
+        self.ids()
+        return self._rows
+
+    def __len__(self) -> int:
+        return len(self.rows())
+
+    def __contains__(self, alpha_id: int) -> bool:
+        return alpha_id in self.rows()
+
+    def matrix(self) -> np.ndarray:
+        """(行数, n_days) 的只读 mmap，行号见 rows()"""
+        n = len(self.ids())
+        if self._matrix is None:
+            if n == 0:
+                self._matrix = np.empty((0, self.n_days), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(
+                    self.data_path(self._generation),
+                    np.float32,
+                    "r",
+                    shape=(n, self.n_days),
+                )
+        return self._matrix
+
+    def get(self, alpha_id: int) -> Optional[np.ndarray]:
+        row = self.rows().get(alpha_id)
+        return None if row is None else self.matrix()[row]
+
+    def load(
+        self, alpha_ids: Iterable[int], columns: slice = slice(None)
+    ) -> Tuple[List[int], np.ndarray]:
+        """按给定顺序取出已存入的 alpha，返回 (alpha ID 列表, (n, 列数) 矩阵)；
+        columns 为日期轴上的切片，只拷贝需要的列"""
+        rows = self.rows()
+        found = [i for i in alpha_ids if i in rows]
+        return found, self.matrix()[[rows[i] for i in found], columns]
+
+    @contextmanager
+    def _locked(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / "lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def row(self, dates: np.ndarray, values: np.ndarray) -> np.ndarray:
+        out = np.full(self.n_days, np.nan, dtype=np.float32)
+        out[self.day_index(dates)] = values
+        return out
+
+    def put_many(self, items: Iterable[Tuple[int, np.ndarray, np.ndarray]]) -> int:
+        """批量写入 (alpha ID, 日期, 累计 PnL)，一次加锁、一次追加，返回写入行数"""
+        ids, rows = [], []
+        for alpha_id, dates, values in items:
+            rows.append(self.row(dates, values))
+            ids.append(alpha_id)
+        if not ids:
+            return 0
+        with self._locked():
+            generation = self.generation()
+            committed = self.committed(generation)
+            with open(self.data_path(generation), "ab") as f:
+                # 截掉上次未提交的矩阵行
+                f.truncate(committed * self.row_bytes)
+                f.write(np.stack(rows).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.ids_path(generation), "ab") as f:
+                f.truncate(committed * 8)
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return len(ids)
+
+    def put(self, alpha_id: int, dates: np.ndarray, values: np.ndarray):
+        self.put_many([(alpha_id, dates, values)])
+
+    def garbage(self) -> int:
+        """被后写覆盖的旧行数"""
+        return len(self.ids()) - len(self.rows())
+
+    def compact(self):
+        """只保留每个 alpha 的最新行，写成新一代文件，切换 CURRENT 后删除旧文件；
+        已打开的旧 mmap 在删除后仍可读"""
+        with self._locked():
+            rows = self.rows()
+            old = self._generation
+            if len(rows) == len(self.ids()):
+                return
+            new = old + 1
+            alpha_ids = sorted(rows)
+            matrix = self.matrix()
+            with open(self.data_path(new), "wb") as f:
+                for start in range(0, len(alpha_ids), 4096):
+                    chunk = alpha_ids[start : start + 4096]
+                    f.write(matrix[[rows[i] for i in chunk]].tobytes())
+                os.fsync(f.fileno())
+            with open(self.ids_path(new), "wb") as f:
+                f.write(np.asarray(alpha_ids, dtype=np.int64).tobytes())
+                os.fsync(f.fileno())
+            current = self.root / "CURRENT.tmp"
+            current.write_text(str(new))
+            os.replace(current, self.root / "CURRENT")
+            self.data_path(old).unlink(missing_ok=True)
+            self.ids_path(old).unlink(missing_ok=True)
+
+
+def migrate_json_pnl(db: Session, store: Optional[PnlStore] = None, chunk: int = 200):
+    """把 pnl_state 为 PNL_STATE_JSON 的行的 JSON 收益数据搬进本地 PnL 库，并清空 JSON 列；
+    解析失败的行标记为 PNL_STATE_FAILED 并保留 JSON 供排查，之后不再重复迁移，
+    pnl_state 置回 PNL_STATE_JSON 即可重试"""
+    store = PnlStore() if store is None else store
+    model = quants_wqb_alpha_handler.model
+    last_id, moved = 0, 0
+    while True:
+        alphas = (
+            db.query(model)
+            .filter(model.pnl_state == model.PNL_STATE_JSON, model.id > last_id)
+            .order_by(model.id)
+            .limit(chunk)
+            .all()
+        )
+        if not alphas:
+            break
+        last_id = alphas[-1].id
+        items, failed = [], []
+        for alpha in alphas:
+            try:
+                dates, values = parse_pnl_recordset(alpha.wqb_pnl_data)
+                items.append((alpha.id, dates, values))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Failed to parse PnL of alpha {alpha.id}: {e}")
+                failed.append(alpha.id)
+        store.put_many(items)
+        for alpha_id, _, _ in items:
+            quants_wqb_alpha_handler.update(
+                db,
+                obj_in={
+                    "id": alpha_id,
+                    "pnl_state": model.PNL_STATE_STORED,
+                    "wqb_pnl_data": {},
+                },
+            )
+        for alpha_id in failed:
+            quants_wqb_alpha_handler.update(
+                db, obj_in={"id": alpha_id, "pnl_state": model.PNL_STATE_FAILED}
+            )
+        db.commit()
+        moved += len(items)
+        print(f"Migrated PnL of {moved} alphas")
+    return moved
+
+
+def load_pnl(db: Session, filters: Optional[dict] = None, store=None):
+    """按条件查出已存入 PnL 的 alpha，返回 (alpha 列表, 累计 PnL 矩阵)，行一一对应"""
+    store = PnlStore() if store is None else store
+    alphas = quants_wqb_alpha_handler.search(
+        db,
+        q={"pnl_state": models.QuantsWqbAlphaModel.PNL_STATE_STORED, **(filters or {})},
+    )
+    by_id = {a.id: a for a in alphas}
+    found, matrix = store.load(by_id)
+    return [by_id[i] for i in found], matrix
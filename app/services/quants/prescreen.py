@@ -0,0 +1,230 @@
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import models
+from app.common.wqb import VECTOR_REDUCTIONS
+from app.crud import quants_wqb_alpha_handler
+
+from .local.cache import NodeCache
+from .local.executor import BatchScorer, Candidate, ScoreRow
+from .local.panel import Panel, PanelStore
+
+
+class ScreenThresholds(NamedTuple):
+    """本地回测的通过门槛，比 WQB 提交标准宽松，只淘汰明显不合格的候选"""
+
+    sharpe: float = 0.8
+    fitness: float = 0.4
+    min_turnover: float = 0.01
+    max_turnover: float = 0.7
+
+    def reject_reason(self, metrics: dict) -> Optional[str]:
+        """metrics 为 SimulationResult.as_dict() 的结果"""
+        if metrics["turnover"] == 0:
+            return "no_position"
+        if metrics["sharpe"] < self.sharpe:
+            return "low_sharpe"
+        if metrics["fitness"] < self.fitness:
+            return "low_fitness"
+        if metrics["turnover"] < self.min_turnover:
+            return "low_turnover"
+        if metrics["turnover"] > self.max_turnover:
+            return "high_turnover"
+        return None
+
+
+class ScreenStats:
+    """按批次统计通过、淘汰、无法本地评估的数量，淘汰数即节省的远程回测次数"""
+
+    PASSED = "passed"
+    REJECTED = "rejected"
+    SKIPPED = "skipped"
+
+    def __init__(self):
+        self.batches: Dict[str, Counter] = {}
+        self.reasons = Counter()
+        self.started = time.monotonic()
+
+    def add(self, batch_no: str, outcome: str, reason: str = ""):
+        self.batches.setdefault(batch_no, Counter())[outcome] += 1
+        if reason:
+            self.reasons[reason] += 1
+
+    def total(self, outcome: Optional[str] = None) -> int:
+        return sum(
+            sum(c.values()) if outcome is None else c[outcome]
+            for c in self.batches.values()
+        )
+
+    def print(self):
+        total, elapsed = self.total(), time.monotonic() - self.started
+        rejected = self.total(self.REJECTED)
+        print(
+            f"Pre-screened {total} alphas in {elapsed:.1f}s: "
+            f"passed {self.total(self.PASSED)}, rejected {rejected}, "
+            f"skipped {self.total(self.SKIPPED)}; "
+            f"saved {rejected} remote simulations ({rejected / max(total, 1):.1%})"
+        )
+        for batch_no, counter in sorted(self.batches.items()):
+            print(f"  {batch_no or '-'}: {dict(counter)}")
+        if self.reasons:
+            print(f"  reasons: {dict(self.reasons.most_common())}")
+
+
+class PreScreener:
+    """生成与远程回测之间的本地预筛
+
+    待回测的 alpha 按面板分组，交给 BatchScorer 分块求值并回测（processes > 1 时多进程），
+    同一块内的公共子表达式只计算一次。本地回测达到门槛的进入 STATE_SCREENED，
+    未达到的进入 STATE_SCREEN_REJECTED 并记录原因；没有本地面板或含本地不支持的
+    操作符、字段时无法判断，直接放行到 STATE_SCREENED 并在 screen_reason 中注明
+    """
+
+    def __init__(
+        self,
+        store: Optional[PanelStore] = None,
+        thresholds: ScreenThresholds = ScreenThresholds(),
+        batch_size: int = 200,
+        processes: int = 1,
+        chunk_size: int = 50,
+        cache: Optional[NodeCache] = None,
+    ):
+        self.store = store or PanelStore()
+        self.thresholds = thresholds
+        self.batch_size = batch_size
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.cache = cache
+
+    def select_alphas(
+        self, db: Session, filters: Optional[dict] = None
+    ) -> List[models.QuantsWqbAlphaModel]:
+        return quants_wqb_alpha_handler.search(
+            db,
+            q={"state": models.QuantsWqbAlphaModel.STATE_PENDING, **(filters or {})},
+        )
+
+    def judge(self, row: ScoreRow) -> Tuple[str, str]:
+        """返回 (结果, 原因)"""
+        if row.error:
+            return ScreenStats.SKIPPED, row.error
+        reason = self.thresholds.reject_reason(row.metrics)
+        if reason:
+            return ScreenStats.REJECTED, reason
+        return ScreenStats.PASSED, ""
+
+    def screen_panel(
+        self,
+        db: Session,
+        panel: Panel,
+        alphas: List[models.QuantsWqbAlphaModel],
+        stats: ScreenStats,
+    ):
+        scorer = BatchScorer(panel, self.processes, self.chunk_size, cache=self.cache)
+        version = panel.version
+        candidates = [Candidate(a.expression, a.settings) for a in alphas]
+        for done, row in enumerate(scorer.score(candidates), 1):
+            alpha = alphas[row.index]
+            outcome, reason = self.judge(row)
+            local_data = (
+                {**row.metrics, "panel_version": version} if row.metrics else {}
+            )
+            self.save(db, alpha, outcome, reason, local_data)
+            stats.add(alpha.batch_no, outcome, reason.split(":")[0])
+            if done % self.batch_size == 0:
+                db.commit()
+        db.commit()
+
+    def save(
+        self,
+        db: Session,
+        alpha: models.QuantsWqbAlphaModel,
+        outcome: str,
+        reason: str,
+        local_data: dict,
+    ):
+        model = models.QuantsWqbAlphaModel
+        state = (
+            model.STATE_SCREEN_REJECTED
+            if outcome == ScreenStats.REJECTED
+            else model.STATE_SCREENED
+        )
+        quants_wqb_alpha_handler.update(
+            db,
+            obj_in={
+                "id": alpha.id,
+                "state": state,
+                "screen_reason": reason[:255],
+                "local_data": local_data,
+            },
+        )
+
+    def screen(self, db: Session, alphas: List[models.QuantsWqbAlphaModel]):
+        stats = ScreenStats()
+        groups: Dict[Tuple, List[models.QuantsWqbAlphaModel]] = {}
+        for alpha in alphas:
+            groups.setdefault((alpha.region, alpha.delay, alpha.universe), []).append(
+                alpha
+            )
+        for key, members in groups.items():
+            panel = self.store.panel(*key)
+            if not panel.exists():
+                for alpha in members:
+                    self.save(db, alpha, ScreenStats.SKIPPED, "no local panel", {})
+                    stats.add(alpha.batch_no, ScreenStats.SKIPPED, "no local panel")
+                db.commit()
+                continue
+            self.screen_panel(db, panel, members, stats)
+        return stats
+
+    def run(self, db: Session, filters: Optional[dict] = None):
+        alphas = self.select_alphas(db, filters)
+        if not alphas:
+            print("Pre-screen skipped, no pending alphas")
+            return
+        self.screen(db, alphas).print()
+
+
+def best_vector_reductions(
+    fields: List[models.QuantsWqbDataFieldModel],
+    store: Optional[PanelStore] = None,
+    reductions: List[str] = VECTOR_REDUCTIONS,
+    processes: int = 1,
+    cache: Optional[NodeCache] = None,
+) -> Dict[int, str]:
+    """在本地面板上用字段自身的 settings 回测每个向量字段的各种归约，
+    返回 {字段ID: 最优归约}，按 (fitness, sharpe) 取最优；
+    没有本地面板或面板中没有该向量字段的不返回，生成时仍用 vec_avg
+    """
+    store = store or PanelStore()
+    groups: Dict[Tuple, List[models.QuantsWqbDataFieldModel]] = {}
+    for field in fields:
+        if field.typ == field.TYP_VECTOR:
+            groups.setdefault((field.region, field.delay, field.universe), []).append(
+                field
+            )
+    best: Dict[int, str] = {}
+    for key, members in groups.items():
+        panel = store.panel(*key)
+        if not panel.exists():
+            continue
+        members = [f for f in members if panel.has_vector(f.name)]
+        candidates = [
+            Candidate(f"{op}({f.name})", f.settings)
+            for f in members
+            for op in reductions
+        ]
+        scores: Dict[int, Tuple[float, float]] = {}
+        scorer = BatchScorer(panel, processes, cache=cache)
+        for row in scorer.score(candidates):
+            if row.error:
+                continue
+            field = members[row.index // len(reductions)]
+            score = (row.metrics["fitness"], row.metrics["sharpe"])
+            if field.id not in scores or score > scores[field.id]:
+                scores[field.id] = score
+                best[field.id] = reductions[row.index % len(reductions)]
+    return best
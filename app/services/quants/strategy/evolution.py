@@ -0,0 +1,168 @@
+import random
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bc_fastkit.common.typing import DATETIME_FORMAT
+from sqlalchemy.orm import Session
+
+from app import models
+from app.common.expression import ExpressionSyntaxError
+from app.crud import quants_wqb_alpha_handler
+
+from ..evolution import ExpressionMutator, field_names, tournament
+from ..hash_index import ExpressionHashIndex, persistent_hash_index
+from ..ingest import AlphaIngestor
+from ..validator import ExpressionValidator
+
+
+class EvolutionStrategy:
+    """把已回测的 alpha 当作种群做进化搜索，每代产出不超过 budget 个新表达式
+
+    父代按 fitness / sharpe 锦标赛选择，子代沿用父代 settings，
+    经签名校验与 expression_hash 去重后以待回测状态写库，回测后即成为下一代的种群
+    """
+
+    def __init__(
+        self,
+        budget: int = 500,
+        population_size: int = 200,
+        crossover_rate: float = 0.3,
+        tournament_size: int = 3,
+        max_attempts: int = 20,
+        seed: Optional[int] = None,
+        insert_chunk_size: int = 1000,
+        persistent_hash_index: bool = True,
+    ):
+        self.budget = budget
+        self.population_size = population_size
+        self.crossover_rate = crossover_rate
+        self.tournament_size = tournament_size
+        # 每个名额最多尝试的次数，避免种群收敛后空转
+        self.max_attempts = max_attempts
+        self.rng = random.Random(seed)
+        self.insert_chunk_size = insert_chunk_size
+        self.persistent_hash_index = persistent_hash_index
+        self.validator: Optional[ExpressionValidator] = None
+        self.hash_index: Optional[ExpressionHashIndex] = None
+
+    def get_validator(self, db: Session) -> ExpressionValidator:
+        if self.validator is None:
+            self.validator = ExpressionValidator.from_db(db)
+        return self.validator
+
+    def get_hash_index(self, db: Session) -> ExpressionHashIndex:
+        if self.hash_index is None:
+            self.hash_index = (
+                persistent_hash_index(db)
+                if self.persistent_hash_index
+                else ExpressionHashIndex.load(db)
+            )
+        return self.hash_index
+
+    @staticmethod
+    def score(alpha: models.QuantsWqbAlphaModel) -> tuple:
+        return float(alpha.fitness or 0), float(alpha.sharpe or 0)
+
+    def select_population(
+        self, db: Session, filters: Optional[dict] = None
+    ) -> List[models.QuantsWqbAlphaModel]:
+        # sharpe / fitness 只在回测后才有值
+        alphas = quants_wqb_alpha_handler.search(
+            db, q={"sharpe_gt": 1, "fitness_gt": 0.5, **(filters or {})}
+        )
+        alphas.sort(key=self.score, reverse=True)
+        return alphas[: self.population_size]
+
+    def new_mutators(
+        self, population: List[models.QuantsWqbAlphaModel]
+    ) -> Dict[str, ExpressionMutator]:
+        """字段池按 region 区分，替换字段时只用同一市场里出现过的字段"""
+        expressions = defaultdict(list)
+        for alpha in population:
+            expressions[alpha.region].append(alpha.expression)
+        return {
+            region: ExpressionMutator(field_names(exprs), rng=self.rng)
+            for region, exprs in expressions.items()
+        }
+
+    def breed(
+        self,
+        population: List[models.QuantsWqbAlphaModel],
+        mutators: Dict[str, ExpressionMutator],
+    ):
+        """返回 (父代, 子代表达式)，变异失败时子代为 None"""
+        parent = tournament(population, self.score, self.rng, self.tournament_size)
+        mutator = mutators[parent.region]
+        donor = None
+        if self.rng.random() < self.crossover_rate:
+            # 只与同一市场的个体交叉，避免引入该市场不存在的字段
+            mates = [a for a in population if a.region == parent.region]
+            mate = tournament(mates, self.score, self.rng, self.tournament_size)
+            if mate.id != parent.id:
+                donor = mate.expression
+        return parent, mutator.offspring(parent.expression, donor)
+
+    def evolve(
+        self,
+        db: Session,
+        population: List[models.QuantsWqbAlphaModel],
+        batch_no: str,
+    ):
+        validator = self.get_validator(db)
+        operator_defaults = quants_wqb_alpha_handler.operator_defaults(db)
+        ingestor = AlphaIngestor(
+            db, chunk_size=self.insert_chunk_size, hash_index=self.get_hash_index(db)
+        )
+        mutators = self.new_mutators(population)
+        rejections = Counter()
+        model = models.QuantsWqbAlphaModel
+        accepted = 0
+        for _ in range(self.budget * self.max_attempts):
+            if accepted >= self.budget:
+                break
+            try:
+                parent, expression = self.breed(population, mutators)
+            except ExpressionSyntaxError:
+                rejections["syntax"] += 1
+                continue
+            if expression is None:
+                rejections["no_change"] += 1
+                continue
+            reason = validator.reject_reason(expression)
+            if reason:
+                rejections[reason] += 1
+                continue
+            accepted += ingestor.add(
+                {
+                    "parent_id": parent.id,
+                    "template_id": parent.template_id,
+                    "batch_no": batch_no,
+                    "typ": parent.typ,
+                    "expression": expression,
+                    "settings": parent.settings,
+                    "state": model.STATE_PENDING,
+                    "expression_hash": model.generate_expression_hash(
+                        expression, parent.settings, operator_defaults
+                    ),
+                }
+            )
+        ingestor.flush()
+        return ingestor, rejections
+
+    def run(self, db: Session, filters: Optional[dict] = None):
+        batch_no = f"""{datetime.now().strftime(DATETIME_FORMAT)}_evolution"""
+        population = self.select_population(db, filters)
+        if not population:
+            print("Evolution skipped, no simulated alphas")
+            return
+        ingestor, rejections = self.evolve(db, population, batch_no)
+        print(
+            f"Evolution over {len(population)} alphas inserted {ingestor.inserted}, "
+            f"deduped {ingestor.deduped} in memory, not inserted {ingestor.skipped} in db"
+        )
+        if rejections:
+            print(
+                f"Evolution rejected {sum(rejections.values())}: "
+                f"{dict(rejections.most_common())}"
+            )
@@ -0,0 +1,114 @@
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence
+
+from bc_fastkit.common.typing import DATETIME_FORMAT
+from sqlalchemy.orm import Session
+
+from app import models
+from app.common.wqb import NEUTRALIZATION_OPERATORS, SWEEP_DECAYS, SWEEP_TRUNCATIONS
+from app.crud import quants_wqb_alpha_handler
+
+from ..hash_index import ExpressionHashIndex, persistent_hash_index
+from ..ingest import AlphaIngestor
+from ..utils import iter_sampled_combos
+
+
+class SettingsSweepStrategy:
+    """对表现好的 alpha 在 neutralization / decay / truncation 网格上重新取样回测
+
+    每个 alpha 在网格上无放回均匀抽样，写库前按 expression_hash 去重，
+    已回测或已排队的组合不计入预算
+    """
+
+    def __init__(
+        self,
+        budget: int = 1000,
+        per_alpha: int = 20,
+        neutralizations: Sequence[str] = NEUTRALIZATION_OPERATORS,
+        decays: Sequence[int] = SWEEP_DECAYS,
+        truncations: Sequence[float] = SWEEP_TRUNCATIONS,
+        seed: Optional[int] = None,
+        insert_chunk_size: int = 1000,
+        persistent_hash_index: bool = True,
+    ):
+        self.budget = budget
+        self.per_alpha = per_alpha
+        self.grid = {
+            "neutralization": list(neutralizations),
+            "decay": list(decays),
+            "truncation": list(truncations),
+        }
+        self.seed = seed
+        self.insert_chunk_size = insert_chunk_size
+        self.persistent_hash_index = persistent_hash_index
+        self.hash_index: Optional[ExpressionHashIndex] = None
+
+    def get_hash_index(self, db: Session) -> ExpressionHashIndex:
+        if self.hash_index is None:
+            self.hash_index = (
+                persistent_hash_index(db)
+                if self.persistent_hash_index
+                else ExpressionHashIndex.load(db)
+            )
+        return self.hash_index
+
+    def select_alphas(
+        self, db: Session, filters: Optional[dict] = None
+    ) -> List[models.QuantsWqbAlphaModel]:
+        alphas = quants_wqb_alpha_handler.search(
+            db, q={"sharpe_gt": 1.2, "fitness_gt": 1, **(filters or {})}
+        )
+        # 好的 alpha 优先占用预算
+        return sorted(
+            alphas, key=lambda a: (a.sharpe or 0, a.fitness or 0), reverse=True
+        )
+
+    def iter_settings(self, alpha: models.QuantsWqbAlphaModel) -> Iterator[dict]:
+        """按 alpha 区分种子，重复运行时同一 alpha 的抽样顺序稳定"""
+        seed = None if self.seed is None else self.seed * 1_000_003 + alpha.id
+        for _, combo in iter_sampled_combos(self.grid, seed=seed, uniform=True):
+            yield {**alpha.settings, **combo}
+
+    def sweep(
+        self, db: Session, alphas: List[models.QuantsWqbAlphaModel], batch_no: str
+    ) -> AlphaIngestor:
+        ingestor = AlphaIngestor(
+            db, chunk_size=self.insert_chunk_size, hash_index=self.get_hash_index(db)
+        )
+        operator_defaults = quants_wqb_alpha_handler.operator_defaults(db)
+        model = models.QuantsWqbAlphaModel
+        remaining = self.budget
+        for alpha in alphas:
+            if remaining <= 0:
+                break
+            accepted = 0
+            for settings in self.iter_settings(alpha):
+                if accepted >= min(self.per_alpha, remaining):
+                    break
+                added = ingestor.add(
+                    {
+                        "parent_id": alpha.id,
+                        "template_id": alpha.template_id,
+                        "batch_no": batch_no,
+                        "typ": alpha.typ,
+                        "expression": alpha.expression,
+                        "settings": settings,
+                        "state": model.STATE_PENDING,
+                        "expression_hash": model.generate_expression_hash(
+                            alpha.expression, settings, operator_defaults
+                        ),
+                    }
+                )
+                accepted += added
+            remaining -= accepted
+        ingestor.flush()
+        return ingestor
+
+    def run(self, db: Session, filters: Optional[dict] = None):
+        batch_no = f"""{datetime.now().strftime(DATETIME_FORMAT)}_settings_sweep"""
+        alphas = self.select_alphas(db, filters)
+        ingestor = self.sweep(db, alphas, batch_no)
+        print(
+            f"Settings sweep over {len(alphas)} alphas inserted {ingestor.inserted}, "
+            f"deduped {ingestor.deduped} in memory, not inserted {ingestor.skipped} in db"
+        )
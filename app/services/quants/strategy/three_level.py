@@ -1,11 +1,10 @@
 import random
+from collections import Counter
 from datetime import datetime
 from typing import List, Optional, Tuple
 
-import pymysql
 from bc_fastkit.common.typing import DATETIME_FORMAT
 from sqlalchemy import func
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app import models
@@ -15,7 +14,19 @@ from app.crud import (
     quants_wqb_data_field_handler,
 )
 
-from ..utils import ExpressionGenerator
+from .. import cursor as generation_cursor
+from ..hash_index import ExpressionHashIndex, persistent_hash_index
+from ..ingest import AlphaIngestor
+from ..local.panel import PanelStore
+from ..parallel import (
+    ExpansionTask,
+    expand_parallel,
+    iter_rows,
+    new_generator,
+)
+from ..prescreen import best_vector_reductions
+from ..utils import FieldRecord
+from ..validator import ExpressionValidator
 from ..worldbrain import wqb_client
 
 
@@ -27,12 +38,111 @@ class ThreeLevelStrategy:
         regions: Optional[list[str]] = None,
         categories: Optional[list[str]] = None,
         settings: Optional[dict] = None,
+        insert_chunk_size: int = 1000,
+        persistent_hash_index: bool = True,
+        processes: int = 1,
+        resume: bool = True,
+        best_vector_reduction: bool = False,
+        panel_store: Optional[PanelStore] = None,
     ):
+        self.resume = resume
+        self.best_vector_reduction = best_vector_reduction
+        self.panel_store = panel_store
         self.batch_size = batch_size
+        self.insert_chunk_size = insert_chunk_size
+        self.persistent_hash_index = persistent_hash_index
+        self.processes = processes
         self.regions = regions
         self.categories = categories
         self.template_ids = list(template_ids)
         self.settings = settings or {}
+        self.validator: Optional[ExpressionValidator] = None
+        self.hash_index: Optional[ExpressionHashIndex] = None
+
+    def get_validator(self, db: Session) -> ExpressionValidator:
+        """操作符签名索引每次运行只从数据库编译一次"""
+        if self.validator is None:
+            self.validator = ExpressionValidator.from_db(db)
+        return self.validator
+
+    def get_hash_index(self, db: Session) -> ExpressionHashIndex:
+        """已存在的 expression_hash 每次运行只加载一次，之后随生成增量加入"""
+        if self.hash_index is None:
+            self.hash_index = (
+                persistent_hash_index(db)
+                if self.persistent_hash_index
+                else ExpressionHashIndex.load(db)
+            )
+        return self.hash_index
+
+    def new_ingestor(self, db: Session, on_flush=None) -> AlphaIngestor:
+        return AlphaIngestor(
+            db,
+            chunk_size=self.insert_chunk_size,
+            hash_index=self.get_hash_index(db),
+            on_flush=on_flush,
+        )
+
+    def new_task(
+        self,
+        db: Session,
+        template,
+        records: List[FieldRecord],
+        data_field_name: str,
+        batch_no: str,
+        vector_reductions: Optional[dict] = None,
+    ) -> Tuple[ExpansionTask, models.QuantsGenerationCursorModel]:
+        """创建展开任务及其游标；resume 时沿用上次中断的批次、种子与位置"""
+        cursor = None
+        if self.resume:
+            cursor, resumed = generation_cursor.resume_cursor(
+                db,
+                template=template,
+                data_field_name=data_field_name,
+                limit=self.batch_size,
+                vector_reductions=vector_reductions,
+            )
+            if cursor is not None:
+                records = resumed
+                print(
+                    f"Resuming template {template.title} from {cursor.position}"
+                    f"/{cursor.total}, batch {cursor.batch_no}"
+                )
+        if cursor is None:
+            cursor = generation_cursor.open_cursor(
+                db,
+                batch_no=batch_no,
+                template=template,
+                data_field_name=data_field_name,
+                records=records,
+                limit=self.batch_size,
+            )
+        task = ExpansionTask(
+            template_id=template.id,
+            typ=template.typ,
+            template=template.expression,
+            fields={**template.default_field, data_field_name: records},
+            data_field_name=data_field_name,
+            batch_no=cursor.batch_no,
+            limit=self.batch_size,
+            seed=cursor.seed,
+            settings=self.settings,
+            start=cursor.position,
+        )
+        return task, cursor
+
+    def report_ingestion(self, template, ingestor: AlphaIngestor):
+        print(
+            f"Template {template.title} inserted {ingestor.inserted}, "
+            f"deduped {ingestor.deduped} in memory, not inserted {ingestor.skipped} in db"
+        )
+
+    def report_rejections(self, template, rejections: Counter):
+        if rejections:
+            print(
+                f"Template {template.title} rejected {sum(rejections.values())}: "
+                f"{dict(rejections.most_common())}"
+            )
 
     def select_data_fields(self, db: Session) -> List[models.QuantsWqbDataFieldModel]:
         pyramids_info = wqb_client.get_pyramids_alpha_info()
@@ -56,6 +166,76 @@ class ThreeLevelStrategy:
             random.shuffle(rs)
         return rs[: self.batch_size]
 
+    def expand_templates(
+        self,
+        db: Session,
+        templates,
+        fields: list,
+        data_field_name: str,
+        batch_no: str,
+        vector_reductions: Optional[dict] = None,
+    ):
+        """展开模板并批量写库，processes > 1 时在进程池中并行展开
+
+        每个模板的种子与抽样位置保存在生成游标中：串行时游标随每次写库在同一事务内推进，
+        中断后可精确续跑；并行时各分片完成后才标记完成，续跑从上次保存的位置重新展开，
+        重复部分由 hash_index 去重；vector_reductions 为向量字段ID到归约操作符的映射
+        """
+        records = [FieldRecord.from_model(v, vector_reductions) for v in fields]
+        tasks, cursors = [], {}
+        for template in templates:
+            task, cursor = self.new_task(
+                db, template, records, data_field_name, batch_no, vector_reductions
+            )
+            tasks.append(task)
+            cursors[template.id] = cursor
+        templates_by_id = {template.id: template for template in templates}
+        validator = self.get_validator(db)
+        operator_defaults = quants_wqb_alpha_handler.operator_defaults(db)
+        if self.processes <= 1:
+            for task in tasks:
+                generator = new_generator(task, validator)
+                cursor = cursors[task.template_id]
+                ingestor = self.new_ingestor(
+                    db,
+                    on_flush=lambda: generation_cursor.save_position(
+                        db, cursor, generator.position
+                    ),
+                )
+                for row in iter_rows(task, generator, operator_defaults):
+                    print(f"Generating expression {row['expression']}")
+                    ingestor.add(row)
+                ingestor.flush()
+                generation_cursor.save_position(
+                    db, cursor, generator.position, done=True
+                )
+                db.commit()
+                self.report_ingestion(templates_by_id[task.template_id], ingestor)
+                self.report_rejections(
+                    templates_by_id[task.template_id], generator.rejections
+                )
+            return
+        ingestors = {task.template_id: self.new_ingestor(db) for task in tasks}
+        rejections = {task.template_id: Counter() for task in tasks}
+        for result in expand_parallel(
+            tasks,
+            list(validator.signatures.values()),
+            operator_defaults,
+            self.processes,
+        ):
+            for row in result.rows:
+                ingestors[result.template_id].add(row)
+            rejections[result.template_id].update(result.rejections)
+        for template_id, ingestor in ingestors.items():
+            ingestor.flush()
+            cursor = cursors[template_id]
+            generation_cursor.save_position(db, cursor, cursor.total, done=True)
+            db.commit()
+            self.report_ingestion(templates_by_id[template_id], ingestor)
+            self.report_rejections(
+                templates_by_id[template_id], rejections[template_id]
+            )
+
     def generate_first_level_alpha(self, db: Session):
         fields = self.select_data_fields(db)
         templates = quants_alpha_template_handler.search(
@@ -63,41 +243,19 @@ class ThreeLevelStrategy:
         )
         batch_no = f"""{datetime.now().strftime(DATETIME_FORMAT)}_first_level"""
         # TODO fields生成修改
-        for template in templates:
-            print(
-                f"Generating first level alphas, template: {template.title}, fields: {len(fields)}"
-            )
-            generator = ExpressionGenerator(
-                template.expression, {**template.default_field, "data_field": fields}
+        print(
+            f"Generating first level alphas, templates: {[t.title for t in templates]}, "
+            f"fields: {len(fields)}"
+        )
+        vector_reductions = None
+        if self.best_vector_reduction:
+            vector_reductions = best_vector_reductions(
+                fields, self.panel_store, processes=self.processes
             )
-            for expression, field_combo in generator.generate(
-                db, limit=self.batch_size
-            ):
-                settings = {
-                    **field_combo[generator.data_field_name].settings,
-                    **self.settings,
-                }
-                print(f"Generating expression {expression}")
-                obj_in = {
-                    "template_id": template.id,
-                    "batch_no": batch_no,
-                    "typ": template.typ,
-                    "expression": expression,
-                    "settings": settings,
-                    "state": models.QuantsWqbAlphaModel.STATE_PENDING,
-                }
-                try:
-                    quants_wqb_alpha_handler.create(db, obj_in=obj_in)
-                    db.commit()
-                except IntegrityError as e:
-                    print(e)
-                    if (
-                        isinstance(e.orig, pymysql.err.IntegrityError)
-                        and e.orig.args[0] == 1062
-                    ):
-                        continue
-                    else:
-                        raise e
+            print(f"Best vector reductions from local panels: {vector_reductions}")
+        self.expand_templates(
+            db, templates, fields, "data_field", batch_no, vector_reductions
+        )
 
     def generate_second_level_alpha(self, db: Session, filters: Optional[dict] = None):
         batch_no = f"""{datetime.now().strftime(DATETIME_FORMAT)}_second_level"""
@@ -107,36 +265,7 @@ class ThreeLevelStrategy:
         templates = quants_alpha_template_handler.search(
             db, q={"id": self.template_ids, "typ": 2}
         )
-        for template in templates:
-            generator = ExpressionGenerator(
-                template.expression,
-                {**template.default_field, "sig1": alphas},
-                data_field_name="sig1",
-            )
-            for expression, field_combo in generator.generate(
-                db, limit=self.batch_size
-            ):
-                prev_alpha = field_combo[generator.data_field_name]
-                settings = {**prev_alpha.settings, **self.settings}
-                obj_in = {
-                    "parent_id": prev_alpha.id,
-                    "template_id": template.id,
-                    "batch_no": batch_no,
-                    "typ": template.typ,
-                    "expression": expression,
-                    "settings": settings,
-                    "state": models.QuantsWqbAlphaModel.STATE_PENDING,
-                }
-                try:
-                    quants_wqb_alpha_handler.create(db, obj_in=obj_in)
-                except IntegrityError as e:
-                    if (
-                        isinstance(e.orig, pymysql.err.IntegrityError)
-                        and e.orig.args[0] == 1062
-                    ):
-                        continue
-                    else:
-                        raise e
+        self.expand_templates(db, templates, alphas, "sig1", batch_no)
 
     def generate_third_level_alpha(self, db: Session, filters: Optional[dict] = None):
         batch_no = f"""{datetime.now().strftime(DATETIME_FORMAT)}_third_level"""
@@ -146,36 +275,7 @@ class ThreeLevelStrategy:
         templates = quants_alpha_template_handler.search(
             db, q={"id": self.template_ids, "typ": 3}
         )
-        for template in templates:
-            generator = ExpressionGenerator(
-                template.expression,
-                {**template.default_field, "sig2": alphas},
-                data_field_name="sig2",
-            )
-            for expression, field_combo in generator.generate(
-                db, limit=self.batch_size
-            ):
-                prev_alpha = field_combo[generator.data_field_name]
-                settings = {**prev_alpha.settings, **self.settings}
-                obj_in = {
-                    "parent_id": prev_alpha.id,
-                    "template_id": template.id,
-                    "batch_no": batch_no,
-                    "typ": template.typ,
-                    "expression": expression,
-                    "settings": settings,
-                    "state": models.QuantsWqbAlphaModel.STATE_PENDING,
-                }
-                try:
-                    quants_wqb_alpha_handler.create(db, obj_in=obj_in)
-                except IntegrityError as e:
-                    if (
-                        isinstance(e.orig, pymysql.err.IntegrityError)
-                        and e.orig.args[0] == 1062
-                    ):
-                        continue
-                    else:
-                        raise e
+        self.expand_templates(db, templates, alphas, "sig2", batch_no)
 
     def run(self, db: Session, filters: Optional[dict] = None):
         self.generate_first_level_alpha(db)
@@ -1,14 +1,21 @@
 import random
 import re
+from collections import Counter
 from datetime import date, datetime
-from itertools import product
-from typing import Iterator, Optional, Tuple
+from string import Formatter
+from typing import Iterator, NamedTuple, Optional, Tuple
 
 from bc_fastkit.common.typing import D
 from sqlalchemy.orm import Session
 
 from app import models
-from app.common.wqb import COUNTRY_GROUPING_OPERATOR, COUNTRY_GROUPING_REGIONS
+from app.common.wqb import (
+    COUNTRY_GROUPING_OPERATOR,
+    COUNTRY_GROUPING_REGIONS,
+    VECTOR_REDUCTIONS,
+)
+
+from .validator import ExpressionValidator
 
 TAG_RE = re.compile(r"<([A-Za-z0-9_]+)\s*/>")
 CLOSE_TAG_RE = re.compile(r"</>\s*")
@@ -32,12 +39,27 @@ def convert_template_to_format(template: str) -> str:
     return out
 
 
-def rand_index(total: int, limit: int, step_mul: int = 2) -> Iterator[int]:
-    """在 total 个元素中随机均匀选择 limit 个索引"""
+def rand_index(
+    total: int,
+    limit: int,
+    step_mul: int = 2,
+    *,
+    uniform: bool = False,
+    rng: Optional[random.Random] = None,
+) -> Iterator[int]:
+    """在 total 个元素中随机均匀选择 limit 个索引
+
+    - uniform=False 时按步长分段抽样，返回递增索引
+    - uniform=True 时为无放回的均匀抽样，内存只与 limit 相关，返回顺序随机
+    """
     if limit >= total:
         yield from range(total)
         return
-    rng = random.Random()
+    rng = rng or random.Random()
+    if uniform:
+        # range 不会展开，random.sample 内部按 limit 大小选用集合抽样
+        yield from rng.sample(range(total), limit)
+        return
     prev = -1
     mul = total // limit
     for i in range(limit):
@@ -46,46 +68,135 @@ def rand_index(total: int, limit: int, step_mul: int = 2) -> Iterator[int]:
         prev = idx
 
 
-def descartes_strategy(
+def unrank_combo(idx: int, values: list) -> tuple:
+    """把笛卡尔积中的序号还原为组合，顺序与 itertools.product 一致"""
+    combo = [None] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        idx, r = divmod(idx, len(values[i]))
+        combo[i] = values[i][r]
+    return tuple(combo)
+
+
+def iter_sampled_combos(
     fields: D,
     *,
     limit: Optional[int] = None,
     randomize: bool = True,
     seed: Optional[int] = None,
-) -> Iterator[D]:
+    uniform: bool = False,
+    shard: Tuple[int, int] = (0, 1),
+    start: int = 0,
+) -> Iterator[Tuple[int, D]]:
+    """产出 (抽样序号, 组合)
+
+    - shard=(i, n) 时只产出抽样序列中第 i, i+n, i+2n... 个组合，
+      相同 seed 的 n 个分片合起来与不分片的结果一致
+    - start 跳过抽样序列的前 start 个位置，只重放随机数，不还原组合
+    """
     keys = list(fields.keys())
-    values = [fields[k] for k in keys]
+    # 在副本上打乱，保证同一 seed 的抽样序列只由输入决定，可重放
+    values = [list(fields[k]) for k in keys]
     total = 1
     for v in values:
         total *= len(v)
     limit = min(limit or total, total)
+    rng = random.Random(seed)
     if randomize:
-        rng = random.Random(seed)
         for v in values:
             rng.shuffle(v)
-    choice = rand_index(total, limit)
-    next_idx = next(choice, None)
-    for idx, combo in enumerate(product(*values)):
-        if next_idx is None:
-            break
-        if idx != next_idx:
-            continue
-        yield dict(zip(keys, combo))
-        next_idx = next(choice, None)
+    shard_no, shard_count = shard
+    # 直接按序号还原组合，开销只与 limit 相关，不再遍历整个 product
+    choice = rand_index(
+        total, limit, uniform=uniform, rng=rng if seed is not None else None
+    )
+    for i, idx in enumerate(choice):
+        if i >= start and i % shard_count == shard_no:
+            yield i, dict(zip(keys, unrank_combo(idx, values)))
+
+
+def descartes_strategy(fields: D, **kwargs) -> Iterator[D]:
+    for _, combo in iter_sampled_combos(fields, **kwargs):
+        yield combo
+
+
+def field_text(v, vector_reductions: Optional[dict] = None) -> str:
+    """数据字段在表达式中的写法；向量字段按 vector_reductions[字段ID] 归约，默认 vec_avg"""
+    if v.typ != v.TYP_VECTOR:
+        return v.name
+    reduction = (vector_reductions or {}).get(v.id, VECTOR_REDUCTIONS[0])
+    return f"{reduction}({v.name})"
+
+
+class FieldRecord(NamedTuple):
+    """数据字段 / 父 alpha 的轻量表示，可廉价地传给子进程"""
+
+    id: int
+    text: str
+    settings: dict
+    parent_id: int = 0
+
+    @classmethod
+    def from_model(cls, v, vector_reductions: Optional[dict] = None) -> "FieldRecord":
+        if isinstance(v, models.QuantsWqbDataFieldModel):
+            return cls(v.id, field_text(v, vector_reductions), v.settings)
+        return cls(v.id, v.expression, v.settings, parent_id=v.id)
+
+
+class RenderPlan:
+    """把 str.format 模板编译为字面量片段 + 占位符下标，渲染时只需拼接字符串"""
+
+    def __init__(self, template: str):
+        parts: list = []
+        positions: list = []
+        keys: list = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            if literal:
+                parts.append(literal)
+            if field is None:
+                continue
+            if not field or spec or conversion:
+                raise ValueError(f"unsupported placeholder {{{field}}} in {template}")
+            if field not in keys:
+                keys.append(field)
+            positions.append((len(parts), field))
+            parts.append("")
+        self.template = template
+        self.parts = parts
+        self.positions = positions
+        self.keys = tuple(keys)
+
+    def render(self, pieces: D) -> str:
+        out = self.parts[:]
+        for pos, key in self.positions:
+            out[pos] = pieces[key]
+        return "".join(out)
 
 
 class ExpressionGenerator:
-    def __init__(self, template: str, fields: D, data_field_name="data_field"):
+    def __init__(
+        self,
+        template: str,
+        fields: D,
+        data_field_name="data_field",
+        validator: Optional[ExpressionValidator] = None,
+    ):
         self.template = convert_template_to_format(template)
         self.fields = fields
         self.data_field_name = data_field_name
+        self.validator = validator
+        self.rejections: Counter = Counter()
+        self.plan = RenderPlan(self.template)
+        # 按对象身份缓存，每个字段 / 父 alpha 只渲染一次、每个数据字段只构造一次 settings
+        self._rendered: dict = {}
+        self._settings: dict = {}
+        # 已消费的抽样序号位置（含校验未通过的），用于断点续跑
+        self.position = 0
 
     def parse_field(self, k, v, settings: dict) -> str:
-        if isinstance(v, models.QuantsWqbDataFieldModel):
-            if v.typ == v.TYP_VECTOR:
-                return f"vec_avg({v.name})"
-            else:
-                return v.name
+        if isinstance(v, FieldRecord):
+            return v.text
+        elif isinstance(v, models.QuantsWqbDataFieldModel):
+            return field_text(v)
         elif isinstance(v, models.QuantsWqbAlphaModel):
             return v.expression
         elif (
@@ -96,22 +207,57 @@ class ExpressionGenerator:
         else:
             return v
 
+    def field_settings(self, field_combo: D) -> dict:
+        v = field_combo.get(self.data_field_name) if self.data_field_name else None
+        if v is None:
+            return {}
+        settings = self._settings.get(id(v))
+        if settings is None:
+            settings = self._settings[id(v)] = v.settings
+        return settings
+
+    def render_field(self, k, v, settings: dict) -> str:
+        key = (k, id(v))
+        if "country_universe" in k:
+            key += (settings.get("region"),)
+        piece = self._rendered.get(key)
+        if piece is None:
+            piece = self._rendered[key] = str(self.parse_field(k, v, settings))
+        return piece
+
     def generate(
-        self, db: Session, *, limit: Optional[int] = None
+        self,
+        db: Optional[Session],
+        *,
+        limit: Optional[int] = None,
+        seed: Optional[int] = None,
+        shard: Tuple[int, int] = (0, 1),
+        start: int = 0,
     ) -> Iterator[Tuple[str, D]]:
-        for field_combo in descartes_strategy(self.fields, limit=limit):
-            if self.data_field_name and self.data_field_name in field_combo:
-                settings = field_combo[self.data_field_name].settings
-                kwargs = {
-                    k: self.parse_field(k, v, settings) for k, v in field_combo.items()
-                }
-            expression = self.template.format(**kwargs)
-            if self.validation(expression, db):
+        self.position = start
+        for i, field_combo in iter_sampled_combos(
+            self.fields, limit=limit, seed=seed, shard=shard, start=start
+        ):
+            self.position = i + 1
+            settings = self.field_settings(field_combo)
+            kwargs = {
+                k: self.render_field(k, field_combo[k], settings)
+                for k in self.plan.keys
+            }
+            expression = self.plan.render(kwargs)
+            if self.validation(expression, db, kwargs=kwargs):
                 yield expression, field_combo
 
-    def validation(self, expression: str, db: Session):
-        """ex:
+    def validation(
+        self, expression: str, db: Session, kwargs: Optional[dict] = None
+    ) -> bool:
+        """按 quants_wqb_operator 签名离线校验，ex:
         name	definition
         add	    add(x, y, filter = false), x + y
         """
-        return True
+        if self.validator is None:
+            self.validator = ExpressionValidator.from_db(db)
+        reason = self.validator.reject_reason(expression, self.template, kwargs)
+        if reason:
+            self.rejections[reason] += 1
+        return reason is None
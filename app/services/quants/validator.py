@@ -0,0 +1,204 @@
+import re
+from collections import Counter
+from string import Formatter
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.common.expression import (
+    VARIADIC_OPERATORS,
+    Assign,
+    Call,
+    ExpressionSyntaxError,
+    Node,
+    iter_calls,
+    parse_expression,
+    parse_operator_definition,
+    tokenize,
+)
+from app.crud import quants_wqb_operator_handler
+
+ELLIPSIS_RE = re.compile(r",\s*\.{2,3}\s*")
+SLOT_PREFIX = "__slot_"
+# 片段无法单独校验（如多语句、含逗号），需要对完整表达式再校验
+FALLBACK = "fallback"
+_MISSING = object()
+
+
+class OperatorSignature(NamedTuple):
+    name: str
+    min_args: Optional[int]
+    max_args: Optional[int]
+    keywords: frozenset
+    scope: frozenset
+    level: str
+
+    @classmethod
+    def from_model(cls, operator) -> "OperatorSignature":
+        """ex: add(x, y, filter = false) -> 2~3 个位置参数，关键字 filter"""
+        definition = operator.definition or ""
+        variadic = bool(ELLIPSIS_RE.search(definition))
+        name = operator.name.lower()
+        call = parse_operator_definition(ELLIPSIS_RE.sub("", definition))
+        if call is None or call.name.lower() != name:
+            min_args = max_args = None
+            keywords = frozenset()
+        else:
+            variadic = variadic or name in VARIADIC_OPERATORS
+            min_args = len(call.args)
+            max_args = None if variadic else len(call.args) + len(call.kwargs)
+            keywords = frozenset(k.lower() for k, _ in call.kwargs)
+        return cls(
+            name=name,
+            min_args=min_args,
+            max_args=max_args,
+            keywords=keywords,
+            scope=frozenset(s.upper() for s in operator.scope or []),
+            level=(operator.level or "").upper(),
+        )
+
+
+class ExpressionValidator:
+    """基于 quants_wqb_operator 的离线签名校验，不依赖远端回测
+
+    check 返回拒绝原因，None 表示通过；stats 记录每种原因的次数
+    """
+
+    def __init__(
+        self,
+        signatures: Iterable[OperatorSignature],
+        scope: str = "REGULAR",
+        levels: Optional[Iterable[str]] = None,
+    ):
+        self.signatures: Dict[str, OperatorSignature] = {s.name: s for s in signatures}
+        self.scope = scope.upper()
+        self.levels = {lv.upper() for lv in levels} if levels else None
+        self.stats: Counter = Counter()
+        self._call_cache: Dict[Tuple, Optional[str]] = {}
+        self._piece_cache: Dict[str, Optional[str]] = {}
+        self._skeleton_cache: Dict[str, Tuple[Tuple[str, ...], Optional[str]]] = {}
+
+    @classmethod
+    def from_db(cls, db: Session, **kwargs) -> "ExpressionValidator":
+        operators = quants_wqb_operator_handler.search(db, q={})
+        return cls((OperatorSignature.from_model(o) for o in operators), **kwargs)
+
+    def check_call(self, call: Call) -> Optional[str]:
+        key = (call.name, len(call.args), tuple(k for k, _ in call.kwargs))
+        if key in self._call_cache:
+            return self._call_cache[key]
+        reason = None
+        name = call.name.lower()
+        sig = self.signatures.get(name)
+        if sig is None:
+            reason = f"unknown_operator:{name}"
+        elif sig.scope and self.scope not in sig.scope:
+            reason = f"scope:{name}"
+        elif self.levels is not None and sig.level and sig.level not in self.levels:
+            reason = f"level:{name}"
+        elif sig.min_args is not None:
+            kw = {k.lower() for k, _ in call.kwargs}
+            unknown = kw - sig.keywords
+            # 必填参数只能按位置传入，关键字参数只能是带默认值的可选参数
+            if unknown:
+                reason = f"unknown_kwarg:{name}.{sorted(unknown)[0]}"
+            elif len(call.args) < sig.min_args or (
+                sig.max_args is not None and len(call.args) + len(kw) > sig.max_args
+            ):
+                reason = f"arity:{name}"
+        self._call_cache[key] = reason
+        return reason
+
+    def check_node(self, node: Node) -> Optional[str]:
+        for call in iter_calls(node):
+            reason = self.check_call(call)
+            if reason:
+                return reason
+        return None
+
+    def check_expression(self, expression: str) -> Optional[str]:
+        try:
+            node = parse_expression(expression)
+        except ExpressionSyntaxError:
+            return "syntax"
+        return self.check_node(node)
+
+    def check_piece(self, piece: str) -> Optional[str]:
+        """模板占位符渲染出的片段，必须是单个表达式才能独立校验"""
+        reason = self._piece_cache.get(piece, _MISSING)
+        if reason is not _MISSING:
+            return reason
+        try:
+            program = parse_expression(piece)
+        except ExpressionSyntaxError:
+            reason = FALLBACK
+        else:
+            if len(program.statements) != 1 or isinstance(program.result, Assign):
+                reason = FALLBACK
+            else:
+                reason = self.check_node(program)
+        self._piece_cache[piece] = reason
+        return reason
+
+    def skeleton(self, template: str) -> Tuple[Tuple[str, ...], Optional[str]]:
+        """把 str.format 模板的占位符替换为变量名后校验一次
+
+        占位符只出现在表达式位置（非操作符名、非关键字名）时，
+        完整表达式的校验结果 = 骨架结果 + 各片段结果
+        """
+        if template in self._skeleton_cache:
+            return self._skeleton_cache[template]
+        keys = tuple(
+            dict.fromkeys(f for _, f, _, _ in Formatter().parse(template) if f)
+        )
+        skeleton = template.format(**{k: f"{SLOT_PREFIX}{k}" for k in keys})
+        try:
+            tokens = list(tokenize(skeleton))
+        except ExpressionSyntaxError:
+            tokens = []
+        slots = {f"{SLOT_PREFIX}{k}" for k in keys}
+        reason = None
+        for i, tok in enumerate(tokens):
+            if tok.kind != "name" or SLOT_PREFIX not in tok.text:
+                continue
+            nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+            if tok.text not in slots or (
+                nxt is not None and nxt.kind == "op" and nxt.text in ("(", "=")
+            ):
+                reason = FALLBACK
+                break
+        if reason is None:
+            reason = self.check_expression(skeleton)
+            if reason == "syntax":
+                reason = FALLBACK
+        self._skeleton_cache[template] = (keys, reason)
+        return keys, reason
+
+    def check_template(self, template: str, kwargs: dict) -> Optional[str]:
+        keys, reason = self.skeleton(template)
+        if reason is None:
+            for k in keys:
+                reason = self.check_piece(str(kwargs[k]))
+                if reason:
+                    break
+        if reason == FALLBACK:
+            reason = self.check_expression(template.format(**kwargs))
+        return reason
+
+    def reject_reason(
+        self,
+        expression: str,
+        template: Optional[str] = None,
+        kwargs: Optional[dict] = None,
+    ) -> Optional[str]:
+        """传入模板与占位符取值时按骨架 + 片段校验，结果与校验完整表达式一致"""
+        if template is not None and kwargs is not None:
+            reason = self.check_template(template, kwargs)
+        else:
+            reason = self.check_expression(expression)
+        if reason:
+            self.stats[reason] += 1
+        return reason
+
+    def validate(self, expression: str) -> bool:
+        return self.reject_reason(expression) is None
@@ -1,9 +1,7 @@
-from asyncio import sleep
+from typing import Optional
 
-from sqlalchemy import func
 from sqlalchemy.orm import Session
 from wqb import (
-    URL_ALPHAS_ALPHAID,
     Alpha,
     FilterRange,
     WQBSession,
@@ -20,8 +18,10 @@ from app.crud import (
 )
 from config import settings
 
+from .pnl_fetcher import PnlFetcher
+from .pnl_store import PnlStore
+
 db = sync_session()
-URL_ALPHAS_ALPHA_PNL = URL_ALPHAS_ALPHAID + "/recordsets/pnl"
 URL_PYRAMIDS_ALPHA = (
     "https://api.worldquantbrain.com/users/self/activities/pyramid-alphas"
 )
@@ -47,6 +47,7 @@ class WorldQuantClient:
         for d in data:
             quants_wqb_operator_handler.create_on_duplicate_update(db, obj_in=d)
         db.commit()
+        quants_wqb_alpha_handler.operator_defaults(db, refresh=True)
 
     def fetch_all_dataset_field(self, db: Session):
         universes = quants_wqb_universe_handler.search(db, q={})
@@ -92,14 +93,16 @@ class WorldQuantClient:
         resp = await self.wqb.simulate(target=expression)
         return resp
 
-    async def simulate_by_db(self, db: Session, conurrency: int = 1):
-        alphas = quants_wqb_alpha_handler.search(
-            db, q={"state": quants_wqb_alpha_handler.model.STATE_PENDING}
+    async def simulate_by_db(
+        self, db: Session, conurrency: int = 1, screened: bool = False
+    ):
+        """screened=True 时只提交通过本地预筛的 alpha，未预筛的保持待回测"""
+        model = quants_wqb_alpha_handler.model
+        state = model.STATE_SCREENED if screened else model.STATE_PENDING
+        alphas = quants_wqb_alpha_handler.search(db, q={"state": state})
+        db.query(model).filter(model.state == state).update(
+            {"state": model.STATE_SIMULATING}
         )
-        db.query(quants_wqb_alpha_handler.model).filter(
-            quants_wqb_alpha_handler.model.state
-            == quants_wqb_alpha_handler.model.STATE_PENDING
-        ).update({"state": quants_wqb_alpha_handler.model.STATE_SIMULATING})
         db.commit()
         print(f"Total to simulate alphas: {len(alphas)}")
         target = {}
@@ -122,31 +125,9 @@ class WorldQuantClient:
                 quants_wqb_alpha_handler.create_or_update_by_wqb_data(db, data=data)
             db.commit()
 
-    async def fetch_alpha_pnl(self, db: Session):
-        alphas = (
-            db.query(quants_wqb_alpha_handler.model)
-            .filter(quants_wqb_alpha_handler.model.wqb_pnl_data == func.json_object())
-            .all()
-        )
-        for alpha in alphas:
-            resp = self.wqb.request(
-                "get", URL_ALPHAS_ALPHA_PNL.format(alpha.wqb_alpha_id)
-            )
-            if resp.status_code == 200:
-                try:
-                    alpha.wqb_pnl_data = resp.json()
-                    quants_wqb_alpha_handler.update(
-                        db, obj_in={"id": alpha.id, "wqb_pnl_data": alpha.wqb_pnl_data}
-                    )
-                    print(f"Updated PnL for Alpha ID: {alpha.wqb_alpha_id}")
-                    db.commit()
-                except Exception as e:
-                    print(
-                        f"Failed to update PnL for Alpha ID: {alpha.wqb_alpha_id}, Error: {e} content: {resp.content}"
-                    )
-                    self.wqb.auth_request()
-                    await sleep(120)
-            await sleep(10)  # 避免请求过快
+    async def fetch_alpha_pnl(self, db: Session, store: Optional[PnlStore] = None):
+        """并发抓取未抓取 PnL 的 alpha，存入本地列式 PnL 库，数据库只更新 pnl_state"""
+        await PnlFetcher(self.wqb, store).run(db)
 
     def get_pyramids_alpha_info(self) -> dict:
         resp = self.wqb.request("get", URL_PYRAMIDS_ALPHA)
@@ -18,6 +18,10 @@ class Settings(BaseSettings):
     MYSQL: MySQLConfig = MySQLConfig()
     Q_ACCOUNT: str = ""
     Q_PASSWORD: str = ""
+    DATA_DIR: str = "data"
+    # PnL 抓取的每秒请求数与同时在途的请求数
+    WQB_PNL_RATE: float = 2.0
+    WQB_PNL_CONCURRENCY: int = 8
 
     class Config:
         env_file = ".env"
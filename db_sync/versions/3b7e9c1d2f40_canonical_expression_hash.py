@@ -0,0 +1,28 @@
+"""canonical expression hash
+
+Revision ID: 3b7e9c1d2f40
+Revises: 6bd1af41fcfe
+Create Date: 2025-11-02 10:12:31.204517
+
+哈希重算依赖当前的表达式规范化逻辑，迁移里不引用业务代码，
+升级后执行 `python scripts/run.py -s rehash`，降级前执行 `-s rehash --legacy`；
+库中还有旧版哈希时 AlphaIngestor 会拒绝写入
+"""
+
+from typing import Sequence, Union
+
+# revision identifiers, used by Alembic.
+revision: str = "3b7e9c1d2f40"
+down_revision: Union[str, Sequence[str], None] = "6bd1af41fcfe"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    pass
@@ -0,0 +1,83 @@
+"""本地求值引擎的离线基准测试，不连接数据库与 WQB
+
+python scripts/benchmark.py -o bench/$(git rev-parse --short HEAD).json
+python scripts/benchmark.py --compare bench/old.json -o bench/new.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+try:
+    base = Path(__file__).resolve().parent
+except NameError:
+    base = Path.cwd()
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(base)))
+
+from app.services.quants.local.benchmark import (  # noqa: E402
+    Benchmark,
+    compare,
+    write_result,
+)
+from app.services.quants.local.panel import PANEL_DIR, PanelStore  # noqa: E402
+
+parser = argparse.ArgumentParser(description="本地求值引擎基准测试")
+parser.add_argument(
+    "-o", type=str, default="benchmark.json", help="结果文件，默认: benchmark.json"
+)
+parser.add_argument(
+    "--panel-dir",
+    type=str,
+    default=str(PANEL_DIR.parent / "benchmark_panel"),
+    help="合成面板目录，形状与字段一致时复用",
+)
+parser.add_argument("--dates", type=int, default=2500, help="交易日数，默认: 2500")
+parser.add_argument("--instruments", type=int, default=3000, help="股票数，默认: 3000")
+parser.add_argument("--repeat", type=int, default=3, help="操作符重复次数，默认: 3")
+parser.add_argument(
+    "--fields-per-template",
+    type=int,
+    default=2,
+    help="每个一阶模板代入的字段数，默认: 2",
+)
+parser.add_argument(
+    "--second-order", type=int, default=50, help="抽取的二阶表达式数，默认: 50"
+)
+parser.add_argument("-p", type=int, default=1, help="批量评估的进程数，默认: 1")
+parser.add_argument("--seed", type=int, default=0, help="合成面板的随机种子，默认: 0")
+parser.add_argument("--compare", type=str, default=None, help="与之对比的旧结果文件")
+
+
+def main():
+    args = parser.parse_args()
+    result = Benchmark(
+        PanelStore(args.panel_dir),
+        n_dates=args.dates,
+        n_instruments=args.instruments,
+        repeat=args.repeat,
+        fields_per_template=args.fields_per_template,
+        second_order_limit=args.second_order,
+        processes=args.p,
+        seed=args.seed,
+    ).run()
+    write_result(result, Path(args.o))
+    for row in result["operators"]:
+        print(
+            f"{row['name']:<24} {row['seconds'] * 1000:9.1f} ms "
+            f"{row['cells_per_second'] / 1e6:9.1f} Mcells/s "
+            f"{row['peak_rss_delta_mb']:+8.0f} MB"
+        )
+    print(f"latency: {result['latency']}")
+    print(f"batch: {result['batch']}")
+    print(f"Result written to {args.o}")
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        for name, old_s, new_s, ratio in compare(old, result):
+            print(f"{name:<24} {old_s:9.4f}s -> {new_s:9.4f}s  x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,23 @@ except NameError:
 sys.path.insert(0, os.path.abspath(os.path.dirname(base)))
 
 
+from app.crud import quants_wqb_alpha_handler  # noqa: E402
+from app.services.quants.correlation import SelfCorrelationChecker  # noqa: E402
+from app.services.quants.hash_index import (  # noqa: E402
+    persistent_hash_index,
+    reset_persistent_hash_index,
+)
+from app.services.quants.local.cache import NodeCache  # noqa: E402
+from app.services.quants.local.panel import (  # noqa: E402
+    PanelStore,
+    write_synthetic_panel,
+)
+from app.services.quants.pnl_store import migrate_json_pnl  # noqa: E402
+from app.services.quants.prescreen import PreScreener  # noqa: E402
+from app.services.quants.strategy.evolution import EvolutionStrategy  # noqa: E402
+from app.services.quants.strategy.settings_sweep import (  # noqa: E402
+    SettingsSweepStrategy,
+)
 from app.services.quants.strategy.three_level import ThreeLevelStrategy  # noqa: E402
 from app.services.quants.worldbrain import db, wqb_client  # noqa: E402
 
@@ -38,7 +55,15 @@ parser = argparse.ArgumentParser(description="wqb量化因子同步脚本")
 
 # 2. 定义参数
 parser.add_argument(
-    "-s", type=str, help="指令代码: g-生成一阶因子, s-回测同步数据, f-抓取同步信息"
+    "-s",
+    type=str,
+    help=(
+        "指令代码: g1/g2/g3-生成一/二/三阶因子, sw-参数网格扫描, ev-进化搜索, "
+        "ps-本地预筛待回测因子, s-回测同步数据, f-抓取同步信息, "
+        "idx-同步表达式哈希索引, syn-生成合成面板数据, "
+        "pm-把 JSON 收益数据迁移到本地 PnL 库, pnl-并发抓取因子收益数据, "
+        "sc-PnL 自相关检查, rehash-按当前规范化逻辑重算表达式哈希"
+    ),
 )
 parser.add_argument(
     "-t", type=str, default="3,5,6", help="模板ID列表，逗号分隔，默认: 3,5,6"
@@ -46,6 +71,29 @@ parser.add_argument(
 parser.add_argument(
     "-b", type=int, default=500, help="每次批量生成的因子数量，默认: 500"
 )
+parser.add_argument(
+    "-p", type=int, default=1, help="并行展开模板 / 本地预筛的进程数，默认: 1"
+)
+parser.add_argument(
+    "-c", type=int, default=1000, help="批量写入数据库的分块大小，默认: 1000"
+)
+parser.add_argument(
+    "--seed", type=int, default=None, help="参数网格扫描 / 进化搜索的随机种子，默认随机"
+)
+parser.add_argument(
+    "--no-resume", action="store_true", help="不从上次中断的生成游标续跑"
+)
+parser.add_argument(
+    "--screened", action="store_true", help="回测时只提交通过本地预筛的因子"
+)
+parser.add_argument(
+    "--legacy", action="store_true", help="rehash 时退回 v1 字符串哈希（降级前执行）"
+)
+parser.add_argument(
+    "--vec-best",
+    action="store_true",
+    help="生成一阶因子时按本地面板回测为向量字段选择最优归约，默认 vec_avg",
+)
 
 
 async def main():
@@ -54,6 +102,10 @@ async def main():
         template_ids=tuple(int(i) for i in args.t.split(",")),
         regions=["GLB", "ASI", "EUR", "USA"],
         batch_size=args.b,
+        insert_chunk_size=args.c,
+        processes=args.p,
+        resume=not args.no_resume,
+        best_vector_reduction=args.vec_best,
     )
     if args.s == "g1":
         strategy.generate_first_level_alpha(db)
@@ -61,13 +113,41 @@ async def main():
         strategy.generate_second_level_alpha(db)
     elif args.s == "g3":
         strategy.generate_third_level_alpha(db)
+    elif args.s == "sw":
+        SettingsSweepStrategy(
+            budget=args.b, insert_chunk_size=args.c, seed=args.seed
+        ).run(db)
+    elif args.s == "ev":
+        EvolutionStrategy(budget=args.b, insert_chunk_size=args.c, seed=args.seed).run(
+            db
+        )
+    elif args.s == "ps":
+        PreScreener(batch_size=args.b, processes=args.p, cache=NodeCache()).run(db)
     elif args.s == "s":
-        await wqb_client.simulate_by_db(db, conurrency=5)
+        await wqb_client.simulate_by_db(db, conurrency=5, screened=args.screened)
     elif args.s == "f":
         wqb_client.fetch_simulate_alpha(
             db,
             date_created=FilterRange.from_str(f"[{iso_with_tz(1)},{iso_with_tz(-1)})"),
         )
+    elif args.s == "idx":
+        index = persistent_hash_index(db)
+        print(f"Hash index synced to alpha id {index.bloom.synced_id}")
+    elif args.s == "syn":
+        panel = write_synthetic_panel(PanelStore(), seed=args.seed or 0)
+        print(f"Synthetic panel {panel.key} written to {panel.path}")
+    elif args.s == "pm":
+        migrate_json_pnl(db)
+    elif args.s == "pnl":
+        await wqb_client.fetch_alpha_pnl(db)
+    elif args.s == "sc":
+        SelfCorrelationChecker().run(db)
+    elif args.s == "rehash":
+        n = quants_wqb_alpha_handler.rehash_expressions(db, legacy=args.legacy)
+        db.commit()
+        # 索引只按 id 增量同步，原地改写的哈希需要全量重建
+        reset_persistent_hash_index()
+        print(f"Rehashed {n} alphas")
     db.commit()
 
 
@@ -0,0 +1,9 @@
+import pytest
+
+from app.services.quants.local.panel import PanelStore, write_synthetic_panel
+
+
+@pytest.fixture(scope="session")
+def synthetic_panel(tmp_path_factory):
+    store = PanelStore(tmp_path_factory.mktemp("panel"))
+    return write_synthetic_panel(store, n_dates=120, n_instruments=60, seed=0)
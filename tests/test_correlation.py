@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.services.quants.correlation import (
+    daily_returns,
+    max_correlation,
+    pairwise_correlation,
+    standardize,
+)
+
+
+def random_returns(rng, n, days, missing=0.3):
+    returns = rng.normal(size=(n, days)).astype(np.float32)
+    returns[:, : days // 2] += rng.normal(size=(n, 1)) * returns[0, : days // 2]
+    returns[rng.random((n, days)) < missing] = np.nan
+    return returns
+
+
+def overlap_corrcoef(a, b, min_overlap):
+    both = ~np.isnan(a) & ~np.isnan(b)
+    if both.sum() < min_overlap or np.std(a[both]) == 0 or np.std(b[both]) == 0:
+        return np.nan
+    return np.corrcoef(a[both], b[both])[0, 1]
+
+
+def test_daily_returns():
+    cumulative = np.array([[0, 1, np.nan, 4, 6]], dtype=np.float32)
+    out = daily_returns(cumulative)
+    np.testing.assert_array_equal(np.isnan(out[0]), [True, False, True, True, False])
+    assert out[0, 1] == 1 and out[0, 4] == 2
+
+
+def test_standardize_keeps_missing_and_drops_flat_rows():
+    returns = np.array(
+        [[1, np.nan, 3, 5], [2, 2, 2, np.nan], [np.nan, 1, np.nan, np.nan]],
+        dtype=np.float32,
+    )
+    z = standardize(returns)
+    assert np.isnan(z[0, 1]) and abs(np.nanmean(z[0])) < 1e-6
+    assert np.isnan(z[1:]).all()
+
+
+def test_pairwise_matches_corrcoef_on_overlap():
+    rng = np.random.default_rng(0)
+    left, right = random_returns(rng, 12, 80), random_returns(rng, 9, 80)
+    right[0, :70] = np.nan
+    corr = pairwise_correlation(standardize(left), standardize(right), min_overlap=20)
+    expected = np.array(
+        [[overlap_corrcoef(a, b, 20) for b in right] for a in left], dtype=np.float64
+    )
+    np.testing.assert_array_equal(np.isnan(corr), np.isnan(expected))
+    assert np.isnan(corr[:, 0]).all()
+    np.testing.assert_allclose(corr, expected, atol=1e-5)
+
+
+def test_max_correlation_blocks_and_self_exclusion():
+    rng = np.random.default_rng(1)
+    returns = standardize(random_returns(rng, 30, 60))
+    ids = list(range(100, 130))
+    cand, acc = returns[:20], returns[10:]
+    best, peer = max_correlation(cand, acc, ids[:20], ids[10:], block_size=7)
+    corr = pairwise_correlation(cand, acc)
+    for k in range(20):
+        row = corr[k].copy()
+        if k >= 10:
+            # 候选与自己比较的一对被排除
+            row[k - 10] = np.nan
+        assert peer[k] == np.nanargmax(row)
+        assert best[k] == pytest.approx(row[peer[k]], abs=1e-5)
+
+
+def test_max_correlation_without_peers():
+    rng = np.random.default_rng(2)
+    cand = standardize(random_returns(rng, 3, 40))
+    best, peer = max_correlation(cand, cand[:0], [1, 2, 3], [])
+    assert np.isnan(best).all() and (peer == -1).all()
+    best, peer = max_correlation(cand[:1], cand[:1], [1], [1])
+    assert np.isnan(best[0]) and peer[0] == -1
@@ -0,0 +1,43 @@
+import numpy as np
+
+from app.services.quants.local.cache import NodeCache
+from app.services.quants.local.evaluator import DagEvaluator, compile_expressions
+
+EXPRESSIONS = [
+    "rank(ts_mean(close, 5))",
+    "ts_mean(close, 5.0) - ts_mean(volume, 5)",
+    "group_rank(ts_delta(close, 3), sector)",
+    "x = ts_mean(close, 5); zscore(x) * -1",
+    "ts_corr(close, volume, 10) > 0 ? returns : -returns",
+]
+
+
+def test_common_subexpressions_are_shared():
+    dag = compile_expressions(EXPRESSIONS)
+    ts_means = [n for n in dag.nodes if n.op == "ts_mean"]
+    # ts_mean(close, 5) 在三个表达式中出现，只保留一个节点
+    assert len(ts_means) == 2
+    assert len({dag.roots[0], dag.roots[1]}) == 2
+
+
+def test_batch_matches_single(synthetic_panel):
+    batch = DagEvaluator(synthetic_panel).evaluate(EXPRESSIONS)
+    for expression, value in zip(EXPRESSIONS, batch):
+        (single,) = DagEvaluator(synthetic_panel).evaluate([expression])
+        np.testing.assert_array_equal(value, single)
+
+
+def test_compile_error_is_reported_per_expression(synthetic_panel):
+    results = DagEvaluator(synthetic_panel).evaluate(["rank(close)", "rank("])
+    assert isinstance(results[0], np.ndarray)
+    assert not isinstance(results[1], np.ndarray)
+
+
+def test_node_cache_reuse(synthetic_panel, tmp_path):
+    cache = NodeCache(tmp_path)
+    first = DagEvaluator(synthetic_panel, cache=cache).evaluate(EXPRESSIONS)
+    assert cache.hits == 0
+    second = DagEvaluator(synthetic_panel, cache=cache).evaluate(EXPRESSIONS)
+    assert cache.hits > 0
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,23 @@
+import random
+
+from app.common.expression import iter_names, parse_expression, to_source
+from app.services.quants.evolution import ExpressionMutator, field_names
+
+COUNTRY_GROUPED = (
+    "group_rank(ts_mean(close, 5), group_cartesian_product(country, industry))"
+)
+
+
+def test_field_names_skip_group_fields_and_unparsable():
+    expressions = [COUNTRY_GROUPED, "x = volume; rank(x)", "rank("]
+    assert field_names(expressions) == ["close", "volume"]
+
+
+def test_swap_field_keeps_group_fields():
+    mutator = ExpressionMutator(["open", "vwap"], random.Random(0))
+    program = parse_expression(COUNTRY_GROUPED)
+    for _ in range(20):
+        mutated = mutator.swap_field(program)
+        names = set(iter_names(mutated))
+        assert {"country", "industry"} <= names, to_source(mutated)
+        assert "close" not in names
@@ -0,0 +1,40 @@
+from app.services.quants.local.executor import BatchScorer, Candidate
+
+SETTINGS = {
+    "region": "USA",
+    "delay": 1,
+    "universe": "TOP3000",
+    "nanHandling": "ON",
+    "truncation": 0.05,
+    "pasteurization": "ON",
+    "decay": 5,
+    "neutralization": "SUBINDUSTRY",
+}
+EXPRESSIONS = [
+    "rank(ts_mean(close, 5))",
+    "-ts_delta(close, 3)",
+    "group_rank(ts_delta(close, 3), sector)",
+    "zscore(ts_std_dev(returns, 10))",
+    "rank(",
+    "ts_corr(close, volume, 10)",
+]
+
+
+def scored(panel, processes):
+    candidates = [Candidate(e, SETTINGS) for e in EXPRESSIONS]
+    candidates += [
+        Candidate(e, {**SETTINGS, "nanHandling": "OFF", "neutralization": "SECTOR"})
+        for e in EXPRESSIONS
+    ]
+    scorer = BatchScorer(panel, processes=processes, chunk_size=3)
+    return sorted(scorer.score(candidates))
+
+
+def test_processes_match_single_process(synthetic_panel):
+    single = scored(synthetic_panel, 1)
+    pooled = scored(synthetic_panel, 2)
+    assert [row.index for row in single] == list(range(2 * len(EXPRESSIONS)))
+    # 多进程共享数组后逐行指标完全一致
+    assert pooled == single
+    assert single[4].error.startswith("evaluate:")
+    assert not single[0].error and single[0].metrics
@@ -0,0 +1,95 @@
+import pytest
+
+from app.common.expression import (
+    Call,
+    ExpressionSyntaxError,
+    Name,
+    Num,
+    canonical_expression,
+    parse_expression,
+    to_source,
+)
+
+ROUND_TRIP = [
+    "rank(close)",
+    "a+b*c",
+    "(a+b)*c",
+    "a-(b-c)",
+    "-a^2",
+    "(-a)^2",
+    "a^b^c",
+    "c>1?a:b",
+    "c>1&&d<2||!e",
+    "ts_decay_linear(x,10,dense=false)",
+    'group_cartesian_product(country,"sector")',
+    "x=ts_mean(close,5);y=rank(x);-y",
+    "1e3+0.5*.25",
+]
+
+
+@pytest.mark.parametrize("expression", ROUND_TRIP)
+def test_round_trip(expression):
+    program = parse_expression(expression)
+    assert parse_expression(to_source(program)) == program
+
+
+def test_precedence():
+    call = parse_expression("a + b * c").result
+    assert call.op == "+"
+    assert call.left == Name("a")
+    assert call.right.op == "*"
+
+
+def test_call_arguments():
+    call = parse_expression("ts_rank(x, 20, constant = 1)").result
+    assert call == Call(
+        "ts_rank", (Name("x"), Num(20.0, "20")), (("constant", Num(1.0, "1")),)
+    )
+
+
+def test_parse_cache_returns_same_tree():
+    assert parse_expression("rank(close)") is parse_expression("rank(close)")
+
+
+@pytest.mark.parametrize("expression", ["rank(", "a +", "add(a,,b)", "a b"])
+def test_syntax_error(expression):
+    with pytest.raises(ExpressionSyntaxError):
+        parse_expression(expression)
+
+
+# generate_expression_hash 对规范化结果小写后再取 md5
+DEFAULTS = {"ts_decay_linear": {"dense": "false"}}
+
+EQUIVALENT = [
+    ("a + b", "b+a"),
+    ("a + b", "add(b, a)"),
+    ("add(add(a, b), c)", "add(a, add(c, b))"),
+    ("a * 2.0", "multiply(2, a)"),
+    ("1e3", "1000"),
+    ("a == b", "b == a"),
+    ("max(x, y)", "max(y, x)"),
+    ("ts_decay_linear(x, 10, dense=false)", "ts_decay_linear(x, 10)"),
+    ("rank( close )", "RANK(close)"),
+]
+
+DISTINCT = [
+    ("a - b", "b - a"),
+    ("divide(a, b)", "divide(b, a)"),
+    ("ts_corr(a, b, 5)", "ts_corr(a, b, 10)"),
+    ("ts_decay_linear(x, 10, dense=true)", "ts_decay_linear(x, 10)"),
+    ("c > 1 ? a : b", "c > 1 ? b : a"),
+]
+
+
+@pytest.mark.parametrize("left, right", EQUIVALENT)
+def test_canonical_equivalent(left, right):
+    assert canonical_expression(left, DEFAULTS).lower() == (
+        canonical_expression(right, DEFAULTS).lower()
+    )
+
+
+@pytest.mark.parametrize("left, right", DISTINCT)
+def test_canonical_distinct(left, right):
+    assert canonical_expression(left, DEFAULTS).lower() != (
+        canonical_expression(right, DEFAULTS).lower()
+    )
@@ -0,0 +1,32 @@
+import hashlib
+
+from app.services.quants.hash_index import ExpressionHashIndex, PersistentBloomFilter
+
+
+def expression_hash(text):
+    return "v2:" + hashlib.md5(text.encode()).hexdigest()
+
+
+def test_replaced_after_rebuild_or_unlink(tmp_path):
+    path = tmp_path / "index.bloom"
+    bloom = PersistentBloomFilter.create(path, 1000, hash_version=2)
+    assert not bloom.replaced() and bloom.hash_version == 2
+    rebuilt = PersistentBloomFilter.create(path, 2000, hash_version=2)
+    assert bloom.replaced() and not rebuilt.replaced()
+    path.unlink()
+    assert rebuilt.replaced()
+    bloom.close()
+    rebuilt.close()
+
+
+def test_pending_hashes_stay_out_of_the_file(tmp_path):
+    path = tmp_path / "index.bloom"
+    index = ExpressionHashIndex(bloom=PersistentBloomFilter.create(path, 1000))
+    h = expression_hash("rank(close)")
+    assert index.check_and_add(h)
+    assert not index.check_and_add(h)
+    # 未提交的哈希只在本进程的 pending 中，其他进程打开文件看不到
+    other = PersistentBloomFilter(path)
+    assert bytes.fromhex(h[-32:]) not in other
+    other.close()
+    index.bloom.close()
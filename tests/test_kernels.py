@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from app.services.quants.local.kernels import (
+    ts_corr,
+    ts_count_nans,
+    ts_decay_linear,
+    ts_delay,
+    ts_delta,
+    ts_mean,
+    ts_rank,
+    ts_std_dev,
+    ts_sum,
+    ts_zscore,
+)
+
+D = 5
+
+
+@pytest.fixture
+def panel():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(40, 6))
+    x[rng.random(x.shape) < 0.15] = np.nan
+    # 并列值，检验 ts_rank 的平均名次
+    x[10:20, 0] = np.round(x[10:20, 0])
+    return x
+
+
+def naive(x, d, nan_handling, func, min_count=1):
+    """逐个日期、逐只股票取窗口计算"""
+    out = np.full(x.shape, np.nan)
+    for t in range(len(x)):
+        for j in range(x.shape[1]):
+            window = x[max(0, t - d + 1) : t + 1, j]
+            values = window[~np.isnan(window)]
+            if len(values) < (min_count if nan_handling else d):
+                continue
+            out[t, j] = func(values, window, x[t, j])
+    return out
+
+
+def decay(values, window, current):
+    weights = np.arange(D - len(window) + 1, D + 1)[~np.isnan(window)]
+    return np.dot(values, weights) / weights.sum()
+
+
+def zscore(values, window, current):
+    std = values.std()
+    return (current - values.mean()) / std if std > 0 else np.nan
+
+
+def rank(values, window, current):
+    if np.isnan(current):
+        return np.nan
+    if len(values) == 1:
+        return 0.5
+    less = (values < current).sum()
+    equal = (values == current).sum()
+    return (less + (equal - 1) / 2) / (len(values) - 1)
+
+
+CASES = [
+    (ts_sum, lambda v, w, c: v.sum(), 1),
+    (ts_mean, lambda v, w, c: v.mean(), 1),
+    (ts_std_dev, lambda v, w, c: v.std(), 2),
+    (ts_zscore, zscore, 2),
+    (ts_decay_linear, decay, 1),
+    (ts_rank, rank, 1),
+]
+
+
+@pytest.mark.parametrize("nan_handling", [True, False])
+@pytest.mark.parametrize("kernel, func, min_count", CASES)
+def test_rolling_kernels(panel, kernel, func, min_count, nan_handling):
+    expected = naive(panel, D, nan_handling, func, min_count)
+    if kernel is ts_zscore:
+        # 当天为 NaN 时没有 zscore
+        expected[np.isnan(panel)] = np.nan
+    actual = kernel(panel, D, nan_handling=nan_handling)
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_ts_rank_constant(panel):
+    np.testing.assert_allclose(
+        ts_rank(panel, D, constant=1), ts_rank(panel, D) + 1, equal_nan=True
+    )
+
+
+def test_ts_corr(panel):
+    rng = np.random.default_rng(1)
+    y = panel * 0.5 + rng.normal(size=panel.shape)
+    y[rng.random(y.shape) < 0.1] = np.nan
+    expected = np.full(panel.shape, np.nan)
+    for t in range(len(panel)):
+        for j in range(panel.shape[1]):
+            a = panel[max(0, t - D + 1) : t + 1, j]
+            b = y[max(0, t - D + 1) : t + 1, j]
+            both = ~np.isnan(a) & ~np.isnan(b)
+            if both.sum() >= 2 and a[both].std() > 0 and b[both].std() > 0:
+                expected[t, j] = np.corrcoef(a[both], b[both])[0, 1]
+    np.testing.assert_allclose(ts_corr(panel, y, D), expected, atol=1e-9)
+
+
+def test_shift_kernels(panel):
+    expected_delay = np.full(panel.shape, np.nan)
+    expected_delay[D:] = panel[:-D]
+    np.testing.assert_array_equal(ts_delay(panel, D), expected_delay)
+    np.testing.assert_array_equal(ts_delta(panel, D), panel - expected_delay)
+    counts = naive(
+        np.isnan(panel).astype(float), D, True, lambda v, w, c: v.sum(), min_count=0
+    )
+    np.testing.assert_array_equal(ts_count_nans(panel, D), counts)
+
+
+def test_float32_output_dtype(panel):
+    assert ts_mean(panel.astype(np.float32), D).dtype == np.float32
+    assert ts_mean(panel.astype(np.float32), D, dtype=np.float64).dtype == np.float64
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from app.services.quants.pnl_fetcher import PnlFetcher
+
+PNL = {
+    "schema": {"properties": [{"name": "date"}, {"name": "pnl"}]},
+    "records": [["2015-01-02", 0.0], ["2015-01-05", 1.5]],
+}
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.data = data
+        self.content = b"{}" if data is not None else b""
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """登录前一律 401；登录后每个 URL 先 429 一次再返回 PnL"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.authed = False
+        self.auth_calls = 0
+        self.calls = []
+        self.throttled = set()
+
+    def auth_request(self):
+        with self.lock:
+            self.auth_calls += 1
+            self.authed = True
+
+    def request(self, method, url, *, expected=None, max_tries=None):
+        # 自带的重试必须关掉，否则 401/429 在线程里被悄悄重试
+        assert max_tries == 1 and expected(FakeResponse(429))
+        with self.lock:
+            self.calls.append(url)
+            if not self.authed:
+                return FakeResponse(401)
+            if url not in self.throttled:
+                self.throttled.add(url)
+                return FakeResponse(429, headers={"Retry-After": "0"})
+        return FakeResponse(200, PNL)
+
+
+def test_fetch_reauths_once_and_throttles():
+    session = FakeSession()
+    fetcher = PnlFetcher(session, store=object(), rate=100.0, concurrency=4)
+    alphas = [SimpleNamespace(wqb_alpha_id=f"a{i}") for i in range(4)]
+    results = asyncio.run(fetcher.fetch_batch(alphas))
+    assert [r.data for r in results] == [PNL] * 4
+    assert session.auth_calls == 1
+    assert fetcher.throttled == 4
+    assert fetcher.bucket.paused_until > 0
+    assert fetcher.bucket.rate < fetcher.bucket.max_rate
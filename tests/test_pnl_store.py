@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from app.services.quants.pnl_store import PnlStore, parse_pnl_recordset
+
+START = np.datetime64("2015-01-02", "D")
+DATES = np.array(["2015-01-02", "2015-01-05", "2015-01-07"], dtype="datetime64[D]")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PnlStore(tmp_path, START, n_days=40)
+
+
+def values(store, alpha_id):
+    return store.get(alpha_id)[store.day_index(DATES)]
+
+
+def test_parse_recordset_skips_missing_pnl():
+    data = {
+        "schema": {"properties": [{"name": "date"}, {"name": "pnl"}]},
+        "records": [["2015-01-02", 0.0], ["2015-01-05", None], ["2015-01-06", 3.5]],
+    }
+    dates, pnl = parse_pnl_recordset(data)
+    assert dates.tolist() == np.array(["2015-01-02", "2015-01-06"], "M8[D]").tolist()
+    assert pnl.tolist() == [0.0, 3.5]
+
+
+def test_put_many_and_reload(store):
+    assert store.put_many([(7, DATES, [1, 2, 3]), (8, DATES, [4, 5, 6])]) == 2
+    assert store.put_many([]) == 0
+    reopened = PnlStore(store.root, START, n_days=40)
+    assert len(reopened) == 2 and 8 in reopened and 9 not in reopened
+    np.testing.assert_array_equal(values(reopened, 8), [4, 5, 6])
+    # 日期轴上没有数据的位置为 NaN
+    assert np.isnan(reopened.get(7)).sum() == 40 - len(DATES)
+    ids, matrix = reopened.load([8, 99, 7])
+    assert ids == [8, 7] and matrix.shape == (2, 40)
+
+
+def test_out_of_range_dates_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.put(1, np.array(["2014-12-31"], dtype="datetime64[D]"), [1.0])
+
+
+def test_uncommitted_rows_are_truncated(store):
+    store.put(7, DATES, [1, 2, 3])
+    # 模拟写完矩阵行、未写 ID 就退出
+    with open(store.data_path(0), "ab") as f:
+        f.write(b"\1" * (store.row_bytes * 2 + 10))
+    store.put(8, DATES, [4, 5, 6])
+    assert store.data_path(0).stat().st_size == 2 * store.row_bytes
+    np.testing.assert_array_equal(values(store, 8), [4, 5, 6])
+
+
+def test_overwrite_then_compact(store):
+    store.put_many([(7, DATES, [1, 2, 3]), (8, DATES, [4, 5, 6])])
+    store.put(7, DATES, [7, 8, 9])
+    assert len(store) == 2 and store.garbage() == 1
+    np.testing.assert_array_equal(values(store, 7), [7, 8, 9])
+    old = store.matrix()
+    store.compact()
+    assert store.generation() == 1 and store.garbage() == 0
+    assert not store.data_path(0).exists()
+    # 已打开的旧 mmap 仍可读
+    assert old.shape == (3, 40)
+    reopened = PnlStore(store.root, START, n_days=40)
+    assert reopened.ids().tolist() == [7, 8]
+    np.testing.assert_array_equal(values(reopened, 7), [7, 8, 9])
+    # 其他实例在换代后继续写入新一代文件
+    store.put(9, DATES, [0, 0, 0])
+    assert reopened.ids().tolist() == [7, 8, 9]
@@ -0,0 +1,16 @@
+import numpy as np
+
+from app.services.quants.local.simulator import metrics
+
+
+def test_turnover_averages_all_days_after_warm_up():
+    # 5 天预热，之后每 5 天在两组持仓间切换一次
+    weights = np.zeros((45, 4))
+    for k, start in enumerate(range(5, 45, 5)):
+        weights[start : start + 5] = [0.5, -0.5, 0, 0] if k % 2 else [0, 0, 0.5, -0.5]
+    turnover_days = np.abs(np.diff(weights, axis=0)).sum(axis=1)
+    daily = np.random.default_rng(0).normal(0.001, 0.01, 39)
+    result = metrics(daily, turnover_days, weights)
+    # 建仓 1.0，之后 7 次换仓各 2.0，共 40 个交易日
+    assert result.turnover == (1.0 + 7 * 2.0) / 40
+    assert result.long_count == 1 and result.short_count == 1